@@ -6,11 +6,19 @@ from typing import List, Optional
 from app.settings import Settings
 from domain.ports import KlineRepo, Cache
 from infra.observability.logging import configure_logging
+from infra.observability.metrics import record_klines_cache, register_cache
 from infra.db.sqlite_repo import SqliteKlineRepo, ensure_schema as ensure_sqlite_schema
 from infra.db.postgres_repo import PostgresKlineRepo, ensure_schema as ensure_pg_schema
+from infra.db.segment_repo import SegmentKlineRepo
+from infra.db.sqlite_shards import ShardedSqliteKlineRepo
 from infra.cache.lru_cache import LRUCache
+from infra.cache.warmer import CacheWarmer, HotKeys
+from infra.serialization import RowFragmentCache, response_compressors, serialize_columnar_rows
+from infra.cache.versions import LocalDataVersions, RedisDataVersions
+from infra.db.versioned_repo import VersionedKlineRepo
 from infra.agg.ring_buffer import RingBuffer
-from domain.usecases import GetKlines, HealthSnapshot
+from infra.agg.bar_hub import BarHub
+from domain.usecases import ExportKlines, GetKlines, HealthSnapshot
 from infra.fetch.fetcher_impl import Fetcher
 from infra.agg.aggregator_impl import Aggregator
 
@@ -20,8 +28,12 @@ class AppState:
     kline_repo: KlineRepo
     l1_cache: Cache
     ring_buffer: RingBuffer
+    bar_hub: BarHub
     use_get_klines: GetKlines
     use_health: HealthSnapshot
+    use_export: ExportKlines
+    hot_keys: HotKeys
+    warmer: CacheWarmer
     fetcher: Optional[Fetcher] = None
     aggregator: Optional[Aggregator] = None
     tasks: List[asyncio.Task] = field(default_factory=list)
@@ -32,30 +44,89 @@ async def build_app_state() -> AppState:
     configure_logging(settings.log_level)
 
     if settings.db_url.startswith("postgres"):
-        kline_repo = PostgresKlineRepo(settings.db_url, pool_size=settings.db_pool_size)
+        kline_repo = PostgresKlineRepo(
+            settings.db_url,
+            pool_size=settings.db_pool_size,
+            copy_threshold=settings.pg_copy_threshold,
+        )
         await ensure_pg_schema(settings.db_url)
     else:
-        kline_repo = SqliteKlineRepo(settings.db_url, pool_size=settings.db_pool_size)
-        await ensure_sqlite_schema(settings.db_url)
+        # "segments+sqlite:///..." keeps sealed months in SEGMENT_DIR and the tail in sqlite
+        sqlite_url = settings.db_url.removeprefix("segments+")
+        sqlite_opts = dict(
+            write_batch_rows=settings.db_write_batch_rows,
+            write_latency_ms=settings.db_write_latency_ms,
+            mmap_size=settings.sqlite_mmap_size,
+            cache_size=settings.sqlite_cache_size,
+            temp_store=settings.sqlite_temp_store,
+        )
+        if settings.sqlite_shard_symbols > 1 or settings.sqlite_shard_by_month:
+            kline_repo = ShardedSqliteKlineRepo(
+                sqlite_url,
+                symbol_shards=settings.sqlite_shard_symbols,
+                by_month=settings.sqlite_shard_by_month,
+                pool_size=settings.sqlite_shard_pool_size,
+                max_open=settings.sqlite_shard_max_open,
+                **sqlite_opts,
+            )
+        else:
+            kline_repo = SqliteKlineRepo(sqlite_url, pool_size=settings.db_pool_size, **sqlite_opts)
+            await ensure_sqlite_schema(sqlite_url)
+        if sqlite_url != settings.db_url:
+            kline_repo = SegmentKlineRepo(
+                kline_repo, settings.segment_dir, seal_grace_days=settings.segment_seal_grace_days
+            )
     await kline_repo.connect()
 
     if settings.cache_url:
         from infra.cache.redis_cache import RedisCache
-        from infra.agg.redis_ring_buffer import RedisRingBuffer
-        l1_cache = RedisCache(settings.cache_url)
-        ring_buffer = RedisRingBuffer(settings.cache_url, capacity=5)
+        from infra.cache.tiered_cache import TieredCache
+        local = LRUCache(max_bytes=settings.cache_max_mb * 1024 * 1024)
+        register_cache("l1", local)
+        l1_cache = TieredCache(local, RedisCache(settings.cache_url))
+        versions = RedisDataVersions(settings.cache_url)
+        await versions.start()
     else:
-        l1_cache = LRUCache(max_items=10000)
-        ring_buffer = RingBuffer(capacity=5)
+        l1_cache = LRUCache(max_bytes=settings.cache_max_mb * 1024 * 1024)
+        register_cache("l1", l1_cache)
+        versions = LocalDataVersions()
+    ring_buffer = RingBuffer(capacity=settings.tail_capacity, max_series=settings.tail_max_series)
+    register_cache("tail", ring_buffer)
+    bar_hub = BarHub(queue_size=settings.push_queue_size)
+    kline_repo = VersionedKlineRepo(kline_repo, versions, tail=ring_buffer, on_commit=bar_hub.publish)
 
-    use_get_klines = GetKlines(kline_repo, l1_cache, ttl_s=settings.cache_ttl_sec_klines)
+    fragments = RowFragmentCache(max_bytes=settings.row_cache_max_mb * 1024 * 1024)
+    register_cache("rows", fragments)
+    use_get_klines = GetKlines(
+        kline_repo, l1_cache,
+        ttl_s=settings.cache_ttl_sec_klines,
+        versions=versions,
+        history_ttl_s=settings.cache_ttl_sec_history,
+        fill_lock_ms=settings.cache_fill_lock_ms,
+        on_event=record_klines_cache,
+        encode=fragments.encode,
+        tail=ring_buffer,
+        formats={"columnar": serialize_columnar_rows},
+        compressors=response_compressors(),
+        compress_min_bytes=settings.cache_compress_min_bytes,
+    )
     use_health = HealthSnapshot(kline_repo)
+    use_export = ExportKlines(kline_repo, chunk_rows=settings.export_chunk_rows)
+    hot_keys = HotKeys(
+        settings.hot_keys_path, top_k=settings.warm_top_k, half_life_s=settings.hot_keys_half_life_sec
+    )
+    hot_keys.load()
+    warmer = CacheWarmer(use_get_klines, hot_keys, concurrency=settings.warm_concurrency)
 
     return AppState(
         settings=settings,
         kline_repo=kline_repo,
         l1_cache=l1_cache,
         ring_buffer=ring_buffer,
+        bar_hub=bar_hub,
         use_get_klines=use_get_klines,
         use_health=use_health,
+        use_export=use_export,
+        hot_keys=hot_keys,
+        warmer=warmer,
     )
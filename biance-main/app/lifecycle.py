@@ -4,27 +4,41 @@ from typing import Callable
 from app.bootstrap import AppState
 from infra.fetch.fetcher_impl import Fetcher
 from infra.agg.aggregator_impl import Aggregator
+from infra.db.retention import RetentionJob
+from infra.db.segment_repo import SegmentStore
 
 logger = logging.getLogger(__name__)
 
 def on_startup(state: AppState) -> Callable[[], None]:
     async def _bg_runner():
         if not (state.settings.enable_fetcher or state.settings.enable_aggregator):
+            state.warmer.schedule()
             return
         state.fetcher = Fetcher(state.settings, state.kline_repo)
-        state.aggregator = Aggregator(state.kline_repo, ring=state.ring_buffer)
+        state.aggregator = Aggregator(state.kline_repo)
 
-        if state.settings.enable_fetcher:
-            await state.fetcher.initial_fetch_all(state.settings.symbols)
-        async def agg_all_symbols():
+        async def aggregate_all_symbols():
             sem = asyncio.Semaphore(5)
             async def _run(sym: str):
                 async with sem:
                     await state.aggregator.aggregate_all(sym)
             await asyncio.gather(*(_run(sym) for sym in state.settings.symbols))
 
-        if state.settings.enable_aggregator:
-            await agg_all_symbols()
+        async def agg_all_symbols():
+            await aggregate_all_symbols()
+            # new bars moved the versions of hot keys; refill them before clients ask
+            state.warmer.schedule()
+
+        try:
+            if state.settings.enable_fetcher:
+                await state.fetcher.initial_fetch_all(state.settings.symbols)
+            if state.settings.enable_aggregator:
+                await aggregate_all_symbols()
+        except Exception as e:
+            logger.exception("startup fetch/aggregation failed, the loops below retry it", exc_info=e)
+        # /v1/ready waits for the first warm pass: run it on the freshest data we could get,
+        # but always run it, or an exchange outage at boot would keep the node unready
+        state.warmer.schedule()
 
         async def loop_fetch():
             retry = 0
@@ -58,6 +72,28 @@ def on_startup(state: AppState) -> Callable[[], None]:
                     delay = min(2 ** retry, 60)
                     await asyncio.sleep(delay)
 
+        async def loop_seal():
+            while True:
+                try:
+                    sealed = await state.kline_repo.seal_completed_months()
+                    if sealed:
+                        logger.info("sealed %d rows into segments", sealed)
+                except Exception as e:
+                    logger.exception("segment sealing failed", exc_info=e)
+                await asyncio.sleep(max(60, state.settings.segment_seal_interval_sec))
+
+        async def loop_retention():
+            s = state.settings
+            archive = SegmentStore(s.retention_archive_dir) if s.retention_mode == "archive" else None
+            job = RetentionJob(state.kline_repo, s.retention_days, archive=archive,
+                               batch_rows=s.retention_batch_rows)
+            while True:
+                try:
+                    await job.run_once()
+                except Exception as e:
+                    logger.exception("retention pass failed", exc_info=e)
+                await asyncio.sleep(max(60, s.retention_interval_sec))
+
         async def start_loop(coro, name: str):
             while True:
                 try:
@@ -71,6 +107,10 @@ def on_startup(state: AppState) -> Callable[[], None]:
             state.tasks.append(asyncio.create_task(start_loop(loop_fetch, "fetch")))
         if state.settings.enable_aggregator:
             state.tasks.append(asyncio.create_task(start_loop(loop_agg, "agg")))
+        if any(days > 0 for days in state.settings.retention_days.values()):
+            state.tasks.append(asyncio.create_task(start_loop(loop_retention, "retention")))
+        if hasattr(state.kline_repo, "seal_completed_months"):
+            state.tasks.append(asyncio.create_task(start_loop(loop_seal, "seal")))
 
     def _start():
         task = asyncio.get_event_loop().create_task(_bg_runner())
@@ -88,7 +128,12 @@ def on_shutdown(state: AppState) -> Callable[[], None]:
                 pass
             except Exception as e:
                 logger.exception("task error during shutdown", exc_info=e)
+        await state.warmer.close()
         if state.fetcher is not None:
             await state.fetcher.aclose()
         await state.kline_repo.close()
+        for res in (state.l1_cache, state.use_get_klines.versions):
+            close = getattr(res, "close", None)
+            if close is not None:
+                await close()
     return _stop
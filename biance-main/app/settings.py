@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 try:
     from pydantic_settings import BaseSettings
 except Exception:  # pragma: no cover
@@ -19,12 +19,43 @@ class Settings(BaseSettings):
     symbol_sync_interval_sec: int = Field(default=300, alias="SYMBOL_SYNC_INTERVAL_SEC")
     quote_assets: List[str] = Field(default_factory=lambda: ["USDT"], alias="QUOTE_ASSETS")
     cache_ttl_sec_klines: int = Field(default=10, alias="CACHE_TTL_SEC_KLINES")
+    cache_ttl_sec_history: int = Field(default=21600, alias="CACHE_TTL_SEC_HISTORY")
+    cache_max_mb: int = Field(default=256, alias="CACHE_MAX_MB")
+    row_cache_max_mb: int = Field(default=32, alias="ROW_CACHE_MAX_MB")
+    cache_compress_min_bytes: int = Field(default=1024, alias="CACHE_COMPRESS_MIN_BYTES")
+    cache_fill_lock_ms: int = Field(default=2000, alias="CACHE_FILL_LOCK_MS")
     cache_url: Optional[str] = Field(default=None, alias="CACHE_URL")
+    tail_capacity: int = Field(default=1500, alias="TAIL_CAPACITY")
+    tail_max_series: int = Field(default=500, alias="TAIL_MAX_SERIES")
+    hot_keys_path: str = Field(default="data/hot_keys.json", alias="HOT_KEYS_PATH")
+    warm_top_k: int = Field(default=200, alias="WARM_TOP_K")
+    hot_keys_half_life_sec: int = Field(default=3600, alias="HOT_KEYS_HALF_LIFE_SEC")
+    warm_concurrency: int = Field(default=4, alias="WARM_CONCURRENCY")
+    push_queue_size: int = Field(default=256, alias="PUSH_QUEUE_SIZE")
+    export_chunk_rows: int = Field(default=5000, alias="EXPORT_CHUNK_ROWS")
 
     # --- new configuration fields ---
     log_level: str = Field("INFO", alias="LOG_LEVEL")
     db_url: str = Field("sqlite:///data/klines.db", alias="DB_URL")
     db_pool_size: int = Field(10, alias="DB_POOL_SIZE")
+    pg_copy_threshold: int = Field(500, alias="PG_COPY_THRESHOLD")
+    db_write_batch_rows: int = Field(20_000, alias="DB_WRITE_BATCH_ROWS")
+    db_write_latency_ms: int = Field(10, alias="DB_WRITE_LATENCY_MS")
+    sqlite_mmap_size: int = Field(256 * 1024 * 1024, alias="SQLITE_MMAP_SIZE")
+    sqlite_cache_size: int = Field(-16_384, alias="SQLITE_CACHE_SIZE")
+    sqlite_temp_store: str = Field("MEMORY", alias="SQLITE_TEMP_STORE")
+    sqlite_shard_symbols: int = Field(1, alias="SQLITE_SHARD_SYMBOLS")
+    sqlite_shard_by_month: bool = Field(False, alias="SQLITE_SHARD_BY_MONTH")
+    sqlite_shard_pool_size: int = Field(2, alias="SQLITE_SHARD_POOL_SIZE")
+    sqlite_shard_max_open: int = Field(32, alias="SQLITE_SHARD_MAX_OPEN")
+    segment_dir: str = Field("data/segments", alias="SEGMENT_DIR")
+    segment_seal_grace_days: int = Field(2, alias="SEGMENT_SEAL_GRACE_DAYS")
+    segment_seal_interval_sec: int = Field(3600, alias="SEGMENT_SEAL_INTERVAL_SEC")
+    retention_days: Dict[str, int] = Field(default_factory=dict, alias="RETENTION_DAYS")
+    retention_mode: str = Field("drop", alias="RETENTION_MODE")
+    retention_archive_dir: str = Field("data/archive", alias="RETENTION_ARCHIVE_DIR")
+    retention_batch_rows: int = Field(20_000, alias="RETENTION_BATCH_ROWS")
+    retention_interval_sec: int = Field(3600, alias="RETENTION_INTERVAL_SEC")
     binance_base: str = Field("https://fapi.binance.com", alias="BINANCE_BASE")
     enable_fetcher: bool = Field(True, alias="ENABLE_FETCHER")
     enable_aggregator: bool = Field(True, alias="ENABLE_AGGREGATOR")
@@ -1,9 +1,20 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Dict
 from enum import Enum
 
 class Interval(str, Enum):
     m1="1m"; m3="3m"; m5="5m"; m15="15m"; h1="1h"; h4="4h"; d1="1d"
 
+INTERVAL_MS = {
+    Interval.m1: 60_000,
+    Interval.m3: 180_000,
+    Interval.m5: 300_000,
+    Interval.m15: 900_000,
+    Interval.h1: 3_600_000,
+    Interval.h4: 14_400_000,
+    Interval.d1: 86_400_000,
+}
+
 @dataclass(frozen=True)
 class Bar:
     symbol: str
@@ -16,3 +27,59 @@ class Bar:
     taker_buy_base: float = 0.0
     taker_buy_quote: float = 0.0
     is_final: bool = True
+
+# Column order of the tuples returned by KlineRepo.query_raw: the Binance kline layout
+# with is_final in place of the trailing "ignore" field.
+RAW_COLUMNS = (
+    "open_time", "open", "high", "low", "close", "volume", "close_time",
+    "quote_volume", "trades", "taker_buy_base", "taker_buy_quote", "is_final",
+)
+
+def bar_from_raw(symbol: str, interval: Interval, r) -> Bar:
+    return Bar(
+        symbol=symbol, interval=interval, open_time=r[0],
+        open=r[1], high=r[2], low=r[3], close=r[4], volume=r[5],
+        close_time=r[6], quote_volume=r[7], trades=r[8],
+        taker_buy_base=r[9], taker_buy_quote=r[10], is_final=bool(r[11]),
+    )
+
+@dataclass(frozen=True)
+class Watermark:
+    """Stored coverage of one (symbol, interval) series."""
+    first_open_time: int
+    last_open_time: int
+    count: int
+
+@dataclass(frozen=True)
+class KlinePayload:
+    """A ready-to-send klines response body and its strong ETag, as cached by GetKlines.
+
+    ``encodings`` holds pre-compressed copies of ``body`` by content-coding ("gzip", "br").
+    """
+    body: bytes
+    etag: str
+    encodings: Dict[str, bytes] = field(default_factory=dict)
+
+    def pack(self) -> bytes:
+        tag = self.etag.encode()
+        out = [bytes((len(tag),)), tag, bytes((len(self.encodings),))]
+        for name, data in self.encodings.items():
+            out += [bytes((len(name),)), name.encode(), len(data).to_bytes(4, "little"), data]
+        out.append(self.body)
+        return b"".join(out)
+
+    @classmethod
+    def unpack(cls, data: bytes) -> "KlinePayload":
+        n = data[0]
+        etag = data[1:1 + n].decode()
+        count = data[1 + n]
+        pos = 2 + n
+        encodings = {}
+        for _ in range(count):
+            k = data[pos]
+            name = data[pos + 1:pos + 1 + k].decode()
+            size = int.from_bytes(data[pos + 1 + k:pos + 5 + k], "little")
+            pos += 5 + k
+            encodings[name] = data[pos:pos + size]
+            pos += size
+        return cls(data[pos:], etag, encodings)
@@ -1,5 +1,12 @@
-from typing import List, Optional, Iterable
-from domain.models import Bar, Interval
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Iterable, Sequence
+from domain.models import Bar, Interval, Watermark
+
+# Scheduling hint for repos with prioritised read pools: API reads run at the default
+# interactive priority, background jobs (aggregation scans) set PRIORITY_BACKGROUND.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+read_priority: ContextVar[int] = ContextVar("read_priority", default=PRIORITY_INTERACTIVE)
 
 class KlineRepo:
     async def upsert_1m(self, bars: Iterable[Bar]) -> None: ...
@@ -7,9 +14,38 @@ class KlineRepo:
     async def query(self, symbol: str, interval: Interval,
                     start: Optional[int], end: Optional[int], limit: int,
                     only_final: bool=True) -> List[Bar]: ...
+    async def query_raw(self, symbol: str, interval: Interval,
+                        start: Optional[int], end: Optional[int], limit: int,
+                        only_final: bool=True) -> Sequence[Sequence]: ...
+    # optional; GetKlines.handle_many falls back to one query_raw per symbol
+    async def query_raw_many(self, symbols: Iterable[str], interval: Interval,
+                             start: Optional[int], end: Optional[int], limit: int,
+                             only_final: bool=True) -> Dict[str, Sequence[Sequence]]: ...
+    async def watermark(self, symbol: str, interval: Interval) -> Optional[Watermark]: ...
     async def max_open_time(self, interval: Interval) -> Optional[int]: ...
     async def min_open_time(self, interval: Interval) -> Optional[int]: ...
 
 class Cache:
     async def get_bytes(self, key: str): ...
     async def set_bytes(self, key: str, data: bytes, ttl_s: int): ...
+
+class DataVersions:
+    """Per-(symbol, interval) counter that changes whenever that series' stored rows change.
+
+    ``modified`` is the epoch second of the write behind the current version (None if
+    unknown), strictly increasing per series.  ``scope`` names the space versions are
+    unique in: anything derived from a version for other processes must include it.
+    """
+    scope: str
+    async def get(self, symbol: str, interval: Interval) -> int: ...
+    async def modified(self, symbol: str, interval: Interval) -> Optional[int]: ...
+    async def bump(self, symbol: str, interval: Interval) -> int: ...
+
+class TailStore:
+    """In-memory copy of the newest rows of each series, tagged with its ``DataVersions`` value."""
+    capacity: int
+    def load(self, symbol: str, interval: Interval, rows: Sequence[Sequence], version: int) -> None: ...
+    def apply(self, symbol: str, interval: Interval, bars: Iterable[Bar], version: int) -> None: ...
+    def invalidate(self, symbol: str, interval: Interval) -> None: ...
+    def latest(self, symbol: str, interval: Interval, limit: int,
+               only_final: bool, version: int) -> Optional[Sequence[Sequence]]: ...
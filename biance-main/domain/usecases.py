@@ -1,24 +1,299 @@
-import pickle
-from typing import Optional, List
-from domain.ports import KlineRepo, Cache
-from domain.models import Interval, Bar
+import time
+import asyncio
+import hashlib
+from typing import AsyncIterator, Callable, Dict, Iterable, Optional, Sequence, Set, Tuple
+from domain.ports import DataVersions, KlineRepo, Cache, TailStore
+from domain.models import INTERVAL_MS, Interval, KlinePayload
+from infra.serialization import serialize_binance_rows
+
+Encoder = Callable[[Sequence[Sequence]], bytes]
+
+def _since(rows: Sequence[Sequence], start: Optional[int]) -> Sequence[Sequence]:
+    # the newest ``limit`` rows from ``start`` on are the newest ``limit`` rows, cut at ``start``
+    if start is None or not rows or rows[0][0] >= start:
+        return rows
+    return [r for r in rows if r[0] >= start]
 
 class GetKlines:
-    def __init__(self, repo: KlineRepo, cache: Cache, ttl_s: int=10):
+    """Cached kline reads, returned as encoded ``KlinePayload`` bytes.
+
+    Rows are encoded with ``encode``, Binance's string-formatted rows unless given (or the
+    ``formats`` encoder a request names), and hashed into an ETag once per fill; each format has its own cache key holding the packed
+    payload, so a hit is a single bytes lookup.  Cache keys carry the series' data version
+    (see ``DataVersions``), so an upsert makes every cached response for that series
+    unreachable at once.  Ranges that end before the current bar opened can no longer
+    change and are kept for ``history_ttl_s``; open-ended ranges keep the short ``ttl_s``
+    as a backstop for writers outside this process.  Bodies of ``compress_min_bytes`` or
+    more are also compressed once per fill with each of ``compressors`` ("gzip", "br") and
+    the variants cached in the same payload, so no request compresses anything.
+
+    Concurrent misses on one key share a single fill.  When the cache offers
+    ``try_lock``/``unlock`` (Redis), processes also take turns: the lock holder fills and the
+    others poll the cache for up to ``fill_lock_ms`` before querying themselves.
+
+    Ranges are first snapped to bar boundaries (see :meth:`normalize`), so timestamps that
+    select the same rows share one cache key.  Open-ended requests (no end) are cut from
+    ``tail`` when it holds the series at the current version; the first miss on a series
+    loads its newest ``tail.capacity`` rows in one query, after which writes keep the tail
+    current.
+    ``on_event`` receives "hit", "tail", "miss", "coalesced" or "peer" for every request.
+    """
+    def __init__(self, repo: KlineRepo, cache: Cache, ttl_s: int=10,
+                 versions: Optional[DataVersions]=None, history_ttl_s: int=21600,
+                 fill_lock_ms: int=2000, on_event: Optional[Callable[[str], None]]=None,
+                 encode: Encoder=serialize_binance_rows, tail: Optional[TailStore]=None,
+                 formats: Optional[Dict[str, Encoder]]=None,
+                 compressors: Optional[Dict[str, Callable[[bytes], bytes]]]=None,
+                 compress_min_bytes: int=1024):
         self.repo = repo
+        self.tail = tail if versions is not None else None
         self.cache = cache
+        self.encode = encode
+        self.encoders: Dict[str, Encoder] = {"json": encode, **(formats or {})}
+        self.compressors = compressors or {}
+        self.compress_min_bytes = compress_min_bytes
         self.ttl_s = max(1, ttl_s)
+        self.versions = versions
+        self.history_ttl_s = max(self.ttl_s, history_ttl_s)
+        self.fill_lock_ms = fill_lock_ms
+        self.on_event = on_event
+        self._inflight: Dict[str, "asyncio.Future[KlinePayload]"] = {}
+        self._batches: Set["asyncio.Task[None]"] = set()
     async def handle(self, symbol: str, interval: str,
                      start: Optional[int], end: Optional[int], limit: int,
-                     only_final: bool=True):
-        key=f"k:{symbol}:{interval}:{end}:{limit}:{1 if only_final else 0}:{start or 0}"
+                     only_final: bool=True, fmt: str="json") -> KlinePayload:
+        if fmt not in self.encoders:
+            raise ValueError(f"unknown klines format {fmt!r}")
+        itv = Interval(interval)
+        start, end = self.normalize(itv, start, end)
+        ver = await self.versions.get(symbol, itv) if self.versions else 0
+        key = self._key(symbol, itv, ver, start, end, limit, only_final, fmt)
         if (b:=await self.cache.get_bytes(key)):
-            return pickle.loads(b)
-        bars: List[Bar] = await self.repo.query(
-            symbol, Interval(interval), start, end, limit, only_final
-        )
-        await self.cache.set_bytes(key, pickle.dumps(bars), self.ttl_s)
-        return bars
+            self._event("hit")
+            return KlinePayload.unpack(b)
+        fill = self._inflight.get(key)
+        if fill is None:
+            # the fill runs as its own task so a disconnecting caller does not fail the others
+            fill = asyncio.ensure_future(self._fill(key, ver, symbol, itv, start, end, limit, only_final, fmt))
+            self._inflight[key] = fill
+            fill.add_done_callback(lambda t, k=key: self._fill_done(k, t))
+        else:
+            self._event("coalesced")
+        return await asyncio.shield(fill)
+    async def handle_many(self, symbols: Iterable[str], interval: str,
+                          start: Optional[int], end: Optional[int], limit: int,
+                          only_final: bool=True) -> Dict[str, KlinePayload]:
+        """``handle`` for several symbols of one interval.
+
+        Every symbol keeps its own cache key, so batch and single requests share entries.
+        Versions and cache entries are looked up concurrently (``cache.get_many_bytes`` when
+        the cache has it), keys already being filled are awaited, the tail answers what it
+        can, and the rest are read with one ``repo.query_raw_many`` call whose fills are
+        registered like ``handle``'s.
+        """
+        symbols = list(dict.fromkeys(symbols))
+        itv = Interval(interval)
+        start, end = self.normalize(itv, start, end)
+        if self.versions is not None:
+            vers = await asyncio.gather(*(self.versions.get(symbol, itv) for symbol in symbols))
+        else:
+            vers = [0] * len(symbols)
+        keys = [self._key(symbol, itv, ver, start, end, limit, only_final) for symbol, ver in zip(symbols, vers)]
+        get_many = getattr(self.cache, "get_many_bytes", None)
+        if get_many is not None:
+            cached = await get_many(keys)
+        else:
+            cached = await asyncio.gather(*(self.cache.get_bytes(key) for key in keys))
+        out: Dict[str, KlinePayload] = {}
+        pending: Dict[str, "asyncio.Future[KlinePayload]"] = {}
+        missing: Dict[str, Tuple[str, "asyncio.Future[KlinePayload]"]] = {}
+        for symbol, ver, key, b in zip(symbols, vers, keys, cached):
+            if b:
+                self._event("hit")
+                out[symbol] = KlinePayload.unpack(b)
+            elif (fill := self._inflight.get(key)) is not None:
+                self._event("coalesced")
+                pending[symbol] = fill
+            elif (end is None and self.tail is not None
+                  and (rows := self.tail.latest(symbol, itv, limit, only_final, ver)) is not None):
+                self._event("tail")
+                out[symbol] = await self._store(key, itv, end, _since(rows, start))
+            else:
+                # registered before any await, so single requests for the key wait on the batch
+                self._event("miss")
+                fill = pending[symbol] = asyncio.get_running_loop().create_future()
+                self._inflight[key] = fill
+                fill.add_done_callback(lambda t, k=key: self._fill_done(k, t))
+                missing[symbol] = (key, fill)
+        if missing:
+            batch = asyncio.ensure_future(self._fill_many(missing, itv, start, end, limit, only_final))
+            self._batches.add(batch)
+            batch.add_done_callback(self._batches.discard)
+        for symbol, fill in pending.items():
+            out[symbol] = await asyncio.shield(fill)
+        return {symbol: out[symbol] for symbol in symbols}
+    async def validators(self, symbol: str, interval: str,
+                         start: Optional[int], end: Optional[int], limit: int,
+                         only_final: bool=True, fmt: str="json") -> Optional[Tuple[str, Optional[int]]]:
+        """Weak ETag and Last-Modified (epoch seconds) of a response, without reading rows.
+
+        Both follow the series' data version, so they need ``versions``; call this before
+        :meth:`handle`, so a write landing in between can only make the ETag older than the
+        body.  The ETag includes ``DataVersions.scope``, so processes with private version
+        counters never validate each other's responses.  Last-Modified is when the write
+        behind the version landed (see ``DataVersions.modified``).
+        """
+        if self.versions is None:
+            return None
+        itv = Interval(interval)
+        start, end = self.normalize(itv, start, end)
+        ver = await self.versions.get(symbol, itv)
+        modified = await self.versions.modified(symbol, itv)
+        tag = (f"{self.versions.scope}:{symbol}:{interval}:{ver}:{start}:{end}:{limit}:"
+               f"{1 if only_final else 0}:{fmt}")
+        return 'W/"' + hashlib.blake2b(tag.encode(), digest_size=12).hexdigest() + '"', modified
+    async def _fill(self, key: str, ver: int, symbol: str, itv: Interval,
+                    start: Optional[int], end: Optional[int], limit: int, only_final: bool,
+                    fmt: str):
+        latest = self.tail is not None and end is None
+        if latest and (rows := self.tail.latest(symbol, itv, limit, only_final, ver)) is not None:
+            self._event("tail")
+            return await self._store(key, itv, end, _since(rows, start), fmt)
+        self._event("miss")
+        try_lock = getattr(self.cache, "try_lock", None)
+        locked = False
+        if try_lock is not None:
+            locked = await try_lock(key, self.fill_lock_ms)
+            if not locked and (b := await self._wait_for_peer(key)):
+                self._event("peer")
+                return KlinePayload.unpack(b)
+        try:
+            rows: Optional[Sequence[Sequence]] = None
+            if latest and limit <= self.tail.capacity:
+                recent = await self.repo.query_raw(symbol, itv, None, None, self.tail.capacity, False)
+                self.tail.load(symbol, itv, recent, ver)
+                rows = self.tail.latest(symbol, itv, limit, only_final, ver)
+                if rows is not None:
+                    rows = _since(rows, start)
+            if rows is None:
+                rows = await self.repo.query_raw(symbol, itv, start, end, limit, only_final)
+            return await self._store(key, itv, end, rows, fmt)
+        finally:
+            if locked:
+                await self.cache.unlock(key)
+    async def _fill_many(self, missing: Dict[str, Tuple[str, "asyncio.Future[KlinePayload]"]],
+                         itv: Interval, start: Optional[int], end: Optional[int], limit: int,
+                         only_final: bool) -> None:
+        try:
+            query_many = getattr(self.repo, "query_raw_many", None)
+            if query_many is not None:
+                found = await query_many(list(missing), itv, start, end, limit, only_final)
+            else:
+                found = dict(zip(missing, await asyncio.gather(*(
+                    self.repo.query_raw(symbol, itv, start, end, limit, only_final) for symbol in missing
+                ))))
+            for symbol, (key, fill) in missing.items():
+                fill.set_result(await self._store(key, itv, end, found.get(symbol, [])))
+        except asyncio.CancelledError:
+            for _, fill in missing.values():
+                fill.cancel()
+            raise
+        except Exception as e:
+            for _, fill in missing.values():
+                if not fill.done():
+                    fill.set_exception(e)
+    async def _store(self, key: str, itv: Interval, end: Optional[int],
+                     rows: Sequence[Sequence], fmt: str="json") -> KlinePayload:
+        body = self.encoders[fmt](rows)
+        encodings: Dict[str, bytes] = {}
+        if self.compressors and len(body) >= self.compress_min_bytes:
+            encodings = await asyncio.to_thread(self._compress, body)
+        payload = KlinePayload(body, '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"', encodings)
+        await self.cache.set_bytes(key, payload.pack(), self._ttl(itv, end))
+        return payload
+    def _compress(self, body: bytes) -> Dict[str, bytes]:
+        out = {}
+        for name, compress in self.compressors.items():
+            data = compress(body)
+            if len(data) < len(body):
+                out[name] = data
+        return out
+    @staticmethod
+    def _key(symbol: str, itv: Interval, ver: int, start: Optional[int], end: Optional[int],
+             limit: int, only_final: bool, fmt: str="json") -> str:
+        key = f"kp:{symbol}:{itv.value}:v{ver}:{end}:{limit}:{1 if only_final else 0}:{start or 0}"
+        return key if fmt == "json" else f"{key}:{fmt}"
+    async def _wait_for_peer(self, key: str) -> Optional[bytes]:
+        deadline = time.monotonic() + self.fill_lock_ms / 1000
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.02)
+            if (b := await self.cache.get_bytes(key)):
+                return b
+        return None
+    def _fill_done(self, key: str, fill: asyncio.Future) -> None:
+        if self._inflight.get(key) is fill:
+            del self._inflight[key]
+        if not fill.cancelled():
+            fill.exception()  # retrieved here in case every waiter went away
+    def _event(self, outcome: str) -> None:
+        if self.on_event is not None:
+            self.on_event(outcome)
+    @staticmethod
+    def normalize(interval: Interval, start: Optional[int],
+                  end: Optional[int]) -> Tuple[Optional[int], Optional[int]]:
+        """Snap a range to bar open times without changing which rows it selects.
+
+        Rows match on ``start <= open_time <= end``, so ``start`` rounds up and ``end`` down to
+        a bar boundary.  An ``end`` at or past the current bar's open selects everything up to
+        now, the same as no ``end``, so ``endTime=now()`` polling shares the latest-window key.
+        """
+        step = INTERVAL_MS[interval]
+        if start is not None:
+            start = -(-start // step) * step
+        if end is not None:
+            now_ms = int(time.time() * 1000)
+            end = None if end >= now_ms - now_ms % step else end - end % step
+        return start, end
+    def _ttl(self, interval: Interval, end: Optional[int]) -> int:
+        if end is None or self.versions is None:
+            return self.ttl_s
+        now_ms = int(time.time() * 1000)
+        current_open = now_ms - now_ms % INTERVAL_MS[interval]
+        return self.history_ttl_s if end < current_open else self.ttl_s
+
+class ExportKlines:
+    """Streams a whole time range oldest first, ``chunk_rows`` rows at a time.
+
+    Uses the repo's ``iter_raw`` cursor when it has one.  Otherwise the range is walked in
+    windows of ``chunk_rows`` bars, each of which ``query_raw`` returns whole, so any repo
+    can export with bounded memory.  ``after`` resumes a broken export: pass the open_time
+    of the last row received.
+    """
+    def __init__(self, repo: KlineRepo, chunk_rows: int=5000):
+        self.repo = repo
+        self.chunk_rows = max(1, chunk_rows)
+    async def stream(self, symbol: str, interval: str,
+                     start: Optional[int], end: Optional[int], only_final: bool=True,
+                     after: Optional[int]=None) -> AsyncIterator[Sequence[Sequence]]:
+        itv = Interval(interval)
+        if after is not None:
+            start = after + 1 if start is None else max(start, after + 1)
+        iter_raw = getattr(self.repo, "iter_raw", None)
+        if iter_raw is not None:
+            async for rows in iter_raw(symbol, itv, start, end, only_final, self.chunk_rows):
+                yield rows
+            return
+        wm = await self.repo.watermark(symbol, itv)
+        if wm is None:
+            return
+        lo = wm.first_open_time if start is None else max(start, wm.first_open_time)
+        hi = wm.last_open_time if end is None else min(end, wm.last_open_time)
+        window = self.chunk_rows * INTERVAL_MS[itv]
+        while lo <= hi:
+            rows = await self.repo.query_raw(symbol, itv, lo, min(lo + window - 1, hi), self.chunk_rows, only_final)
+            if rows:
+                yield rows
+            lo += window
 
 class HealthSnapshot:
     def __init__(self, kline_repo: KlineRepo):
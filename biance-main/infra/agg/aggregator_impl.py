@@ -1,95 +1,81 @@
 import asyncio
 from typing import List, Dict, Optional
 from time import time
-from domain.models import Interval, Bar
-from domain.ports import KlineRepo
-from .ring_buffer import RingBuffer
-
-MS = {
-    Interval.m1: 60_000,
-    Interval.m3: 180_000,
-    Interval.m5: 300_000,
-    Interval.m15: 900_000,
-    Interval.h1: 3_600_000,
-    Interval.h4: 14_400_000,
-    Interval.d1: 86_400_000,
-}
+from domain.models import INTERVAL_MS as MS, Interval, Bar
+from domain.ports import KlineRepo, PRIORITY_BACKGROUND, read_priority
 
 def bucket_start_ms(ts_ms: int, interval_ms: int) -> int:
     return (ts_ms // interval_ms) * interval_ms
 
 class Aggregator:
-    def __init__(self, repo: KlineRepo, ring: Optional[RingBuffer] = None):
+    def __init__(self, repo: KlineRepo):
         self.repo = repo
-        self.ring = ring or RingBuffer(capacity=5)
 
     async def aggregate_symbol(self, symbol: str, target: Interval):
-        prev = getattr(self.repo, "cur_symbol", None)
-        if hasattr(self.repo, "cur_symbol"):
-            self.repo.cur_symbol = symbol
+        token = read_priority.set(PRIORITY_BACKGROUND)
         try:
-            assert target in (Interval.m3, Interval.m5, Interval.m15, Interval.h1, Interval.h4, Interval.d1)
-            itv_ms = MS[target]
-            last_t: Optional[int] = await self.repo.max_open_time(target)
-            min_1m: Optional[int] = await self.repo.min_open_time(Interval.m1)
-            if min_1m is None:
-                return
-            start_t = bucket_start_ms((last_t + itv_ms) if last_t else min_1m, itv_ms)
-            now_ms = int(time()*1000)
-            end_bucket = bucket_start_ms(now_ms - 1, itv_ms)
+            await self._aggregate_symbol(symbol, target)
+        finally:
+            read_priority.reset(token)
 
-            window_ms = 3 * MS[Interval.d1]
-            cur_start = start_t
-            out: List[Bar] = []
-            while cur_start <= end_bucket:
-                cur_end = min(end_bucket + itv_ms - 1, cur_start + window_ms - 1)
-                src_bars = await self.repo.query(symbol, Interval.m1, start=cur_start, end=cur_end, limit=500000, only_final=True)
-                if not src_bars:
-                    cur_start = cur_end + 1
-                    continue
-                buckets: Dict[int, List[Bar]] = {}
-                for b in src_bars:
-                    bs = bucket_start_ms(b.open_time, itv_ms)
-                    buckets.setdefault(bs, []).append(b)
-                for bs in sorted(buckets.keys()):
-                    bars = buckets[bs]
-                    o = bars[0].open
-                    h = max(x.high for x in bars)
-                    l = min(x.low for x in bars)
-                    c = bars[-1].close
-                    vol = sum(x.volume for x in bars)
-                    qv = sum(x.quote_volume for x in bars)
-                    trades = sum(x.trades for x in bars)
-                    tb = sum(x.taker_buy_base for x in bars)
-                    tq = sum(x.taker_buy_quote for x in bars)
-                    close_time = bs + itv_ms - 1
-                    out.append(Bar(
-                        symbol=symbol, interval=target, open_time=bs,
-                        open=o, high=h, low=l, close=c,
-                        volume=vol, quote_volume=qv,
-                        close_time=close_time, trades=trades,
-                        taker_buy_base=tb, taker_buy_quote=tq, is_final=True
-                    ))
-                if len(out) >= 5000:
-                    await self.repo.upsert(out)
-                    for b in out[-5:]:
-                        await self.ring.put(symbol, target.value, {
-                            "open_time": b.open_time, "close_time": b.close_time,
-                            "open": b.open, "high": b.high, "low": b.low, "close": b.close
-                        })
-                    out.clear()
-                cur_start = cur_end + 1
+    async def _aggregate_symbol(self, symbol: str, target: Interval):
+        assert target in (Interval.m3, Interval.m5, Interval.m15, Interval.h1, Interval.h4, Interval.d1)
+        itv_ms = MS[target]
+        src_wm = await self.repo.watermark(symbol, Interval.m1)
+        if src_wm is None:
+            return
+        dst_wm = await self.repo.watermark(symbol, target)
+        last_t: Optional[int] = dst_wm.last_open_time if dst_wm else None
+        if last_t is not None:
+            # an open bucket is rebuilt until it is written final
+            last = await self.repo.query(symbol, target, start=last_t, end=last_t, limit=1, only_final=False)
+            if not last or last[0].is_final:
+                last_t += itv_ms
+        start_t = bucket_start_ms(last_t if last_t is not None else src_wm.first_open_time, itv_ms)
+        now_ms = int(time()*1000)
+        end_bucket = bucket_start_ms(now_ms - 1, itv_ms)
 
-            if out:
+        window_ms = 3 * MS[Interval.d1]
+        cur_start = start_t
+        out: List[Bar] = []
+        while cur_start <= end_bucket:
+            cur_end = min(end_bucket + itv_ms - 1, cur_start + window_ms - 1)
+            src_bars = await self.repo.query(symbol, Interval.m1, start=cur_start, end=cur_end, limit=500000, only_final=True)
+            if not src_bars:
+                cur_start = cur_end + 1
+                continue
+            buckets: Dict[int, List[Bar]] = {}
+            for b in src_bars:
+                bs = bucket_start_ms(b.open_time, itv_ms)
+                buckets.setdefault(bs, []).append(b)
+            for bs in sorted(buckets.keys()):
+                bars = buckets[bs]
+                o = bars[0].open
+                h = max(x.high for x in bars)
+                l = min(x.low for x in bars)
+                c = bars[-1].close
+                vol = sum(x.volume for x in bars)
+                qv = sum(x.quote_volume for x in bars)
+                trades = sum(x.trades for x in bars)
+                tb = sum(x.taker_buy_base for x in bars)
+                tq = sum(x.taker_buy_quote for x in bars)
+                close_time = bs + itv_ms - 1
+                # closed once its last minute is in, or the source has moved past it (a gap)
+                final = bars[-1].close_time >= close_time or src_wm.last_open_time > close_time
+                out.append(Bar(
+                    symbol=symbol, interval=target, open_time=bs,
+                    open=o, high=h, low=l, close=c,
+                    volume=vol, quote_volume=qv,
+                    close_time=close_time, trades=trades,
+                    taker_buy_base=tb, taker_buy_quote=tq, is_final=final
+                ))
+            if len(out) >= 5000:
                 await self.repo.upsert(out)
-                for b in out[-5:]:
-                    await self.ring.put(symbol, target.value, {
-                        "open_time": b.open_time, "close_time": b.close_time,
-                        "open": b.open, "high": b.high, "low": b.low, "close": b.close
-                    })
-        finally:
-            if hasattr(self.repo, "cur_symbol"):
-                self.repo.cur_symbol = prev
+                out.clear()
+            cur_start = cur_end + 1
+
+        if out:
+            await self.repo.upsert(out)
 
     async def aggregate_all(self, symbol: str, limit: int = 3):
         sem = asyncio.Semaphore(limit)
@@ -0,0 +1,131 @@
+import asyncio
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import orjson
+
+from domain.models import Bar
+
+# (symbol, interval value)
+Stream = Tuple[str, str]
+# one message, encoded once for every subscriber: WebSocket text and SSE frame
+Push = Tuple[str, bytes]
+# streams one connection may hold at once
+MAX_STREAMS = 200
+
+
+def parse_streams(spec: str, limit: int = MAX_STREAMS) -> List[Stream]:
+    """``"BTCUSDT@1m,ethusdt@5m"`` -> ``[("BTCUSDT", "1m"), ("ETHUSDT", "5m")]``."""
+    out: List[Stream] = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        symbol, sep, interval = item.partition("@")
+        if not sep or not symbol:
+            raise ValueError(f"bad stream {item!r}, expected SYMBOL@interval")
+        out.append((symbol.upper(), interval))
+    if len(out) > limit:
+        raise ValueError(f"at most {limit} streams per connection")
+    return list(dict.fromkeys(out))
+
+
+def _encode(b: Bar) -> Push:
+    text = orjson.dumps({
+        "s": b.symbol, "i": b.interval.value,
+        "k": [b.open_time, str(b.open), str(b.high), str(b.low), str(b.close), str(b.volume),
+              b.close_time, str(b.quote_volume), b.trades, str(b.taker_buy_base),
+              str(b.taker_buy_quote), "0"],
+    }).decode()
+    return text, b"data: " + text.encode() + b"\n\n"
+
+
+class Subscription:
+    """One connection's queue.  It is cut off, not slowed down, when it falls behind."""
+    __slots__ = ("streams", "queue", "overflowed")
+
+    def __init__(self, queue_size: int):
+        self.streams: Set[Stream] = set()
+        self.queue: "asyncio.Queue[Push]" = asyncio.Queue(queue_size)
+        self.overflowed = False
+
+    async def get(self) -> Optional[Push]:
+        """The next message, or None once the subscriber overflowed."""
+        if self.overflowed:
+            return None
+        return await self.queue.get()
+
+
+class BarHub:
+    """Fans finalized bars out to subscribers of their (symbol, interval).
+
+    Fed with every committed write (see ``VersionedKlineRepo``); only final bars newer
+    than the last one pushed for the series go out, at most ``max_catchup`` per write, so
+    backfills never flood clients.  Each bar is encoded once and the same object is queued
+    for every subscriber without awaiting, so a publish costs one ``put_nowait`` per
+    subscriber.  A subscriber whose queue is full is dropped and told so; it reconnects and
+    reads what it missed from ``/fapi/v1/klines``.
+    """
+
+    def __init__(self, queue_size: int = 256, max_catchup: int = 5):
+        self.queue_size = queue_size
+        self.max_catchup = max_catchup
+        self._subs: Dict[Stream, Set[Subscription]] = {}
+        self._last: Dict[Stream, int] = {}
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, streams: Iterable[Stream] = ()) -> Subscription:
+        sub = Subscription(self.queue_size)
+        self.add(sub, streams)
+        return sub
+
+    def add(self, sub: Subscription, streams: Iterable[Stream]) -> None:
+        for stream in streams:
+            sub.streams.add(stream)
+            self._subs.setdefault(stream, set()).add(sub)
+
+    def remove(self, sub: Subscription, streams: Iterable[Stream]) -> None:
+        for stream in list(streams):
+            sub.streams.discard(stream)
+            subs = self._subs.get(stream)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[stream]
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        self.remove(sub, sub.streams)
+
+    def publish(self, bars: Iterable[Bar]) -> None:
+        fresh: Dict[Stream, List[Bar]] = {}
+        for b in bars:
+            if not b.is_final:
+                continue
+            stream = (b.symbol, b.interval.value)
+            last = self._last.get(stream)
+            if last is None or b.open_time > last:
+                fresh.setdefault(stream, []).append(b)
+        for stream, new in fresh.items():
+            new.sort(key=lambda b: b.open_time)
+            self._last[stream] = new[-1].open_time
+            subs = self._subs.get(stream)
+            if not subs:
+                continue
+            for b in new[-self.max_catchup:]:
+                msg = _encode(b)
+                self.published += 1
+                for sub in list(subs):
+                    try:
+                        sub.queue.put_nowait(msg)
+                    except asyncio.QueueFull:
+                        sub.overflowed = True
+                        self.dropped += 1
+                        self.unsubscribe(sub)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "streams": len(self._subs),
+            "subscriptions": sum(len(s) for s in self._subs.values()),
+            "published": self.published,
+            "dropped": self.dropped,
+        }
@@ -1,15 +1,137 @@
-from collections import deque
-from typing import Dict, Deque, Tuple
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from domain.models import Bar, Interval
+
+# one typed column per RAW_COLUMNS field; is_final is stored as 0/1
+TAIL_TYPECODES = "qdddddqdqddq"
+FINAL = 11
+
+
+def _row(b: Bar) -> tuple:
+    return (
+        b.open_time, b.open, b.high, b.low, b.close, b.volume, b.close_time,
+        b.quote_volume, b.trades, b.taker_buy_base, b.taker_buy_quote, 1 if b.is_final else 0,
+    )
+
+
+class _Tail:
+    __slots__ = ("cols", "version", "complete")
+
+    def __init__(self, version: int, complete: bool):
+        self.cols = [array(code) for code in TAIL_TYPECODES]
+        self.version = version
+        # True when the series has no rows older than the ones held here
+        self.complete = complete
+
+    def __len__(self) -> int:
+        return len(self.cols[0])
+
+    def upsert(self, row: tuple) -> None:
+        ots = self.cols[0]
+        ot = row[0]
+        if not ots or ot > ots[-1]:
+            for col, v in zip(self.cols, row):
+                col.append(v)
+            return
+        i = bisect_left(ots, ot)
+        if ots[i] == ot:
+            for col, v in zip(self.cols, row):
+                col[i] = v
+        elif i > 0 or self.complete:
+            for col, v in zip(self.cols, row):
+                col.insert(i, v)
+        # else: older than every held row of an incomplete tail, so not among the latest
+
+    def trim(self, capacity: int) -> None:
+        extra = len(self) - capacity
+        if extra > 0:
+            for col in self.cols:
+                del col[:extra]
+            self.complete = False
+
 
 class RingBuffer:
-    def __init__(self, capacity: int = 5):
+    """Latest ``capacity`` rows per (symbol, interval), held in typed array columns.
+
+    A series is loaded from the DB on first use (:meth:`load`) and then kept current by
+    :meth:`apply` with every committed write.  Each tail remembers the data version it
+    reflects; a write that skips a version (made by another process) drops the tail, and
+    :meth:`latest` only answers for the exact version asked, so a stale tail is never served.
+    At most ``max_series`` tails are kept, least recently used first out.
+    """
+
+    def __init__(self, capacity: int = 1500, max_series: int = 500):
         self.capacity = capacity
-        self._buf: Dict[Tuple[str, str], Deque[dict]] = {}
+        self.max_series = max_series
+        self._tails: "OrderedDict[Tuple[str, Interval], _Tail]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def load(self, symbol: str, interval: Interval, rows: Sequence[Sequence], version: int) -> None:
+        """Install the newest ``rows`` (oldest first, as from ``query_raw``) as of ``version``."""
+        tail = _Tail(version, complete=len(rows) < self.capacity)
+        for i, col in enumerate(tail.cols):
+            col.extend(int(r[i]) if i == FINAL else r[i] for r in rows)
+        tail.trim(self.capacity)
+        self._tails[(symbol, interval)] = tail
+        self._tails.move_to_end((symbol, interval))
+        while len(self._tails) > self.max_series:
+            self._tails.popitem(last=False)
+            self.evictions += 1
+
+    def apply(self, symbol: str, interval: Interval, bars: Iterable[Bar], version: int) -> None:
+        """Fold committed ``bars`` into the tail, which moves to ``version``."""
+        key = (symbol, interval)
+        tail = self._tails.get(key)
+        if tail is None:
+            return
+        if tail.version != version - 1:
+            del self._tails[key]
+            return
+        for b in sorted(bars, key=lambda b: b.open_time):
+            tail.upsert(_row(b))
+        tail.trim(self.capacity)
+        tail.version = version
+
+    def invalidate(self, symbol: str, interval: Interval) -> None:
+        self._tails.pop((symbol, interval), None)
 
-    async def put(self, symbol: str, interval: str, bucket: dict):
+    def latest(self, symbol: str, interval: Interval, limit: int,
+               only_final: bool, version: int) -> Optional[List[tuple]]:
+        """The newest ``limit`` rows as ``query_raw`` would return them, or None if unknown."""
         key = (symbol, interval)
-        dq = self._buf.setdefault(key, deque(maxlen=self.capacity))
-        dq.append(bucket)
+        tail = self._tails.get(key)
+        if tail is None or tail.version != version:
+            self.misses += 1
+            return None
+        n = len(tail)
+        lo = max(0, n - limit)
+        if only_final:
+            final = tail.cols[FINAL]
+            lo, found = n, 0
+            while lo > 0 and found < limit:
+                lo -= 1
+                found += final[lo]
+        else:
+            found = n - lo
+        if found < limit and not tail.complete:
+            self.misses += 1
+            return None
+        self._tails.move_to_end(key)
+        self.hits += 1
+        rows = list(zip(*(col[lo:n] for col in tail.cols)))
+        return [r for r in rows if r[FINAL]] if only_final else rows
 
-    async def get_all(self, symbol: str, interval: str):
-        return list(self._buf.get((symbol, interval), []))
+    def stats(self) -> Dict[str, int]:
+        items = sum(len(t) for t in self._tails.values())
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "bytes": items * 8 * len(TAIL_TYPECODES),
+            "items": items,
+        }
@@ -1,29 +1,84 @@
-import asyncio
 import time
 from collections import OrderedDict
-from typing import OrderedDict as OrderedDictType
+from typing import Dict, List, Optional, Tuple
+
+# rough per-entry bookkeeping (key, tuple, dict slot) added to len(data) for the budget
+ENTRY_OVERHEAD = 128
+
 
 class LRUCache:
-    def __init__(self, max_items: int = 10000):
-        self._d: OrderedDictType[str, tuple[bytes, float]] = OrderedDict()
-        self._lock = asyncio.Lock()
+    """In-process LRU bounded by total bytes (and optionally entries).
+
+    All operations are synchronous under the hood: the event loop runs one coroutine at a
+    time and nothing here awaits, so no lock is needed.  Entries expire after the TTL given
+    to ``set_bytes`` (checked on read); values larger than ``max_bytes / 8`` are not cached
+    so one huge response cannot flush the hot set.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, max_items: Optional[int] = None):
+        self._d: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self.max_bytes = max_bytes
         self.max_items = max_items
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        item = self._d.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        data, exp = item
+        if exp < time.monotonic():
+            self._drop(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._d.move_to_end(key)
+        self.hits += 1
+        return data
+
+    def set(self, key: str, data: bytes, ttl_s: int) -> None:
+        size = len(data) + ENTRY_OVERHEAD
+        if key in self._d:
+            self._drop(key)
+        if size > self.max_bytes // 8:
+            return
+        self._d[key] = (data, time.monotonic() + max(1, ttl_s))
+        self.bytes += size
+        while self.bytes > self.max_bytes or (self.max_items and len(self._d) > self.max_items):
+            old, (old_data, _) = self._d.popitem(last=False)
+            self.bytes -= len(old_data) + ENTRY_OVERHEAD
+            self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        if key in self._d:
+            self._drop(key)
+
+    def _drop(self, key: str) -> None:
+        data, _ = self._d.pop(key)
+        self.bytes -= len(data) + ENTRY_OVERHEAD
+
+    def __len__(self) -> int:
+        return len(self._d)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "bytes": self.bytes,
+            "items": len(self._d),
+        }
+
     async def get_bytes(self, key: str):
-        async with self._lock:
-            item = self._d.get(key)
-            if not item:
-                return None
-            data, exp = item
-            now = time.time()
-            if exp < now:
-                self._d.pop(key, None)
-                return None
-            self._d.move_to_end(key)
-            return data
+        return self.get(key)
+
+    async def get_many_bytes(self, keys: List[str]) -> List[Optional[bytes]]:
+        return [self.get(key) for key in keys]
+
     async def set_bytes(self, key: str, data: bytes, ttl_s: int):
-        async with self._lock:
-            expire = time.time() + max(1, ttl_s)
-            self._d[key] = (data, expire)
-            self._d.move_to_end(key)
-            while len(self._d) > self.max_items:
-                self._d.popitem(last=False)
+        self.set(key, data, ttl_s)
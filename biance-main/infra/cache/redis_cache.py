@@ -1,13 +1,53 @@
+import os
+from typing import List, Optional, Tuple
+
 import redis.asyncio as redis
 
+# delete the lock only if we still own it
+UNLOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
 class RedisCache:
     """Redis-based cache implementing the Cache port."""
     def __init__(self, url: str):
         self._redis = redis.from_url(url, decode_responses=False)
+        self._token = os.urandom(8).hex()
 
-        
     async def get_bytes(self, key: str):
         return await self._redis.get(key)
 
     async def set_bytes(self, key: str, data: bytes, ttl_s: int):
         await self._redis.set(key, data, ex=max(1, ttl_s))
+
+    async def get_with_ttl(self, key: str) -> Tuple[Optional[bytes], int]:
+        """The value and its remaining TTL in ms, in one round trip."""
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.get(key)
+            pipe.pttl(key)
+            data, ttl_ms = await pipe.execute()
+        return data, ttl_ms
+
+    async def get_many_bytes(self, keys: List[str]) -> List[Optional[bytes]]:
+        return await self._redis.mget(keys) if keys else []
+
+    async def get_many_with_ttl(self, keys: List[str]) -> List[Tuple[Optional[bytes], int]]:
+        """``get_with_ttl`` for several keys, pipelined into one round trip."""
+        if not keys:
+            return []
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.get(key)
+                pipe.pttl(key)
+            res = await pipe.execute()
+        return list(zip(res[::2], res[1::2]))
+
+    async def try_lock(self, key: str, ttl_ms: int) -> bool:
+        """Take the fill lock for ``key``; it expires by itself after ``ttl_ms``."""
+        return bool(await self._redis.set(f"lock:{key}", self._token, nx=True, px=max(1, ttl_ms)))
+
+    async def unlock(self, key: str) -> None:
+        await self._redis.eval(UNLOCK_SCRIPT, 1, f"lock:{key}", self._token)
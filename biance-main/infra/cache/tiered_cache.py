@@ -0,0 +1,45 @@
+from typing import List, Optional
+
+from infra.cache.lru_cache import LRUCache
+from infra.cache.redis_cache import RedisCache
+
+
+class TieredCache:
+    """Cache port with the in-process LRU (L1) in front of Redis (L2).
+
+    Reads try L1 first and promote L2 hits into L1 for the entry's remaining Redis TTL;
+    writes go to both.  Nothing is ever invalidated: keys carry the series' data version, so
+    a write makes every stale entry unreachable in every worker at once.
+    """
+
+    def __init__(self, l1: LRUCache, l2: RedisCache):
+        self.l1 = l1
+        self.l2 = l2
+
+    async def get_bytes(self, key: str):
+        data = self.l1.get(key)
+        if data is not None:
+            return data
+        data, ttl_ms = await self.l2.get_with_ttl(key)
+        if data is not None and ttl_ms > 0:
+            self.l1.set(key, data, max(1, ttl_ms // 1000))
+        return data
+
+    async def get_many_bytes(self, keys: List[str]) -> List[Optional[bytes]]:
+        out = [self.l1.get(key) for key in keys]
+        misses = [i for i, data in enumerate(out) if data is None]
+        for i, (data, ttl_ms) in zip(misses, await self.l2.get_many_with_ttl([keys[i] for i in misses])):
+            if data is not None and ttl_ms > 0:
+                self.l1.set(keys[i], data, max(1, ttl_ms // 1000))
+            out[i] = data
+        return out
+
+    async def set_bytes(self, key: str, data: bytes, ttl_s: int):
+        self.l1.set(key, data, ttl_s)
+        await self.l2.set_bytes(key, data, ttl_s)
+
+    async def try_lock(self, key: str, ttl_ms: int) -> bool:
+        return await self.l2.try_lock(key, ttl_ms)
+
+    async def unlock(self, key: str) -> None:
+        await self.l2.unlock(key)
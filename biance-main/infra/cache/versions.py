@@ -0,0 +1,142 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+
+import redis.asyncio as redis
+
+from domain.models import Interval
+
+log = logging.getLogger(__name__)
+
+
+def _next_second(prev: Optional[int]) -> int:
+    now = int(time.time())
+    return now if prev is None else max(now, prev + 1)
+
+
+class LocalDataVersions:
+    """In-process DataVersions.
+
+    Counters start at the process start time in ms rather than 0, so a restarted process
+    never hands out a version an earlier one already used in a cache key.  Two worker
+    processes can still hand out the same number for different data, so ``scope`` (random
+    per instance) goes into every validator built from these versions.
+    """
+
+    def __init__(self):
+        self.scope = os.urandom(6).hex()
+        self._epoch = int(time.time() * 1000)
+        self._v: Dict[Tuple[str, str], int] = {}
+        self._t: Dict[Tuple[str, str], int] = {}
+
+    async def get(self, symbol: str, interval: Interval) -> int:
+        return self._v.get((symbol, interval.value), self._epoch)
+
+    async def modified(self, symbol: str, interval: Interval) -> Optional[int]:
+        return self._t.get((symbol, interval.value))
+
+    async def bump(self, symbol: str, interval: Interval) -> int:
+        key = (symbol, interval.value)
+        v = self._v[key] = self._v.get(key, self._epoch) + 1
+        self._t[key] = _next_second(self._t.get(key))
+        return v
+
+
+# INCR the counter and move its write time (KEYS[2]) to max(now, previous + 1)
+_BUMP_LUA = """
+local v = redis.call('INCR', KEYS[1])
+local t = tonumber(redis.call('GET', KEYS[2]) or '0') + 1
+local now = tonumber(ARGV[1])
+if now > t then t = now end
+redis.call('SET', KEYS[2], t)
+return {v, t}
+"""
+
+
+class RedisDataVersions:
+    """DataVersions shared by every process using the same Redis (``INCR`` per series).
+
+    Next to each counter Redis keeps the epoch second of the bump that produced it
+    (``<key>:t``), so every process reports the same ``modified``.  Each process mirrors the counters locally: bumps are published on ``channel`` and
+    applied by a listener, so ``get`` normally costs no round trip.  Mirrored values are
+    re-read from Redis after ``mirror_s`` in case a message was lost.
+    """
+
+    def __init__(self, url: str, prefix: str = "kv", channel: str = "mtf:versions",
+                 mirror_s: float = 5.0):
+        self._redis = redis.from_url(url, decode_responses=False)
+        self.prefix = prefix
+        self.channel = channel
+        self.mirror_s = mirror_s
+        # versions mean the same in every process sharing the Redis
+        self.scope = ""
+        self._mirror: Dict[str, Tuple[int, Optional[int], float]] = {}
+        self._bump = self._redis.register_script(_BUMP_LUA)
+        self._task: Optional[asyncio.Task] = None
+
+    def _key(self, symbol: str, interval: Interval) -> str:
+        return f"{self.prefix}:{symbol}:{interval.value}"
+
+    def _remember(self, key: str, v: int, t: Optional[int]) -> Tuple[int, Optional[int], float]:
+        known = self._mirror.get(key)
+        if known is not None and known[0] > v:
+            v, t = known[0], known[1]
+        entry = self._mirror[key] = (v, t, time.monotonic() + self.mirror_s)
+        return entry
+
+    async def _lookup(self, symbol: str, interval: Interval) -> Tuple[int, Optional[int], float]:
+        key = self._key(symbol, interval)
+        known = self._mirror.get(key)
+        if known is not None and known[2] > time.monotonic():
+            return known
+        v, t = await self._redis.mget(key, f"{key}:t")
+        return self._remember(key, int(v) if v is not None else 0, int(t) if t is not None else None)
+
+    async def get(self, symbol: str, interval: Interval) -> int:
+        return (await self._lookup(symbol, interval))[0]
+
+    async def modified(self, symbol: str, interval: Interval) -> Optional[int]:
+        return (await self._lookup(symbol, interval))[1]
+
+    async def bump(self, symbol: str, interval: Interval) -> int:
+        key = self._key(symbol, interval)
+        v, t = await self._bump(keys=[key, f"{key}:t"], args=[int(time.time())])
+        v, t = int(v), int(t)
+        self._remember(key, v, t)
+        await self._redis.publish(self.channel, f"{key}={v}:{t}")
+        return v
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._listen())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                pubsub = self._redis.pubsub()
+                await pubsub.subscribe(self.channel)
+                try:
+                    async for msg in pubsub.listen():
+                        if msg.get("type") == "message":
+                            key, _, vt = msg["data"].decode().rpartition("=")
+                            v, _, t = vt.partition(":")
+                            self._remember(key, int(v), int(t) if t else None)
+                finally:
+                    await pubsub.aclose()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning("version listener failed, resubscribing: %s", e)
+                self._mirror.clear()
+                await asyncio.sleep(1)
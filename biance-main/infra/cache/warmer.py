@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from domain.models import Interval
+from domain.ports import PRIORITY_BACKGROUND, read_priority
+from domain.usecases import GetKlines
+
+log = logging.getLogger(__name__)
+
+# (symbol, interval, limit, only_final) of a latest-window klines request
+HotKey = Tuple[str, str, int, bool]
+
+
+class HotKeys:
+    """Request counts of latest-window klines keys, persisted as the top ``top_k``.
+
+    Counts are halved once per ``half_life_s`` of wall-clock time (see :meth:`decay`), so
+    the list follows what is polled now rather than what was popular at some point since
+    the first start.
+    """
+
+    def __init__(self, path: str, top_k: int = 200, half_life_s: int = 3600):
+        self.path = path
+        self.top_k = top_k
+        self.half_life_s = max(1, half_life_s)
+        self._counts: Counter = Counter()
+        self._decayed_at = time.monotonic()
+
+    def record(self, symbol: str, interval: str, limit: int, only_final: bool) -> None:
+        self._counts[(symbol, interval, limit, only_final)] += 1
+        if len(self._counts) > 10 * self.top_k:
+            self._counts = Counter(dict(self._counts.most_common(self.top_k)))
+
+    def observe(self, symbol: str, interval: str, start: Optional[int], end: Optional[int],
+                limit: int, only_final: bool) -> None:
+        """Count a klines request if it asks for the latest window."""
+        try:
+            itv = Interval(interval)
+        except ValueError:
+            return
+        if GetKlines.normalize(itv, start, end) == (None, None):
+            self.record(symbol, interval, limit, only_final)
+
+    def top(self) -> List[HotKey]:
+        return [key for key, _ in self._counts.most_common(self.top_k)]
+
+    def decay(self, now: Optional[float] = None) -> None:
+        """Halve every count once for each half-life elapsed since the last decay."""
+        now = time.monotonic() if now is None else now
+        periods = int((now - self._decayed_at) // self.half_life_s)
+        if periods <= 0:
+            return
+        self._decayed_at += periods * self.half_life_s
+        self._counts = Counter({
+            key: n >> periods for key, n in self._counts.most_common(self.top_k) if n >> periods
+        })
+
+    def load(self) -> None:
+        try:
+            with open(self.path, "rb") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            log.warning("ignoring unreadable hot key list %s: %s", self.path, e)
+            return
+        for symbol, interval, limit, only_final, count in entries:
+            self._counts[(symbol, interval, int(limit), bool(only_final))] += int(count)
+
+    async def save(self) -> None:
+        """Write the top ``top_k`` counts; the file is written off the event loop."""
+        entries = [[*key, n] for key, n in self._counts.most_common(self.top_k)]
+        await asyncio.to_thread(self._write, entries)
+
+    def _write(self, entries: list) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp, self.path)
+
+
+class CacheWarmer:
+    """Fills the klines cache for the hot keys in the background.
+
+    :meth:`schedule` starts a pass unless one is already running.  Requests go through
+    ``GetKlines`` like any other, at background read priority, so a pass after new data
+    lands also primes the tail store.  ``ready`` turns True once the first pass finished;
+    the app schedules that pass only after the initial fetch and aggregation.
+    """
+
+    def __init__(self, get_klines, hot_keys: HotKeys, concurrency: int = 4):
+        self.get_klines = get_klines
+        self.hot_keys = hot_keys
+        self.concurrency = max(1, concurrency)
+        self.ready = False
+        self.total = 0
+        self.done = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def schedule(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self.warm())
+        return self._task
+
+    async def warm(self) -> None:
+        keys = self.hot_keys.top()
+        self.total, self.done = len(keys), 0
+        sem = asyncio.Semaphore(self.concurrency)
+        token = read_priority.set(PRIORITY_BACKGROUND)
+        try:
+            async def _one(key: HotKey) -> None:
+                symbol, interval, limit, only_final = key
+                async with sem:
+                    try:
+                        await self.get_klines.handle(symbol, interval, None, None, limit, only_final)
+                    except Exception as e:
+                        log.warning("warming %s failed: %s", key, e)
+                self.done += 1
+
+            await asyncio.gather(*(_one(key) for key in keys))
+        finally:
+            read_priority.reset(token)
+        if self.ready:
+            self.hot_keys.decay()
+            await self.hot_keys.save()
+        else:
+            log.info("cache warm-up finished: %d keys", self.total)
+        self.ready = True
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+        await self.hot_keys.save()
+
+    def status(self) -> Dict[str, object]:
+        return {"ready": self.ready, "warmed": self.done, "total": self.total}
@@ -1,12 +1,16 @@
+import time
+import logging
 import asyncpg
-from typing import Iterable, List, Optional
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
 
-from domain.models import Bar, Interval
+from domain.models import RAW_COLUMNS, Bar, Interval, Watermark, bar_from_raw
+from infra.db.segment_repo import month_label, month_start, next_month
 
+log = logging.getLogger(__name__)
 
-DDL = [
-    """
-    CREATE TABLE IF NOT EXISTS kline_1m (
+
+KLINE_COLUMNS_DDL = """
       symbol TEXT NOT NULL,
       open_time BIGINT NOT NULL,
       open DOUBLE PRECISION NOT NULL,
@@ -21,16 +25,100 @@ DDL = [
       taker_buy_quote DOUBLE PRECISION NOT NULL DEFAULT 0,
       is_final BOOLEAN NOT NULL DEFAULT TRUE,
       PRIMARY KEY(symbol, open_time)
+"""
+
+# Every interval table is range-partitioned by UTC month of open_time ({tbl}_pYYYYMM).  There
+# is no DEFAULT partition: it would rule out DETACH PARTITION CONCURRENTLY in drop_expired.
+KLINE_DDL = "CREATE TABLE IF NOT EXISTS {tbl} (" + KLINE_COLUMNS_DDL + ") PARTITION BY RANGE (open_time)"
+
+WATERMARK_DDL = """
+    CREATE TABLE IF NOT EXISTS kline_watermark (
+      symbol TEXT NOT NULL,
+      itv TEXT NOT NULL,
+      first_open_time BIGINT NOT NULL,
+      last_open_time BIGINT NOT NULL,
+      row_count BIGINT NOT NULL,
+      PRIMARY KEY(symbol, itv)
     );
-    """,
-    """CREATE TABLE IF NOT EXISTS kline_3m (... same columns ...);""",
-    """CREATE TABLE IF NOT EXISTS kline_5m (... same columns ...);""",
-    """CREATE TABLE IF NOT EXISTS kline_15m (... same columns ...);""",
-    """CREATE TABLE IF NOT EXISTS kline_1h (... same columns ...);""",
-    """CREATE TABLE IF NOT EXISTS kline_4h (... same columns ...);""",
-    """CREATE TABLE IF NOT EXISTS kline_1d (... same columns ...);""",
+"""
+
+PARTITION_MONTHS_AHEAD = 2
+
+WATERMARK_UPSERT = """
+    INSERT INTO kline_watermark (symbol, itv, first_open_time, last_open_time, row_count)
+    VALUES ($1, $2, $3, $4, $5)
+    ON CONFLICT (symbol, itv) DO UPDATE SET
+      first_open_time=LEAST(kline_watermark.first_open_time, EXCLUDED.first_open_time),
+      last_open_time=GREATEST(kline_watermark.last_open_time, EXCLUDED.last_open_time),
+      row_count=kline_watermark.row_count + EXCLUDED.row_count
+"""
+
+KLINE_COLUMNS = [
+    "symbol", "open_time", "open", "high", "low", "close", "volume", "close_time",
+    "quote_volume", "trades", "taker_buy_base", "taker_buy_quote", "is_final",
 ]
 
+ON_CONFLICT_UPDATE = """
+    ON CONFLICT (symbol, open_time) DO UPDATE SET
+      open=EXCLUDED.open, high=EXCLUDED.high, low=EXCLUDED.low, close=EXCLUDED.close,
+      volume=EXCLUDED.volume, close_time=EXCLUDED.close_time,
+      quote_volume=EXCLUDED.quote_volume, trades=EXCLUDED.trades,
+      taker_buy_base=EXCLUDED.taker_buy_base, taker_buy_quote=EXCLUDED.taker_buy_quote,
+      is_final=EXCLUDED.is_final
+"""
+
+KLINE_ARRAY_TYPES = [
+    "text", "bigint", "float8", "float8", "float8", "float8", "float8", "bigint",
+    "float8", "bigint", "float8", "float8", "boolean",
+]
+
+# small batches: one statement over a column array per field
+UPSERT_ARRAYS = (
+    "INSERT INTO {tbl} (" + ", ".join(KLINE_COLUMNS) + ")\n"
+    "    SELECT * FROM unnest("
+    + ", ".join(f"${i}::{t}[]" for i, t in enumerate(KLINE_ARRAY_TYPES, 1)) + ")" + ON_CONFLICT_UPDATE
+)
+
+# open_time correlates with insertion order, so a BRIN index stays tiny and prunes well.  It
+# is declared ON ONLY the parent; each partition carries (and attaches) its own.
+BRIN_DDL = "CREATE INDEX IF NOT EXISTS {tbl}_open_time_brin ON ONLY {tbl} USING BRIN (open_time)"
+
+# per-session staging table for bulk upserts; emptied by every commit
+STAGING_DDL = """
+    CREATE TEMP TABLE IF NOT EXISTS kline_stage
+      (LIKE kline_1m INCLUDING DEFAULTS) ON COMMIT DELETE ROWS
+"""
+
+UPSERT_STAGED = (
+    "INSERT INTO {tbl} (" + ", ".join(KLINE_COLUMNS) + ")\n"
+    "    SELECT " + ", ".join(KLINE_COLUMNS) + " FROM kline_stage" + ON_CONFLICT_UPDATE
+)
+
+# rows the upsert created, per symbol: xmax is 0 only on a freshly inserted row, so a key
+# that a concurrent writer inserted first counts once, for that writer
+COUNT_INSERTED = """
+    WITH up AS ({upsert} RETURNING symbol, xmax = 0 AS inserted)
+    SELECT symbol, COUNT(*) FILTER (WHERE inserted) FROM up GROUP BY symbol
+"""
+
+
+def _record(b: Bar) -> tuple:
+    return (
+        b.symbol,
+        b.open_time,
+        b.open,
+        b.high,
+        b.low,
+        b.close,
+        b.volume,
+        b.close_time,
+        b.quote_volume,
+        b.trades,
+        b.taker_buy_base,
+        b.taker_buy_quote,
+        b.is_final,
+    )
+
 
 def table_for_interval(interval: Interval) -> str:
     return {
@@ -47,25 +135,139 @@ def table_for_interval(interval: Interval) -> str:
 async def ensure_schema(db_url: str) -> None:
     conn = await asyncpg.connect(db_url)
     try:
-        for template in DDL:
-            stmt = template
-            if "... same columns ..." in stmt:
-                base = DDL[0].split("(", 1)[1].rsplit(");", 1)[0]
-                stmt = template.replace("... same columns ...", base)
-            await conn.execute(stmt)
+        now = month_start(int(time.time() * 1000))
+        for interval in Interval:
+            tbl = table_for_interval(interval)
+            await _ensure_partitioned(conn, tbl)
+            month = now
+            for _ in range(PARTITION_MONTHS_AHEAD + 1):
+                await _create_partition(conn, tbl, month)
+                month = next_month(month)
+        await conn.execute(WATERMARK_DDL)
+        await _backfill_watermarks(conn)
     finally:
         await conn.close()
 
 
+async def _ensure_partitioned(conn: asyncpg.Connection, tbl: str) -> None:
+    """Create ``tbl`` partitioned by month, converting a plain table from before partitioning.
+
+    A plain table is renamed to ``{tbl}_legacy`` and attached as the partition for every
+    month up to the current one, so existing rows stay where they are; later months get
+    their own partitions.  An empty DEFAULT partition left by earlier versions is dropped.
+    Workers starting together take turns on a session lock.
+    """
+    await conn.execute("SELECT pg_advisory_lock(hashtext('kline_schema'))")
+    try:
+        kind = await conn.fetchval("SELECT relkind::text FROM pg_class WHERE oid = to_regclass($1)", tbl)
+        if kind == "r":
+            await _convert_legacy(conn, tbl)
+        async with conn.transaction():
+            await conn.execute(KLINE_DDL.format(tbl=tbl))
+            await conn.execute(BRIN_DDL.format(tbl=tbl))
+        default = await conn.fetchval("SELECT to_regclass($1)::text", f"{tbl}_default")
+        if default is not None:
+            if await conn.fetchval(f"SELECT 1 FROM {default} LIMIT 1"):
+                log.warning("%s holds rows; expired partitions of %s are detached under a lock", default, tbl)
+            else:
+                await conn.execute(f"DROP TABLE {default}")
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock(hashtext('kline_schema'))")
+
+
+async def _convert_legacy(conn: asyncpg.Connection, tbl: str) -> None:
+    """Turn the plain table ``tbl`` into the legacy partition of a new partitioned ``tbl``.
+
+    ATTACH PARTITION scans the table under ACCESS EXCLUSIVE unless a valid CHECK already
+    implies the partition bound.  So the bound is added NOT VALID first (no scan), then
+    validated in its own transaction (a scan that lets reads and writes go on), and the
+    attach itself only takes the lock for a catalog change.  Likewise the BRIN index is
+    built CONCURRENTLY on the plain table beforehand, so the attach adopts it instead of
+    building one under the lock.
+    """
+    last = await conn.fetchval(f"SELECT MAX(open_time) FROM {tbl}")
+    now = month_start(int(time.time() * 1000))
+    # cover the current month, so live writes keep passing the check meanwhile
+    bound = next_month(now if last is None else max(last, now))
+    check = f"{tbl}_legacy_bound"
+    log.info("converting %s to a partitioned table (legacy rows before %d)", tbl, bound)
+    await conn.execute(
+        f"ALTER TABLE {tbl} DROP CONSTRAINT IF EXISTS {check}, "
+        f"ADD CONSTRAINT {check} CHECK (open_time < {bound}) NOT VALID"
+    )
+    await conn.execute(f"ALTER TABLE {tbl} VALIDATE CONSTRAINT {check}")
+    brin = f"{tbl}_legacy_open_time_brin"
+    # an interrupted CONCURRENTLY build leaves an invalid index behind
+    if await conn.fetchval(
+        "SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1)", brin
+    ):
+        await conn.execute(f"DROP INDEX CONCURRENTLY {brin}")
+    await conn.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {brin} ON {tbl} USING BRIN (open_time)")
+    async with conn.transaction():
+        await conn.execute(f"ALTER TABLE {tbl} RENAME TO {tbl}_legacy")
+        await conn.execute(f"ALTER INDEX IF EXISTS {tbl}_pkey RENAME TO {tbl}_legacy_pkey")
+        await conn.execute(KLINE_DDL.format(tbl=tbl))
+        await conn.execute(BRIN_DDL.format(tbl=tbl))
+        await conn.execute(
+            f"ALTER TABLE {tbl} ATTACH PARTITION {tbl}_legacy FOR VALUES FROM (MINVALUE) TO ({bound})"
+        )
+        # the partition bound enforces the same from now on
+        await conn.execute(f"ALTER TABLE {tbl}_legacy DROP CONSTRAINT {check}")
+
+
+def partition_name(tbl: str, month: int) -> str:
+    return f"{tbl}_p{month_label(month).replace('-', '')}"
+
+
+async def _create_partition(conn: asyncpg.Connection, tbl: str, month: int) -> None:
+    # PARTITION OF also builds the new, empty partition's BRIN index and attaches it
+    try:
+        await conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {partition_name(tbl, month)} PARTITION OF {tbl} "
+            f"FOR VALUES FROM ({month}) TO ({next_month(month)})"
+        )
+    except (asyncpg.DuplicateTableError, asyncpg.UniqueViolationError):
+        pass  # created concurrently by another worker
+    except asyncpg.PostgresError as e:
+        # overlaps the legacy partition (or an old default partition already holds rows
+        # for this month); those rows simply stay where they are
+        log.debug("no partition for %s %s: %s", tbl, month_label(month), e)
+
+
+async def _backfill_watermarks(conn: asyncpg.Connection) -> None:
+    """Seed kline_watermark from the kline tables once, for databases created before it existed."""
+    if await conn.fetchval("SELECT 1 FROM kline_watermark LIMIT 1"):
+        return
+    async with conn.transaction():
+        for interval in Interval:
+            tbl = table_for_interval(interval)
+            await conn.execute(
+                f"""
+                INSERT INTO kline_watermark (symbol, itv, first_open_time, last_open_time, row_count)
+                SELECT symbol, $1, MIN(open_time), MAX(open_time), COUNT(*)
+                FROM {tbl} GROUP BY symbol
+                ON CONFLICT (symbol, itv) DO NOTHING
+                """,
+                interval.value,
+            )
+
+
 class PostgresKlineRepo:
-    def __init__(self, db_url: str, pool_size: int = 5):
+    def __init__(self, db_url: str, pool_size: int = 5, copy_threshold: int = 500):
         self.db_url = db_url
         self.pool_size = pool_size
+        # batches at least this large go through COPY + one merge instead of executemany
+        self.copy_threshold = copy_threshold
         self._pool: Optional[asyncpg.pool.Pool] = None
+        self._partitions: Set[Tuple[str, int]] = set()
 
     async def connect(self) -> None:
         if self._pool is None:
-            self._pool = await asyncpg.create_pool(self.db_url, min_size=1, max_size=self.pool_size)
+            # statement texts are stable per (table, filters), so asyncpg's per-connection
+            # cache keeps the query/upsert paths as prepared statements
+            self._pool = await asyncpg.create_pool(
+                self.db_url, min_size=1, max_size=self.pool_size, statement_cache_size=256
+            )
 
     async def close(self) -> None:
         if self._pool is not None:
@@ -80,39 +282,46 @@ class PostgresKlineRepo:
         if not bars:
             return
         await self.connect()
-        tbl = table_for_interval(bars[0].interval)
-        q = f"""
-            INSERT INTO {tbl} (symbol, open_time, open, high, low, close, volume, close_time,
-                               quote_volume, trades, taker_buy_base, taker_buy_quote, is_final)
-            VALUES ($1,$2,$3,$4,$5,$6,$7,$8,$9,$10,$11,$12,$13)
-            ON CONFLICT (symbol, open_time) DO UPDATE SET
-              open=EXCLUDED.open, high=EXCLUDED.high, low=EXCLUDED.low, close=EXCLUDED.close,
-              volume=EXCLUDED.volume, close_time=EXCLUDED.close_time,
-              quote_volume=EXCLUDED.quote_volume, trades=EXCLUDED.trades,
-              taker_buy_base=EXCLUDED.taker_buy_base, taker_buy_quote=EXCLUDED.taker_buy_quote,
-              is_final=EXCLUDED.is_final
-        """
+        interval = bars[0].interval
+        tbl = table_for_interval(interval)
+        spans: Dict[str, Tuple[int, int]] = {}
+        for b in bars:
+            lo, hi = spans.get(b.symbol, (b.open_time, b.open_time))
+            spans[b.symbol] = (min(lo, b.open_time), max(hi, b.open_time))
+        # one INSERT may not touch a key twice, so keep only the last bar per key
+        records = list({(b.symbol, b.open_time): _record(b) for b in bars}.values())
         assert self._pool is not None
         async with self._pool.acquire() as conn:
+            await self._ensure_partitions(
+                conn, tbl,
+                min(lo for lo, _ in spans.values()), max(hi for _, hi in spans.values()),
+            )
             async with conn.transaction():
-                await conn.executemany(q, [
-                    (
-                        b.symbol,
-                        b.open_time,
-                        b.open,
-                        b.high,
-                        b.low,
-                        b.close,
-                        b.volume,
-                        b.close_time,
-                        b.quote_volume,
-                        b.trades,
-                        b.taker_buy_base,
-                        b.taker_buy_quote,
-                        b.is_final,
+                if len(records) >= self.copy_threshold:
+                    counts = await self._merge_copy(conn, tbl, records)
+                else:
+                    counts = await conn.fetch(
+                        COUNT_INSERTED.format(upsert=UPSERT_ARRAYS.format(tbl=tbl)),
+                        *[list(col) for col in zip(*records)],
                     )
-                    for b in bars
-                ])
+                added = dict(counts)
+                for sym, (lo, hi) in sorted(spans.items()):
+                    await conn.execute(WATERMARK_UPSERT, sym, interval.value, lo, hi, added.get(sym, 0))
+
+    async def _ensure_partitions(self, conn: asyncpg.Connection, tbl: str, lo: int, hi: int) -> None:
+        month = month_start(lo)
+        while month <= hi:
+            if (tbl, month) not in self._partitions:
+                await _create_partition(conn, tbl, month)
+                self._partitions.add((tbl, month))
+            month = next_month(month)
+
+    async def _merge_copy(self, conn: asyncpg.Connection, tbl: str,
+                          records: List[tuple]) -> List[asyncpg.Record]:
+        """COPY ``records`` into the session's staging table and merge them with one statement."""
+        await conn.execute(STAGING_DDL)
+        await conn.copy_records_to_table("kline_stage", records=records, columns=KLINE_COLUMNS)
+        return await conn.fetch(COUNT_INSERTED.format(upsert=UPSERT_STAGED.format(tbl=tbl)))
 
     async def query(
         self,
@@ -123,6 +332,19 @@ class PostgresKlineRepo:
         limit: int,
         only_final: bool = True,
     ) -> List[Bar]:
+        rows = await self.query_raw(symbol, interval, start, end, limit, only_final)
+        return [bar_from_raw(symbol, interval, r) for r in rows]
+
+    async def query_raw(
+        self,
+        symbol: str,
+        interval: Interval,
+        start: Optional[int],
+        end: Optional[int],
+        limit: int,
+        only_final: bool = True,
+    ) -> List[tuple]:
+        """Rows in ``RAW_COLUMNS`` order, oldest first."""
         await self.connect()
         tbl = table_for_interval(interval)
         where = ["symbol = $1"]
@@ -140,8 +362,7 @@ class PostgresKlineRepo:
             where.append("is_final = TRUE")
         where_sql = " AND ".join(where)
         sql = f"""
-            SELECT symbol, open_time, open, high, low, close, volume, close_time,
-                   quote_volume, trades, taker_buy_base, taker_buy_quote, is_final
+            SELECT {", ".join(RAW_COLUMNS)}
             FROM {tbl}
             WHERE {where_sql}
             ORDER BY open_time DESC
@@ -151,41 +372,224 @@ class PostgresKlineRepo:
         assert self._pool is not None
         async with self._pool.acquire() as conn:
             rows = await conn.fetch(sql, *args)
-        out: List[Bar] = []
-        for r in reversed(rows):
-            out.append(
-                Bar(
-                    symbol=r["symbol"],
-                    interval=interval,
-                    open_time=r["open_time"],
-                    open=r["open"],
-                    high=r["high"],
-                    low=r["low"],
-                    close=r["close"],
-                    volume=r["volume"],
-                    quote_volume=r["quote_volume"],
-                    close_time=r["close_time"],
-                    trades=r["trades"],
-                    taker_buy_base=r["taker_buy_base"],
-                    taker_buy_quote=r["taker_buy_quote"],
-                    is_final=r["is_final"],
+        return [tuple(r) for r in reversed(rows)]
+
+    async def query_raw_many(
+        self,
+        symbols: Iterable[str],
+        interval: Interval,
+        start: Optional[int],
+        end: Optional[int],
+        limit: int,
+        only_final: bool = True,
+    ) -> Dict[str, List[tuple]]:
+        """``query_raw`` for several symbols in one statement (a LATERAL index scan per symbol)."""
+        await self.connect()
+        tbl = table_for_interval(interval)
+        out: Dict[str, List[tuple]] = {s: [] for s in symbols}
+        where = ["k.symbol = s.symbol"]
+        args: List[object] = [list(out)]
+        idx = 2
+        if start is not None:
+            where.append(f"k.open_time >= ${idx}")
+            args.append(start)
+            idx += 1
+        if end is not None:
+            where.append(f"k.open_time <= ${idx}")
+            args.append(end)
+            idx += 1
+        if only_final:
+            where.append("k.is_final = TRUE")
+        where_sql = " AND ".join(where)
+        sql = f"""
+            SELECT s.symbol, w.*
+            FROM unnest($1::text[]) AS s(symbol)
+            CROSS JOIN LATERAL (
+                SELECT {", ".join("k." + c for c in RAW_COLUMNS)}
+                FROM {tbl} k
+                WHERE {where_sql}
+                ORDER BY k.open_time DESC
+                LIMIT ${idx}
+            ) w
+        """
+        args.append(limit)
+        assert self._pool is not None
+        async with self._pool.acquire() as conn:
+            rows = await conn.fetch(sql, *args)
+        for r in rows:
+            out[r[0]].append(tuple(r)[1:])
+        for found in out.values():
+            found.sort(key=lambda r: r[0])
+        return out
+
+    async def iter_raw(
+        self,
+        symbol: str,
+        interval: Interval,
+        start: Optional[int],
+        end: Optional[int],
+        only_final: bool = True,
+        chunk_rows: int = 5000,
+    ) -> AsyncIterator[List[tuple]]:
+        """Rows of ``[start, end]`` oldest first, in chunks of up to ``chunk_rows``.
+
+        Each chunk is a keyset seek on the primary key with a connection acquired just for
+        it, so a slow consumer holds neither a pooled connection nor an open transaction.
+        """
+        await self.connect()
+        tbl = table_for_interval(interval)
+        where = ["symbol = $1", "open_time >= $2"]
+        if end is not None:
+            where.append("open_time <= $3")
+        if only_final:
+            where.append("is_final = TRUE")
+        sql = f"""
+            SELECT {", ".join(RAW_COLUMNS)}
+            FROM {tbl}
+            WHERE {" AND ".join(where)}
+            ORDER BY open_time
+            LIMIT {int(chunk_rows)}
+        """
+        lo = start if start is not None else 0
+        assert self._pool is not None
+        while True:
+            args: List[object] = [symbol, lo]
+            if end is not None:
+                args.append(end)
+            async with self._pool.acquire() as conn:
+                rows = await conn.fetch(sql, *args)
+            if rows:
+                yield [tuple(r) for r in rows]
+            if len(rows) < chunk_rows:
+                return
+            lo = rows[-1][0] + 1
+
+    async def watermark(self, symbol: str, interval: Interval) -> Optional[Watermark]:
+        await self.connect()
+        assert self._pool is not None
+        async with self._pool.acquire() as conn:
+            row = await conn.fetchrow(
+                "SELECT first_open_time, last_open_time, row_count FROM kline_watermark "
+                "WHERE symbol = $1 AND itv = $2",
+                symbol,
+                interval.value,
+            )
+        if row is None:
+            return None
+        return Watermark(int(row[0]), int(row[1]), int(row[2]))
+
+    async def watermarks(self) -> Dict[Tuple[str, Interval], Watermark]:
+        await self.connect()
+        assert self._pool is not None
+        async with self._pool.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT symbol, itv, first_open_time, last_open_time, row_count FROM kline_watermark"
+            )
+        return {(r[0], Interval(r[1])): Watermark(int(r[2]), int(r[3]), int(r[4])) for r in rows}
+
+    async def delete_range(self, symbol: str, interval: Interval,
+                           start: Optional[int], end: Optional[int]) -> int:
+        await self.connect()
+        tbl = table_for_interval(interval)
+        assert self._pool is not None
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                status = await conn.execute(
+                    f"DELETE FROM {tbl} WHERE symbol = $1 AND open_time BETWEEN $2 AND $3",
+                    symbol, -1 if start is None else start, 2**62 if end is None else end,
                 )
+                deleted = int(status.split()[-1])
+                if deleted == 0:
+                    return 0
+                bounds = await conn.fetchrow(
+                    f"SELECT MIN(open_time), MAX(open_time) FROM {tbl} WHERE symbol = $1", symbol
+                )
+                if bounds[0] is None:
+                    await conn.execute(
+                        "DELETE FROM kline_watermark WHERE symbol = $1 AND itv = $2",
+                        symbol, interval.value,
+                    )
+                else:
+                    await conn.execute(
+                        "UPDATE kline_watermark SET first_open_time = $1, last_open_time = $2, "
+                        "row_count = GREATEST(0, row_count - $3) WHERE symbol = $4 AND itv = $5",
+                        bounds[0], bounds[1], deleted, symbol, interval.value,
+                    )
+        return deleted
+
+    async def drop_expired(self, interval: Interval, cutoff: int) -> int:
+        """Drop whole monthly partitions that end at or before ``cutoff``; returns the rows dropped.
+
+        Much cheaper than deleting the rows; whatever is left before ``cutoff`` (in the
+        partly expired month or the legacy partition) is for ``delete_range``.  Each
+        partition is detached CONCURRENTLY, so readers and writers of the table are never
+        blocked, and dropped once it is on its own; watermarks are fixed up afterwards.
+        """
+        await self.connect()
+        tbl = table_for_interval(interval)
+        assert self._pool is not None
+        dropped = 0
+        async with self._pool.acquire() as conn:
+            # CONCURRENTLY is refused while a DEFAULT partition (from older versions) exists
+            concurrently = not await conn.fetchval(
+                "SELECT partdefid <> 0 FROM pg_partitioned_table WHERE partrelid = to_regclass($1)", tbl
             )
-        return out
+            parts = await conn.fetch(
+                "SELECT c.relname, i.inhdetachpending FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = to_regclass($1) ORDER BY c.relname",
+                tbl,
+            )
+            for name, pending in parts:
+                label = name[len(tbl) + 2:]
+                if not (name.startswith(f"{tbl}_p") and label.isdigit() and len(label) == 6):
+                    continue
+                month = int(datetime(int(label[:4]), int(label[4:]), 1, tzinfo=timezone.utc).timestamp() * 1000)
+                if next_month(month) > cutoff:
+                    break
+                counts = await conn.fetch(f"SELECT symbol, COUNT(*) FROM {name} GROUP BY symbol")
+                if pending:
+                    # an earlier concurrent detach was interrupted
+                    await conn.execute(f"ALTER TABLE {tbl} DETACH PARTITION {name} FINALIZE")
+                elif concurrently:
+                    await conn.execute(f"ALTER TABLE {tbl} DETACH PARTITION {name} CONCURRENTLY")
+                else:
+                    async with conn.transaction():
+                        # give up (until the next pass) rather than queue everyone behind us
+                        await conn.execute("SET LOCAL lock_timeout = '2s'")
+                        await conn.execute(f"ALTER TABLE {tbl} DETACH PARTITION {name}")
+                await conn.execute(f"DROP TABLE {name}")
+                self._partitions.discard((tbl, month))
+                log.info("dropped partition %s", name)
+                for sym, n in counts:
+                    first = await conn.fetchval(f"SELECT MIN(open_time) FROM {tbl} WHERE symbol = $1", sym)
+                    if first is None:
+                        await conn.execute(
+                            "DELETE FROM kline_watermark WHERE symbol = $1 AND itv = $2",
+                            sym, interval.value,
+                        )
+                    else:
+                        await conn.execute(
+                            "UPDATE kline_watermark SET first_open_time = $1, "
+                            "row_count = GREATEST(0, row_count - $2) WHERE symbol = $3 AND itv = $4",
+                            first, n, sym, interval.value,
+                        )
+                    dropped += n
+        return dropped
 
     async def max_open_time(self, interval: Interval) -> Optional[int]:
         await self.connect()
-        tbl = table_for_interval(interval)
         assert self._pool is not None
         async with self._pool.acquire() as conn:
-            val = await conn.fetchval(f"SELECT MAX(open_time) FROM {tbl}")
+            val = await conn.fetchval(
+                "SELECT MAX(last_open_time) FROM kline_watermark WHERE itv = $1", interval.value
+            )
         return int(val) if val is not None else None
 
     async def min_open_time(self, interval: Interval) -> Optional[int]:
         await self.connect()
-        tbl = table_for_interval(interval)
         assert self._pool is not None
         async with self._pool.acquire() as conn:
-            val = await conn.fetchval(f"SELECT MIN(open_time) FROM {tbl}")
+            val = await conn.fetchval(
+                "SELECT MIN(first_open_time) FROM kline_watermark WHERE itv = $1", interval.value
+            )
         return int(val) if val is not None else None
-
@@ -0,0 +1,84 @@
+import time
+import asyncio
+import logging
+from typing import Dict, Optional
+
+from domain.models import INTERVAL_MS as MS, Interval
+from domain.ports import PRIORITY_BACKGROUND, read_priority
+from infra.db.segment_repo import SegmentStore
+
+log = logging.getLogger(__name__)
+
+
+class RetentionJob:
+    """Trims every series to a per-interval horizon.
+
+    ``horizons_days`` maps interval values to days to keep ("1m" -> 90); intervals missing
+    from it (or set to 0) are kept forever, so aggregated bars can outlive their 1m source.
+    Expired rows are removed in windows of about ``batch_rows`` rows, each its own short
+    write transaction, optionally sealed into ``archive`` segments first.  Segments hold
+    closed bars only, so a bar still open at expiry is dropped, not archived.  Freed pages
+    are then returned to the OS when the repo supports incremental vacuum.
+    """
+
+    def __init__(self, repo, horizons_days: Dict[str, int],
+                 archive: Optional[SegmentStore] = None,
+                 batch_rows: int = 20_000, vacuum_pages: int = 4096):
+        self.repo = repo
+        self.horizons_ms = {
+            Interval(itv): int(days) * 86_400_000 for itv, days in horizons_days.items() if int(days) > 0
+        }
+        self.archive = archive
+        self.batch_rows = max(1, batch_rows)
+        self.vacuum_pages = vacuum_pages
+
+    async def run_once(self, now_ms: Optional[int] = None) -> int:
+        """One retention pass; returns the rows removed."""
+        if not self.horizons_ms:
+            return 0
+        if now_ms is None:
+            now_ms = int(time.time() * 1000)
+        token = read_priority.set(PRIORITY_BACKGROUND)
+        try:
+            removed = 0
+            drop = getattr(self.repo, "drop_expired", None)
+            if drop is not None and self.archive is None:
+                # partitioned backends drop whole expired months before any row deletes
+                for interval, horizon in self.horizons_ms.items():
+                    removed += await drop(interval, now_ms - horizon)
+            for (symbol, interval), wm in (await self.repo.watermarks()).items():
+                horizon = self.horizons_ms.get(interval)
+                if horizon is None:
+                    continue
+                cutoff = now_ms - horizon
+                if wm.first_open_time < cutoff:
+                    removed += await self._trim(symbol, interval, wm.first_open_time, cutoff)
+            if removed:
+                log.info("retention removed %d rows", removed)
+                await self._vacuum()
+            return removed
+        finally:
+            read_priority.reset(token)
+
+    async def _trim(self, symbol: str, interval: Interval, first: int, cutoff: int) -> int:
+        window = self.batch_rows * MS[interval]
+        removed = 0
+        lo = first
+        while lo < cutoff:
+            hi = min(lo + window, cutoff) - 1
+            if self.archive is not None:
+                rows = await self.repo.query_raw(symbol, interval, lo, hi, self.batch_rows)
+                if rows:
+                    await asyncio.to_thread(self.archive.write, symbol, interval, rows)
+            removed += await self.repo.delete_range(symbol, interval, lo, hi)
+            lo = hi + 1
+        return removed
+
+    async def _vacuum(self) -> None:
+        vacuum = getattr(self.repo, "incremental_vacuum", None)
+        if vacuum is None:
+            return
+        while True:
+            freed = await vacuum(self.vacuum_pages)
+            if freed < self.vacuum_pages:
+                return
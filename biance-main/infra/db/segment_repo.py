@@ -0,0 +1,394 @@
+import os
+import sys
+import mmap
+import fcntl
+import bisect
+import struct
+import asyncio
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import partial
+from itertools import repeat
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from domain.models import Bar, Interval, Watermark, bar_from_raw
+from domain.ports import PRIORITY_BACKGROUND, read_priority
+
+log = logging.getLogger(__name__)
+
+# Fixed-width columns of a segment, in RAW_COLUMNS order.  Sealed rows are always final,
+# so is_final is not stored.
+SEGMENT_COLUMNS = (
+    ("open_time", "q"), ("open", "d"), ("high", "d"), ("low", "d"), ("close", "d"),
+    ("volume", "d"), ("close_time", "q"), ("quote_volume", "d"), ("trades", "q"),
+    ("taker_buy_base", "d"), ("taker_buy_quote", "d"),
+)
+# magic, format version, rows, first open_time, last open_time; 32 bytes keeps blocks aligned
+HEADER = struct.Struct("<4sIqqq")
+MAGIC = b"KSEG"
+
+
+def month_start(ts_ms: int) -> int:
+    d = datetime.fromtimestamp(ts_ms / 1000, tz=timezone.utc)
+    return int(datetime(d.year, d.month, 1, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def next_month(ts_ms: int) -> int:
+    d = datetime.fromtimestamp(month_start(ts_ms) / 1000, tz=timezone.utc)
+    year, month = (d.year + 1, 1) if d.month == 12 else (d.year, d.month + 1)
+    return int(datetime(year, month, 1, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def month_label(ts_ms: int) -> str:
+    return datetime.fromtimestamp(ts_ms / 1000, tz=timezone.utc).strftime("%Y-%m")
+
+
+def write_segment(path: str, rows: Sequence[Sequence]) -> None:
+    """Write ``rows`` (ascending, one month) as a segment file, atomically replacing ``path``.
+
+    Each column is a contiguous little-endian block after the header, so a segment can
+    also be read with ``numpy.memmap(path, dtype="<f8", offset=..., shape=rows)``.
+    """
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, 1, len(rows), rows[0][0], rows[-1][0]))
+        for i, (_, code) in enumerate(SEGMENT_COLUMNS):
+            col = array(code, (r[i] for r in rows))
+            if sys.byteorder != "little":
+                col.byteswap()
+            col.tofile(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class Segment:
+    """A sealed segment file mapped read-only, with one memoryview per column."""
+
+    def __init__(self, path: str):
+        if sys.byteorder != "little":
+            raise RuntimeError("segment files are little-endian and are mapped in native order")
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, _, self.rows, self.first, self.last = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self._mm.close()
+            raise ValueError(f"{path} is not a kline segment")
+        self._view = memoryview(self._mm)
+        width = self.rows * 8
+        self.columns = [
+            self._view[HEADER.size + i * width: HEADER.size + (i + 1) * width].cast(code)
+            for i, (_, code) in enumerate(SEGMENT_COLUMNS)
+        ]
+
+    def span(self, start: Optional[int], end: Optional[int]) -> Tuple[int, int]:
+        ot = self.columns[0]
+        lo = 0 if start is None else bisect.bisect_left(ot, start)
+        hi = self.rows if end is None else bisect.bisect_right(ot, end)
+        return lo, hi
+
+    def rows_between(self, lo: int, hi: int) -> List[tuple]:
+        return list(zip(*(c[lo:hi] for c in self.columns), repeat(1)))
+
+    def close(self) -> None:
+        for c in self.columns:
+            c.release()
+        self._view.release()
+        self._mm.close()
+
+
+class SegmentInfo(NamedTuple):
+    path: str
+    inode: int
+    rows: int
+    first: int
+    last: int
+
+
+class SegmentStore:
+    """Sealed history laid out as ``{root}/{interval}/{symbol}/{YYYY-MM}.seg``.
+
+    The per-series listing is cached and revalidated with one ``stat`` of the series
+    directory, so segments written by another process are picked up on the next read.
+    Reads run in worker threads; evicted mappings are left to be unmapped once the last
+    reader drops them.
+    """
+
+    def __init__(self, root: str, max_open: int = 256):
+        self.root = root
+        self.max_open = max_open
+        self._index: Dict[Tuple[str, Interval], Tuple[int, List[SegmentInfo]]] = {}
+        self._open: "OrderedDict[Tuple[str, int], Segment]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _dir(self, symbol: str, interval: Interval) -> str:
+        return os.path.join(self.root, interval.value, symbol)
+
+    def segments(self, symbol: str, interval: Interval) -> List[SegmentInfo]:
+        d = self._dir(symbol, interval)
+        try:
+            mtime = os.stat(d).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        with self._lock:
+            cached = self._index.get((symbol, interval))
+        if cached and cached[0] == mtime:
+            return cached[1]
+        infos = []
+        for name in sorted(os.listdir(d)):
+            if not name.endswith(".seg"):
+                continue
+            path = os.path.join(d, name)
+            with open(path, "rb") as f:
+                _, _, rows, first, last = HEADER.unpack(f.read(HEADER.size))
+                infos.append(SegmentInfo(path, os.fstat(f.fileno()).st_ino, rows, first, last))
+        with self._lock:
+            self._index[(symbol, interval)] = (mtime, infos)
+        return infos
+
+    def symbols(self, interval: Interval) -> List[str]:
+        try:
+            return os.listdir(os.path.join(self.root, interval.value))
+        except FileNotFoundError:
+            return []
+
+    def _segment(self, info: SegmentInfo) -> Segment:
+        key = (info.path, info.inode)
+        with self._lock:
+            seg = self._open.get(key)
+            if seg is not None:
+                self._open.move_to_end(key)
+                return seg
+        seg = Segment(info.path)
+        with self._lock:
+            self._open[key] = seg
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+        return seg
+
+    def bounds(self, symbol: str, interval: Interval) -> Optional[Watermark]:
+        infos = self.segments(symbol, interval)
+        if not infos:
+            return None
+        return Watermark(infos[0].first, infos[-1].last, sum(i.rows for i in infos))
+
+    def read(self, symbol: str, interval: Interval,
+             start: Optional[int], end: Optional[int], limit: int) -> List[tuple]:
+        """The newest ``limit`` sealed rows with ``start <= open_time <= end``, oldest first."""
+        chunks = []
+        remaining = limit
+        for info in reversed(self.segments(symbol, interval)):
+            if remaining <= 0 or (start is not None and info.last < start):
+                break
+            if end is not None and info.first > end:
+                continue
+            seg = self._segment(info)
+            lo, hi = seg.span(start, end)
+            lo = max(lo, hi - remaining)
+            if hi > lo:
+                chunks.append(seg.rows_between(lo, hi))
+                remaining -= hi - lo
+        out: List[tuple] = []
+        for chunk in reversed(chunks):
+            out.extend(chunk)
+        return out
+
+    def write(self, symbol: str, interval: Interval, rows: Sequence[Sequence]) -> None:
+        """Seal final ``rows`` (ascending), merging with whatever is already sealed per month."""
+        d = self._dir(symbol, interval)
+        os.makedirs(d, exist_ok=True)
+        by_month: Dict[int, List[Sequence]] = {}
+        for r in rows:
+            by_month.setdefault(month_start(r[0]), []).append(r)
+        for m, month_rows in by_month.items():
+            path = os.path.join(d, f"{month_label(m)}.seg")
+            if os.path.exists(path):
+                seg = Segment(path)
+                try:
+                    merged = {r[0]: r for r in seg.rows_between(0, seg.rows)}
+                finally:
+                    seg.close()
+                merged.update((r[0], r) for r in month_rows)
+                month_rows = [merged[k] for k in sorted(merged)]
+            write_segment(path, month_rows)
+
+    def delete(self, symbol: str, interval: Interval,
+               start: Optional[int], end: Optional[int]) -> int:
+        """Drop sealed rows with ``start <= open_time <= end``; returns the rows removed."""
+        removed = 0
+        for info in self.segments(symbol, interval):
+            if (start is not None and info.last < start) or (end is not None and info.first > end):
+                continue
+            seg = Segment(info.path)
+            try:
+                lo, hi = seg.span(start, end)
+                keep = seg.rows_between(0, lo) + seg.rows_between(hi, seg.rows)
+            finally:
+                seg.close()
+            if keep:
+                write_segment(info.path, keep)
+            else:
+                os.remove(info.path)
+            removed += info.rows - len(keep)
+        return removed
+
+    def close(self) -> None:
+        with self._lock:
+            self._open.clear()
+            self._index.clear()
+
+
+def _merge(sealed: List[Sequence], tail: List[Sequence], limit: int) -> List[Sequence]:
+    if not sealed:
+        return tail
+    if not tail or sealed[-1][0] < tail[0][0]:
+        return (sealed + tail)[-limit:]
+    # rows written into a sealed month after sealing: the tail copy wins until it is resealed
+    merged = {r[0]: r for r in sealed}
+    merged.update((r[0], r) for r in tail)
+    return [merged[k] for k in sorted(merged)][-limit:]
+
+
+class SegmentKlineRepo:
+    """KlineRepo serving completed months from mmap'd column segments.
+
+    The mutable recent tail stays in ``tail`` (any repo with ``watermarks`` and
+    ``drain_final``, i.e. :class:`SqliteKlineRepo`); :meth:`seal_completed_months` moves
+    the final rows of months that ended more than ``seal_grace_days`` ago out of it.
+    Open rows are never sealed; they stay in the tail until they are final.
+    """
+
+    def __init__(self, tail, root: str, seal_grace_days: int = 2):
+        self.tail = tail
+        self.store = SegmentStore(root)
+        self.seal_grace_ms = max(0, seal_grace_days) * 86_400_000
+        os.makedirs(root, exist_ok=True)
+
+    async def connect(self) -> None:
+        await self.tail.connect()
+
+    async def close(self) -> None:
+        await self.tail.close()
+        self.store.close()
+
+    async def upsert_1m(self, bars: Iterable[Bar]) -> None:
+        await self.tail.upsert(bars)
+
+    async def upsert(self, bars: Iterable[Bar]) -> None:
+        await self.tail.upsert(bars)
+
+    async def submit(self, bars: Iterable[Bar]) -> "asyncio.Future[None]":
+        return await self.tail.submit(bars)
+
+    async def query(self, symbol: str, interval: Interval,
+                    start: Optional[int], end: Optional[int], limit: int,
+                    only_final: bool = True) -> List[Bar]:
+        rows = await self.query_raw(symbol, interval, start, end, limit, only_final)
+        return [bar_from_raw(symbol, interval, r) for r in rows]
+
+    async def query_raw(self, symbol: str, interval: Interval,
+                        start: Optional[int], end: Optional[int], limit: int,
+                        only_final: bool = True) -> List[Sequence]:
+        # read the tail before listing segments: sealing writes the segment before it
+        # deletes the tail rows, so this order never misses a month in flight
+        rows = await self.tail.query_raw(symbol, interval, start, end, limit, only_final)
+        infos = self.store.segments(symbol, interval)
+        if not infos or (len(rows) >= limit and rows[0][0] > infos[-1].last):
+            return rows
+        sealed = await asyncio.to_thread(self.store.read, symbol, interval, start, end, limit)
+        return _merge(sealed, rows, limit)
+
+    async def watermark(self, symbol: str, interval: Interval) -> Optional[Watermark]:
+        tail = await self.tail.watermark(symbol, interval)
+        sealed = self.store.bounds(symbol, interval)
+        if tail is None or sealed is None:
+            return tail or sealed
+        return Watermark(
+            min(tail.first_open_time, sealed.first_open_time),
+            max(tail.last_open_time, sealed.last_open_time),
+            tail.count + sealed.count,
+        )
+
+    async def watermarks(self) -> Dict[Tuple[str, Interval], Watermark]:
+        out = dict(await self.tail.watermarks())
+        for interval in Interval:
+            for symbol in self.store.symbols(interval):
+                sealed = self.store.bounds(symbol, interval)
+                if sealed is None:
+                    continue
+                tail = out.get((symbol, interval))
+                out[(symbol, interval)] = sealed if tail is None else Watermark(
+                    min(tail.first_open_time, sealed.first_open_time),
+                    max(tail.last_open_time, sealed.last_open_time),
+                    tail.count + sealed.count,
+                )
+        return out
+
+    async def delete_range(self, symbol: str, interval: Interval,
+                           start: Optional[int], end: Optional[int]) -> int:
+        removed = await asyncio.to_thread(self.store.delete, symbol, interval, start, end)
+        return removed + await self.tail.delete_range(symbol, interval, start, end)
+
+    async def incremental_vacuum(self, max_pages: int = 4096) -> int:
+        return await self.tail.incremental_vacuum(max_pages)
+
+    async def max_open_time(self, interval: Interval) -> Optional[int]:
+        last = await self.tail.max_open_time(interval)
+        if last is not None:
+            return last
+        sealed = [b.last_open_time for b in self._sealed_bounds(interval)]
+        return max(sealed) if sealed else None
+
+    async def min_open_time(self, interval: Interval) -> Optional[int]:
+        firsts = [b.first_open_time for b in self._sealed_bounds(interval)]
+        first = await self.tail.min_open_time(interval)
+        if first is not None:
+            firsts.append(first)
+        return min(firsts) if firsts else None
+
+    def _sealed_bounds(self, interval: Interval) -> List[Watermark]:
+        out = []
+        for sym in self.store.symbols(interval):
+            b = self.store.bounds(sym, interval)
+            if b is not None:
+                out.append(b)
+        return out
+
+    async def seal_completed_months(self, now_ms: Optional[int] = None) -> int:
+        """Move every month that ended before ``now - grace`` from the tail into segments.
+
+        Only one process seals at a time; others skip the pass.  Returns the rows sealed.
+        """
+        if now_ms is None:
+            now_ms = int(datetime.now(timezone.utc).timestamp() * 1000)
+        cutoff = month_start(now_ms - self.seal_grace_ms)
+        with open(os.path.join(self.store.root, ".seal.lock"), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+            token = read_priority.set(PRIORITY_BACKGROUND)
+            try:
+                return await self._seal_before(cutoff)
+            finally:
+                read_priority.reset(token)
+
+    async def _seal_before(self, cutoff: int) -> int:
+        sealed = 0
+        for (symbol, interval), wm in (await self.tail.watermarks()).items():
+            m = month_start(wm.first_open_time)
+            while m < cutoff:
+                nxt = next_month(m)
+                # read, segment write and delete are one tail writer op, so a backfill of
+                # this month committing meanwhile is either sealed or left in the tail
+                moved = await self.tail.drain_final(
+                    symbol, interval, m, nxt - 1, partial(self.store.write, symbol, interval)
+                )
+                if moved:
+                    sealed += moved
+                    log.info("sealed %s %s %s: %d rows", symbol, interval.value, month_label(m), moved)
+                m = nxt
+        return sealed
@@ -1,105 +1,44 @@
 import os
+import fcntl
+import heapq
 import asyncio
+import logging
+import itertools
 import aiosqlite
 from contextlib import asynccontextmanager
-from typing import Iterable, List, Optional
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
 
-from domain.models import Bar, Interval
+from domain.models import RAW_COLUMNS, Bar, Interval, Watermark, bar_from_raw
+from domain.ports import PRIORITY_INTERACTIVE, read_priority
+from infra.db.write_queue import SqliteWriteQueue
 
-DDL = [
-    """
-    CREATE TABLE IF NOT EXISTS kline_1m (
-      symbol TEXT NOT NULL,
-      open_time INTEGER NOT NULL,
-      open REAL NOT NULL,
-      high REAL NOT NULL,
-      low REAL NOT NULL,
-      close REAL NOT NULL,
-      volume REAL NOT NULL,
-      close_time INTEGER NOT NULL,
-      quote_volume REAL NOT NULL DEFAULT 0,
-      trades INTEGER NOT NULL DEFAULT 0,
-      taker_buy_base REAL NOT NULL DEFAULT 0,
-      taker_buy_quote REAL NOT NULL DEFAULT 0,
-      is_final INTEGER NOT NULL DEFAULT 1,
-      PRIMARY KEY(symbol, open_time)
-    );
-    """,
-    """
-    CREATE TABLE IF NOT EXISTS kline_3m (
-      symbol TEXT NOT NULL,
-      open_time INTEGER NOT NULL,
-      open REAL NOT NULL,
-      high REAL NOT NULL,
-      low REAL NOT NULL,
-      close REAL NOT NULL,
-      volume REAL NOT NULL,
-      close_time INTEGER NOT NULL,
-      quote_volume REAL NOT NULL DEFAULT 0,
-      trades INTEGER NOT NULL DEFAULT 0,
-      taker_buy_base REAL NOT NULL DEFAULT 0,
-      taker_buy_quote REAL NOT NULL DEFAULT 0,
-      is_final INTEGER NOT NULL DEFAULT 1,
-      PRIMARY KEY(symbol, open_time)
-    );
-    """,
-    """
-    CREATE TABLE IF NOT EXISTS kline_5m (
-      symbol TEXT NOT NULL,
-      open_time INTEGER NOT NULL,
-      open REAL NOT NULL,
-      high REAL NOT NULL,
-      low REAL NOT NULL,
-      close REAL NOT NULL,
-      volume REAL NOT NULL,
-      close_time INTEGER NOT NULL,
-      quote_volume REAL NOT NULL DEFAULT 0,
-      trades INTEGER NOT NULL DEFAULT 0,
-      taker_buy_base REAL NOT NULL DEFAULT 0,
-      taker_buy_quote REAL NOT NULL DEFAULT 0,
-      is_final INTEGER NOT NULL DEFAULT 1,
-      PRIMARY KEY(symbol, open_time)
-    );
-    """,
-    """
-    CREATE TABLE IF NOT EXISTS kline_15m (
-      symbol TEXT NOT NULL,
-      open_time INTEGER NOT NULL,
-      open REAL NOT NULL,
-      high REAL NOT NULL,
-      low REAL NOT NULL,
-      close REAL NOT NULL,
-      volume REAL NOT NULL,
-      close_time INTEGER NOT NULL,
-      quote_volume REAL NOT NULL DEFAULT 0,
-      trades INTEGER NOT NULL DEFAULT 0,
-      taker_buy_base REAL NOT NULL DEFAULT 0,
-      taker_buy_quote REAL NOT NULL DEFAULT 0,
-      is_final INTEGER NOT NULL DEFAULT 1,
-      PRIMARY KEY(symbol, open_time)
-    );
-    """,
-    """
-    CREATE TABLE IF NOT EXISTS kline_1h (
-      symbol TEXT NOT NULL,
-      open_time INTEGER NOT NULL,
-      open REAL NOT NULL,
-      high REAL NOT NULL,
-      low REAL NOT NULL,
-      close REAL NOT NULL,
-      volume REAL NOT NULL,
-      close_time INTEGER NOT NULL,
-      quote_volume REAL NOT NULL DEFAULT 0,
-      trades INTEGER NOT NULL DEFAULT 0,
-      taker_buy_base REAL NOT NULL DEFAULT 0,
-      taker_buy_quote REAL NOT NULL DEFAULT 0,
-      is_final INTEGER NOT NULL DEFAULT 1,
-      PRIMARY KEY(symbol, open_time)
+log = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 2
+
+def table_for_interval(interval: Interval) -> str:
+    return {
+        Interval.m1: "kline_1m",
+        Interval.m3: "kline_3m",
+        Interval.m5: "kline_5m",
+        Interval.m15: "kline_15m",
+        Interval.h1: "kline_1h",
+        Interval.h4: "kline_4h",
+        Interval.d1: "kline_1d",
+    }[interval]
+
+SYMBOLS_DDL = """
+    CREATE TABLE IF NOT EXISTS symbols (
+      id INTEGER PRIMARY KEY,
+      name TEXT NOT NULL UNIQUE
     );
-    """,
-    """
-    CREATE TABLE IF NOT EXISTS kline_4h (
-      symbol TEXT NOT NULL,
+"""
+
+# v2 layout: rows are clustered on the primary key (WITHOUT ROWID) and reference the
+# symbols dictionary, so each table is a single B-tree with no secondary indexes.
+KLINE_DDL = """
+    CREATE TABLE IF NOT EXISTS {tbl} (
+      symbol_id INTEGER NOT NULL,
       open_time INTEGER NOT NULL,
       open REAL NOT NULL,
       high REAL NOT NULL,
@@ -112,214 +51,611 @@ DDL = [
       taker_buy_base REAL NOT NULL DEFAULT 0,
       taker_buy_quote REAL NOT NULL DEFAULT 0,
       is_final INTEGER NOT NULL DEFAULT 1,
-      PRIMARY KEY(symbol, open_time)
-    );
-    """,
-    """
-    CREATE TABLE IF NOT EXISTS kline_1d (
+      PRIMARY KEY(symbol_id, open_time)
+    ) WITHOUT ROWID;
+"""
+
+DDL = [SYMBOLS_DDL] + [KLINE_DDL.format(tbl=table_for_interval(i)) for i in Interval]
+
+RAW_SELECT = ", ".join(RAW_COLUMNS)
+
+SYMBOL_ID = "(SELECT id FROM symbols WHERE name = ?)"
+
+# SQLite allows at most 500 terms in a compound SELECT
+BATCH_QUERY_SYMBOLS = 400
+
+
+def _window_sql(tbl: str, start: Optional[int], end: Optional[int],
+                only_final: bool) -> Tuple[str, List[int]]:
+    """Newest-first rows of one symbol; binds the symbol, the returned bounds, then the limit."""
+    where = [f"symbol_id = {SYMBOL_ID}"]
+    bounds = []
+    if start is not None:
+        where.append("open_time >= ?")
+        bounds.append(start)
+    if end is not None:
+        where.append("open_time <= ?")
+        bounds.append(end)
+    if only_final:
+        where.append("is_final = 1")
+    sql = f"SELECT {RAW_SELECT} FROM {tbl} WHERE {' AND '.join(where)} ORDER BY open_time DESC LIMIT ?"
+    return sql, bounds
+
+WATERMARK_DDL = """
+    CREATE TABLE IF NOT EXISTS kline_watermark (
       symbol TEXT NOT NULL,
-      open_time INTEGER NOT NULL,
-      open REAL NOT NULL,
-      high REAL NOT NULL,
-      low REAL NOT NULL,
-      close REAL NOT NULL,
-      volume REAL NOT NULL,
-      close_time INTEGER NOT NULL,
-      quote_volume REAL NOT NULL DEFAULT 0,
-      trades INTEGER NOT NULL DEFAULT 0,
-      taker_buy_base REAL NOT NULL DEFAULT 0,
-      taker_buy_quote REAL NOT NULL DEFAULT 0,
-      is_final INTEGER NOT NULL DEFAULT 1,
-      PRIMARY KEY(symbol, open_time)
+      itv TEXT NOT NULL,
+      first_open_time INTEGER NOT NULL,
+      last_open_time INTEGER NOT NULL,
+      row_count INTEGER NOT NULL,
+      PRIMARY KEY(symbol, itv)
     );
-    """,
-]
-
-INDEX_DDL = [
-    "CREATE UNIQUE INDEX IF NOT EXISTS idx_kline_1m_symbol_time ON kline_1m(symbol, open_time);",
-    "CREATE INDEX IF NOT EXISTS idx_kline_1m_final ON kline_1m(symbol, open_time) WHERE is_final = 1;",
-    "CREATE UNIQUE INDEX IF NOT EXISTS idx_kline_3m_symbol_time ON kline_3m(symbol, open_time);",
-    "CREATE INDEX IF NOT EXISTS idx_kline_3m_final ON kline_3m(symbol, open_time) WHERE is_final = 1;",
-    "CREATE UNIQUE INDEX IF NOT EXISTS idx_kline_5m_symbol_time ON kline_5m(symbol, open_time);",
-    "CREATE INDEX IF NOT EXISTS idx_kline_5m_final ON kline_5m(symbol, open_time) WHERE is_final = 1;",
-    "CREATE UNIQUE INDEX IF NOT EXISTS idx_kline_15m_symbol_time ON kline_15m(symbol, open_time);",
-    "CREATE INDEX IF NOT EXISTS idx_kline_15m_final ON kline_15m(symbol, open_time) WHERE is_final = 1;",
-    "CREATE UNIQUE INDEX IF NOT EXISTS idx_kline_1h_symbol_time ON kline_1h(symbol, open_time);",
-    "CREATE INDEX IF NOT EXISTS idx_kline_1h_final ON kline_1h(symbol, open_time) WHERE is_final = 1;",
-    "CREATE UNIQUE INDEX IF NOT EXISTS idx_kline_4h_symbol_time ON kline_4h(symbol, open_time);",
-    "CREATE INDEX IF NOT EXISTS idx_kline_4h_final ON kline_4h(symbol, open_time) WHERE is_final = 1;",
-    "CREATE UNIQUE INDEX IF NOT EXISTS idx_kline_1d_symbol_time ON kline_1d(symbol, open_time);",
-    "CREATE INDEX IF NOT EXISTS idx_kline_1d_final ON kline_1d(symbol, open_time) WHERE is_final = 1;",
-]
+"""
 
-def table_for_interval(interval: Interval) -> str:
-    return {
-        Interval.m1: "kline_1m",
-        Interval.m3: "kline_3m",
-        Interval.m5: "kline_5m",
-        Interval.m15: "kline_15m",
-        Interval.h1: "kline_1h",
-        Interval.h4: "kline_4h",
-        Interval.d1: "kline_1d",
-    }[interval]
+WATERMARK_UPSERT = """
+    INSERT INTO kline_watermark (symbol, itv, first_open_time, last_open_time, row_count)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(symbol, itv) DO UPDATE SET
+      first_open_time=MIN(first_open_time, excluded.first_open_time),
+      last_open_time=MAX(last_open_time, excluded.last_open_time),
+      row_count=row_count + excluded.row_count
+"""
+
+MIGRATE_BATCH_ROWS = 50_000
 
 async def ensure_schema(db_url: str):
     path = db_url.replace("sqlite:///", "")
     if "/" in path:
         os.makedirs(os.path.dirname(path), exist_ok=True)
-    async with aiosqlite.connect(f"file:{path}?cache=shared", uri=True) as db:
-        await db.execute("PRAGMA journal_mode=WAL;")
-        await db.execute("PRAGMA busy_timeout=5000;")
-        for stmt in DDL:
-            await db.execute(stmt)
-        for stmt in INDEX_DDL:
-            await db.execute(stmt)
+    # serialise schema work across worker processes starting at the same time
+    with open(f"{path}.schema.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        async with aiosqlite.connect(path) as db:
+            # only takes effect on a new, empty file; lets retention hand pages back to the OS
+            await db.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+            await db.execute("PRAGMA journal_mode=WAL;")
+            await db.execute("PRAGMA busy_timeout=5000;")
+            cur = await db.execute("PRAGMA auto_vacuum")
+            if (await cur.fetchone())[0] != 2:
+                log.info("%s has auto_vacuum off; run 'PRAGMA auto_vacuum=INCREMENTAL; VACUUM;' "
+                         "once so retention can shrink the file", path)
+            for stmt in DDL:
+                await db.execute(stmt)
+            await db.execute(WATERMARK_DDL)
+            await db.commit()
+            await _migrate_v1(db)
+            await _backfill_watermarks(db)
+
+async def _migrate_v1(db: aiosqlite.Connection) -> None:
+    """Move v1 tables (symbol TEXT in every row plus two duplicate indexes) to the v2 layout.
+
+    Triggers first log every key v1 writers touch into ``<table>_v1_changes``.  Rows are
+    then synced per symbol in windows of ``MIGRATE_BATCH_ROWS`` (see :func:`_sync_v1_window`),
+    each its own short transaction, so other processes keep reading and writing the v1
+    table meanwhile and an interrupted run simply re-checks what it already copied.  The
+    change log is replayed the same way until one batch is left; only that batch and the
+    swap run under ``BEGIN IMMEDIATE``, so v1 writers wait for a short delta, not a scan.
+    """
+    cur = await db.execute("PRAGMA user_version")
+    if (await cur.fetchone())[0] >= SCHEMA_VERSION:
+        return
+    for interval in Interval:
+        tbl = table_for_interval(interval)
+        cur = await db.execute(f"PRAGMA table_info({tbl})")
+        if "symbol" not in {r[1] for r in await cur.fetchall()}:
+            continue
+        log.info("migrating %s to schema v%d", tbl, SCHEMA_VERSION)
+        new, changes = f"{tbl}_v2", f"{tbl}_v1_changes"
+        await db.execute("BEGIN IMMEDIATE")
+        await db.execute(KLINE_DDL.format(tbl=new))
+        await db.execute(f"""
+            CREATE TABLE IF NOT EXISTS {changes} (
+              seq INTEGER PRIMARY KEY,
+              symbol TEXT NOT NULL,
+              open_time INTEGER NOT NULL
+            )
+        """)
+        for event, keys in (("INSERT", "(NEW.symbol, NEW.open_time)"),
+                            ("UPDATE", "(OLD.symbol, OLD.open_time), (NEW.symbol, NEW.open_time)"),
+                            ("DELETE", "(OLD.symbol, OLD.open_time)")):
+            await db.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {changes}_{event.lower()} AFTER {event} ON {tbl}
+                BEGIN INSERT INTO {changes}(symbol, open_time) VALUES {keys}; END
+            """)
         await db.commit()
+        cur = await db.execute(f"SELECT DISTINCT symbol FROM {tbl}")
+        await db.executemany("INSERT OR IGNORE INTO symbols(name) VALUES (?)", await cur.fetchall())
+        await db.commit()
+        cur = await db.execute("SELECT id, name FROM symbols")
+        for sid, name in await cur.fetchall():
+            lo = -1
+            while lo is not None:
+                cur = await db.execute(
+                    f"SELECT open_time FROM {tbl} WHERE symbol = ? AND open_time > ?"
+                    " ORDER BY open_time LIMIT 1 OFFSET ?",
+                    (name, lo, MIGRATE_BATCH_ROWS - 1),
+                )
+                row = await cur.fetchone()
+                hi = None if row is None else row[0]
+                await db.execute("BEGIN IMMEDIATE")
+                await _sync_v1_window(db, tbl, new, sid, name, lo, hi)
+                await db.commit()
+                lo = hi
+        while True:
+            await db.execute("BEGIN IMMEDIATE")
+            replayed = await _replay_v1_changes(db, tbl, new, MIGRATE_BATCH_ROWS)
+            if replayed < MIGRATE_BATCH_ROWS:
+                break
+            await db.commit()
+        # still under the write lock: nothing can have been logged since the last replay
+        await db.execute(f"DROP TABLE {tbl}")
+        await db.execute(f"DROP TABLE {changes}")
+        await db.execute(f"ALTER TABLE {new} RENAME TO {tbl}")
+        await db.commit()
+    await db.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+    await db.commit()
+
+_V1_VALUES = ("open", "high", "low", "close", "volume", "close_time", "quote_volume",
+              "trades", "taker_buy_base", "taker_buy_quote", "is_final")
+
+async def _sync_v1_window(db: aiosqlite.Connection, tbl: str, new: str, sid: int, name: str,
+                          lo: int, hi: Optional[int]) -> None:
+    """Make ``new`` hold exactly the v1 rows of ``name`` with ``lo < open_time <= hi``.
+
+    Rows missing or different in ``new`` are written, rows gone from ``tbl`` are deleted;
+    rows already copied unchanged are only read.  ``hi`` of None means no upper bound.
+    """
+    window = "open_time > ?" + ("" if hi is None else " AND open_time <= ?")
+    args = (lo,) if hi is None else (lo, hi)
+    same = " AND ".join(f"n.{c} IS t.{c}" for c in _V1_VALUES)
+    await db.execute(f"""
+        INSERT OR REPLACE INTO {new}
+        SELECT ?, t.open_time, {", ".join("t." + c for c in _V1_VALUES)}
+        FROM {tbl} t
+        WHERE t.symbol = ? AND t.{window} AND NOT EXISTS (
+            SELECT 1 FROM {new} n WHERE n.symbol_id = ? AND n.open_time = t.open_time AND {same}
+        )
+    """, (sid, name, *args, sid))
+    await db.execute(f"""
+        DELETE FROM {new}
+        WHERE symbol_id = ? AND {window} AND NOT EXISTS (
+            SELECT 1 FROM {tbl} t WHERE t.symbol = ? AND t.open_time = {new}.open_time
+        )
+    """, (sid, *args, name))
+
+async def _replay_v1_changes(db: aiosqlite.Connection, tbl: str, new: str, limit: int) -> int:
+    """Copy the current v1 state of the oldest ``limit`` logged keys into ``new``.
+
+    Runs inside the caller's write transaction and removes what it replayed from the log;
+    returns how many log entries that was.
+    """
+    changes = f"{tbl}_v1_changes"
+    cur = await db.execute(
+        f"SELECT COUNT(*), MAX(seq) FROM (SELECT seq FROM {changes} ORDER BY seq LIMIT ?)", (limit,)
+    )
+    count, last = await cur.fetchone()
+    if not count:
+        return 0
+    await db.execute(
+        f"INSERT OR IGNORE INTO symbols(name) SELECT DISTINCT symbol FROM {changes} WHERE seq <= ?", (last,)
+    )
+    await db.execute(f"""
+        DELETE FROM {new} WHERE (symbol_id, open_time) IN (
+            SELECT s.id, c.open_time FROM {changes} c JOIN symbols s ON s.name = c.symbol
+            WHERE c.seq <= ?
+        )
+    """, (last,))
+    await db.execute(f"""
+        INSERT OR REPLACE INTO {new}
+        SELECT s.id, t.open_time, {", ".join("t." + c for c in _V1_VALUES)}
+        FROM {changes} c
+        JOIN {tbl} t ON t.symbol = c.symbol AND t.open_time = c.open_time
+        JOIN symbols s ON s.name = c.symbol
+        WHERE c.seq <= ?
+    """, (last,))
+    await db.execute(f"DELETE FROM {changes} WHERE seq <= ?", (last,))
+    return count
+
+async def _backfill_watermarks(db: aiosqlite.Connection) -> None:
+    """Seed kline_watermark from the kline tables once, for databases created before it existed."""
+    cur = await db.execute("SELECT 1 FROM kline_watermark LIMIT 1")
+    if await cur.fetchone():
+        return
+    for interval in Interval:
+        tbl = table_for_interval(interval)
+        await db.execute(
+            f"""
+            INSERT OR REPLACE INTO kline_watermark
+            (symbol, itv, first_open_time, last_open_time, row_count)
+            SELECT s.name, ?, MIN(k.open_time), MAX(k.open_time), COUNT(*)
+            FROM {tbl} k JOIN symbols s ON s.id = k.symbol_id
+            GROUP BY k.symbol_id
+            """,
+            (interval.value,),
+        )
+    await db.commit()
+
+async def _symbol_ids(db: aiosqlite.Connection, names: Iterable[str]) -> Dict[str, int]:
+    names = list(names)
+    await db.executemany("INSERT OR IGNORE INTO symbols(name) VALUES (?)", [(n,) for n in names])
+    marks = ",".join("?" * len(names))
+    cur = await db.execute(f"SELECT name, id FROM symbols WHERE name IN ({marks})", names)
+    return dict(await cur.fetchall())
+
+async def _apply_upsert(db: aiosqlite.Connection, interval: Interval, bars: List[Bar]) -> None:
+    """Write ``bars`` and advance their watermarks; the caller owns the transaction.
+
+    The row-count delta is taken from the batch's own key range, so the cost scales with the
+    batch and not with the table.
+    """
+    tbl = table_for_interval(interval)
+    spans: Dict[str, Tuple[int, int]] = {}
+    for b in bars:
+        lo, hi = spans.get(b.symbol, (b.open_time, b.open_time))
+        spans[b.symbol] = (min(lo, b.open_time), max(hi, b.open_time))
+    ids = await _symbol_ids(db, spans)
+    count_sql = f"SELECT COUNT(*) FROM {tbl} WHERE symbol_id = ? AND open_time BETWEEN ? AND ?"
+    before: Dict[str, int] = {}
+    for sym, (lo, hi) in spans.items():
+        cur = await db.execute(count_sql, (ids[sym], lo, hi))
+        before[sym] = (await cur.fetchone())[0]
+    await db.executemany(f"""
+        INSERT INTO {tbl}
+        (symbol_id, open_time, open, high, low, close, volume, close_time,
+         quote_volume, trades, taker_buy_base, taker_buy_quote, is_final)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(symbol_id, open_time) DO UPDATE SET
+          open=excluded.open, high=excluded.high, low=excluded.low, close=excluded.close,
+          volume=excluded.volume, close_time=excluded.close_time, quote_volume=excluded.quote_volume,
+          trades=excluded.trades, taker_buy_base=excluded.taker_buy_base,
+          taker_buy_quote=excluded.taker_buy_quote, is_final=excluded.is_final
+    """, [
+        (ids[b.symbol], b.open_time, b.open, b.high, b.low, b.close, b.volume,
+         b.close_time, b.quote_volume, b.trades, b.taker_buy_base, b.taker_buy_quote,
+         1 if b.is_final else 0)
+        for b in bars
+    ])
+    for sym, (lo, hi) in spans.items():
+        cur = await db.execute(count_sql, (ids[sym], lo, hi))
+        added = (await cur.fetchone())[0] - before[sym]
+        await db.execute(WATERMARK_UPSERT, (sym, interval.value, lo, hi, added))
+
+async def _apply_delete(db: aiosqlite.Connection, symbol: str, interval: Interval,
+                        start: Optional[int], end: Optional[int], only_final: bool = False) -> int:
+    """Delete one symbol's rows in ``[start, end]`` and shrink its watermark accordingly."""
+    tbl = table_for_interval(interval)
+    final = " AND is_final = 1" if only_final else ""
+    cur = await db.execute(
+        f"DELETE FROM {tbl} WHERE symbol_id = {SYMBOL_ID} AND open_time BETWEEN ? AND ?{final}",
+        (symbol, -1 if start is None else start, 2**62 if end is None else end),
+    )
+    deleted = cur.rowcount
+    if deleted <= 0:
+        return 0
+    bounds = []
+    for order in ("ASC", "DESC"):
+        cur = await db.execute(
+            f"SELECT open_time FROM {tbl} WHERE symbol_id = {SYMBOL_ID} "
+            f"ORDER BY open_time {order} LIMIT 1",
+            (symbol,),
+        )
+        row = await cur.fetchone()
+        bounds.append(row[0] if row else None)
+    if bounds[0] is None:
+        await db.execute(
+            "DELETE FROM kline_watermark WHERE symbol = ? AND itv = ?", (symbol, interval.value)
+        )
+    else:
+        await db.execute(
+            "UPDATE kline_watermark SET first_open_time = ?, last_open_time = ?, "
+            "row_count = MAX(0, row_count - ?) WHERE symbol = ? AND itv = ?",
+            (bounds[0], bounds[1], deleted, symbol, interval.value),
+        )
+    return deleted
+
+async def _apply_incremental_vacuum(db: aiosqlite.Connection, max_pages: int) -> int:
+    cur = await db.execute("PRAGMA freelist_count")
+    before = (await cur.fetchone())[0]
+    if before == 0:
+        return 0
+    # the pragma frees one page per step, and sqlite3 steps a statement without result
+    # columns once per execution (fetchall() does not step it further); executemany
+    # steps it once per parameter set, inside the writer's transaction
+    pages = min(before, int(max_pages))
+    await db.executemany(f"PRAGMA incremental_vacuum({pages})", itertools.repeat((), pages))
+    cur = await db.execute("PRAGMA freelist_count")
+    return before - (await cur.fetchone())[0]
 
 class SqliteConnectionPool:
-    """A very small async connection pool for sqlite."""
+    """A very small async connection pool for sqlite.
 
-    def __init__(self, path: str, size: int = 10):
+    Waiters are served by priority (see ``domain.ports.read_priority``), and background
+    acquirers may hold at most ``size - 1`` connections so an interactive read never
+    queues behind a pool full of long aggregation scans.
+    """
+
+    def __init__(self, path: str, size: int = 10, readonly: bool = False,
+                 pragmas: Optional[Dict[str, object]] = None):
         self.path = path
         self.size = size
-        self._pool: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue(maxsize=size)
+        self.readonly = readonly
+        self.pragmas = pragmas or {}
+        self.background_limit = max(1, size - 1)
+        self._idle: List[aiosqlite.Connection] = []
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._background_busy = 0
+        self._init_lock = asyncio.Lock()
         self._initialized = False
 
     async def _open_connection(self) -> aiosqlite.Connection:
-        db = await aiosqlite.connect(f"file:{self.path}?cache=shared", uri=True)
-        await db.execute("PRAGMA journal_mode=WAL;")
+        if self.readonly:
+            db = await aiosqlite.connect(f"file:{self.path}?mode=ro", uri=True)
+            await db.execute("PRAGMA query_only=1;")
+        else:
+            db = await aiosqlite.connect(self.path)
+            await db.execute("PRAGMA journal_mode=WAL;")
         await db.execute("PRAGMA busy_timeout=5000;")
+        for name, value in self.pragmas.items():
+            await db.execute(f"PRAGMA {name}={value};")
         await db.commit()
         return db
 
     async def init(self) -> None:
         if self._initialized:
             return
-        for _ in range(self.size):
-            conn = await self._open_connection()
-            await self._pool.put(conn)
-        self._initialized = True
+        async with self._init_lock:
+            if self._initialized:
+                return
+            for _ in range(self.size):
+                self._idle.append(await self._open_connection())
+            self._initialized = True
+
+    def _eligible(self, priority: int) -> bool:
+        return priority == PRIORITY_INTERACTIVE or self._background_busy < self.background_limit
+
+    async def _get(self, priority: int) -> aiosqlite.Connection:
+        if self._idle and not self._waiters and self._eligible(priority):
+            if priority != PRIORITY_INTERACTIVE:
+                self._background_busy += 1
+            return self._idle.pop()
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        self._dispatch()
+        try:
+            return await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self._release(fut.result(), priority)
+            raise
+
+    def _release(self, conn: aiosqlite.Connection, priority: int) -> None:
+        if priority != PRIORITY_INTERACTIVE:
+            self._background_busy -= 1
+        self._idle.append(conn)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        deferred = []
+        while self._idle and self._waiters:
+            prio, seq, fut = heapq.heappop(self._waiters)
+            if fut.done():
+                continue
+            if not self._eligible(prio):
+                deferred.append((prio, seq, fut))
+                continue
+            if prio != PRIORITY_INTERACTIVE:
+                self._background_busy += 1
+            fut.set_result(self._idle.pop())
+        for item in deferred:
+            heapq.heappush(self._waiters, item)
 
     @asynccontextmanager
-    async def acquire(self) -> aiosqlite.Connection:
+    async def acquire(self, priority: Optional[int] = None) -> aiosqlite.Connection:
         if not self._initialized:
             await self.init()
-        conn = await self._pool.get()
+        if priority is None:
+            priority = read_priority.get()
+        conn = await self._get(priority)
         try:
             yield conn
         finally:
-            await self._pool.put(conn)
+            self._release(conn, priority)
 
     async def close(self) -> None:
-        while not self._pool.empty():
-            conn = await self._pool.get()
-            await conn.close()
+        while self._idle:
+            await self._idle.pop().close()
         self._initialized = False
 
 
 class SqliteKlineRepo:
-    def __init__(self, db_url: str, pool_size: int = 10):
+    def __init__(self, db_url: str, pool_size: int = 10,
+                 write_batch_rows: int = 20_000, write_latency_ms: int = 10,
+                 mmap_size: int = 256 * 1024 * 1024, cache_size: int = -16_384,
+                 temp_store: str = "MEMORY"):
         self.path = db_url.replace("sqlite:///", "")
-        self._pool = SqliteConnectionPool(self.path, pool_size)
+        self._readers = SqliteConnectionPool(
+            self.path, pool_size, readonly=True,
+            pragmas={"mmap_size": mmap_size, "cache_size": cache_size, "temp_store": temp_store},
+        )
+        # the writer "pool" is the single connection owned by the group-commit queue
+        self._writer = SqliteWriteQueue(
+            self.path, _apply_upsert,
+            max_batch_rows=write_batch_rows, max_latency_ms=write_latency_ms,
+        )
 
     async def connect(self) -> None:
-        await self._pool.init()
+        await self._readers.init()
+        await self._writer.start()
 
     async def close(self) -> None:
-        await self._pool.close()
+        await self._writer.close()
+        await self._readers.close()
 
     async def upsert_1m(self, bars: Iterable[Bar]) -> None:
         await self.upsert(bars)
 
     async def upsert(self, bars: Iterable[Bar]) -> None:
-        bars = list(bars)
-        if not bars:
-            return
-        interval = bars[0].interval
-        tbl = table_for_interval(interval)
-        await self.connect()
-        q = f"""
-            INSERT INTO {tbl}
-            (symbol, open_time, open, high, low, close, volume, close_time,
-             quote_volume, trades, taker_buy_base, taker_buy_quote, is_final)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(symbol, open_time) DO UPDATE SET
-              open=excluded.open, high=excluded.high, low=excluded.low, close=excluded.close,
-              volume=excluded.volume, close_time=excluded.close_time, quote_volume=excluded.quote_volume,
-              trades=excluded.trades, taker_buy_base=excluded.taker_buy_base,
-              taker_buy_quote=excluded.taker_buy_quote, is_final=excluded.is_final
+        await (await self.submit(bars))
+
+    async def submit(self, bars: Iterable[Bar]) -> "asyncio.Future[None]":
+        """Queue ``bars`` on the group-commit writer without waiting for the commit.
+
+        The returned future resolves once the rows are committed, for callers that need
+        the durability ack; ``upsert`` is ``await (await submit(bars))``.
         """
-        async with self._pool.acquire() as db:
-            last_err = None
-            for _ in range(5):
-                try:
-                    await db.execute("BEGIN")
-                    await db.executemany(q, [
-                        (b.symbol, b.open_time, b.open, b.high, b.low, b.close, b.volume,
-                         b.close_time, b.quote_volume, b.trades, b.taker_buy_base, b.taker_buy_quote,
-                         1 if b.is_final else 0)
-                        for b in bars
-                    ])
-                    await db.commit()
-                    return
-                except aiosqlite.OperationalError as e:
-                    await db.rollback()
-                    last_err = e
-                    await asyncio.sleep(0.1)
-            raise last_err
+        await self.connect()
+        return self._writer.submit(list(bars))
 
     async def query(self, symbol: str, interval: Interval,
                     start: Optional[int], end: Optional[int], limit: int,
                     only_final: bool = True) -> List[Bar]:
+        rows = await self.query_raw(symbol, interval, start, end, limit, only_final)
+        return [bar_from_raw(symbol, interval, r) for r in rows]
+
+    async def query_raw(self, symbol: str, interval: Interval,
+                        start: Optional[int], end: Optional[int], limit: int,
+                        only_final: bool = True) -> List[tuple]:
+        """Rows in ``RAW_COLUMNS`` order, oldest first, exactly as the cursor returns them."""
+        sql, bounds = _window_sql(table_for_interval(interval), start, end, only_final)
+        await self.connect()
+        async with self._readers.acquire() as db:
+            cur = await db.execute(sql, [symbol, *bounds, limit])
+            rows = await cur.fetchall()
+        rows.reverse()
+        return rows
+
+    async def query_raw_many(self, symbols: Iterable[str], interval: Interval,
+                             start: Optional[int], end: Optional[int], limit: int,
+                             only_final: bool = True) -> Dict[str, List[tuple]]:
+        """``query_raw`` for several symbols, one UNION ALL of per-symbol windows per statement.
+
+        Each branch is the same index range scan ``query_raw`` does, so the statement costs
+        what the separate queries would minus their round trips.
+        """
+        window, bounds = _window_sql(table_for_interval(interval), start, end, only_final)
+        out: Dict[str, List[tuple]] = {s: [] for s in symbols}
+        names = list(out)
+        await self.connect()
+        for i in range(0, len(names), BATCH_QUERY_SYMBOLS):
+            chunk = names[i:i + BATCH_QUERY_SYMBOLS]
+            sql = " UNION ALL ".join(f"SELECT ? AS symbol, * FROM ({window})" for _ in chunk)
+            args: List[object] = []
+            for symbol in chunk:
+                args += [symbol, symbol, *bounds, limit]
+            async with self._readers.acquire() as db:
+                cur = await db.execute(sql, args)
+                for row in await cur.fetchall():
+                    out[row[0]].append(row[1:])
+        for rows in out.values():
+            rows.sort(key=lambda r: r[0])
+        return out
+
+    async def iter_raw(self, symbol: str, interval: Interval,
+                       start: Optional[int], end: Optional[int], only_final: bool = True,
+                       chunk_rows: int = 5000) -> AsyncIterator[List[tuple]]:
+        """Rows of ``[start, end]`` oldest first, in chunks of up to ``chunk_rows``.
+
+        Each chunk is a keyset seek on the primary key with a reader taken just for it, so a
+        slow consumer never holds a read snapshot open (which would stall WAL checkpoints).
+        """
         tbl = table_for_interval(interval)
-        where = ["symbol = ?"]
-        args = [symbol]
-        if start is not None:
-            where.append("open_time >= ?")
-            args.append(start)
+        where = [f"symbol_id = {SYMBOL_ID}", "open_time >= ?"]
         if end is not None:
             where.append("open_time <= ?")
-            args.append(end)
         if only_final:
             where.append("is_final = 1")
-        wsql = " AND ".join(where)
-        sql = f"""
-            SELECT symbol, open_time, open, high, low, close, volume, close_time,
-                   quote_volume, trades, taker_buy_base, taker_buy_quote, is_final
-            FROM {tbl}
-            WHERE {wsql}
-            ORDER BY open_time DESC
-            LIMIT ?
+        sql = f"SELECT {RAW_SELECT} FROM {tbl} WHERE {' AND '.join(where)} ORDER BY open_time LIMIT ?"
+        lo = start if start is not None else 0
+        await self.connect()
+        while True:
+            args: List[object] = [symbol, lo]
+            if end is not None:
+                args.append(end)
+            args.append(chunk_rows)
+            async with self._readers.acquire() as db:
+                cur = await db.execute(sql, args)
+                rows = await cur.fetchall()
+            if rows:
+                yield rows
+            if len(rows) < chunk_rows:
+                return
+            lo = rows[-1][0] + 1
+
+    async def watermark(self, symbol: str, interval: Interval) -> Optional[Watermark]:
+        await self.connect()
+        async with self._readers.acquire() as db:
+            cur = await db.execute(
+                "SELECT first_open_time, last_open_time, row_count FROM kline_watermark "
+                "WHERE symbol = ? AND itv = ?",
+                (symbol, interval.value),
+            )
+            row = await cur.fetchone()
+        return Watermark(row[0], row[1], row[2]) if row else None
+
+    async def watermarks(self) -> Dict[Tuple[str, Interval], Watermark]:
+        """Every stored (symbol, interval) series with its watermark."""
+        await self.connect()
+        async with self._readers.acquire() as db:
+            cur = await db.execute(
+                "SELECT symbol, itv, first_open_time, last_open_time, row_count FROM kline_watermark"
+            )
+            rows = await cur.fetchall()
+        return {(r[0], Interval(r[1])): Watermark(r[2], r[3], r[4]) for r in rows}
+
+    async def delete_range(self, symbol: str, interval: Interval,
+                           start: Optional[int], end: Optional[int]) -> int:
+        """Delete ``symbol``'s rows with ``start <= open_time <= end``; returns the row count."""
+        await self.connect()
+        return await self._writer.run(
+            lambda db: _apply_delete(db, symbol, interval, start, end)
+        )
+
+    async def drain_final(self, symbol: str, interval: Interval, start: int, end: int,
+                          sink: Callable[[List[tuple]], None]) -> int:
+        """Hand ``symbol``'s final rows in ``[start, end]`` to ``sink``, then delete them.
+
+        One writer op: no write lands between the read and the delete, and exactly the rows
+        ``sink`` received are deleted; open rows stay.  ``sink`` runs in a worker thread
+        inside the transaction, so if the delete does not commit the rows stay here too.
+        Returns the rows moved.
         """
-        args.append(limit)
         await self.connect()
-        async with self._pool.acquire() as db:
-            db.row_factory = aiosqlite.Row
-            cur = await db.execute(sql, args)
+        tbl = table_for_interval(interval)
+
+        async def op(db: aiosqlite.Connection) -> int:
+            cur = await db.execute(
+                f"SELECT {RAW_SELECT} FROM {tbl} WHERE symbol_id = {SYMBOL_ID} "
+                "AND open_time BETWEEN ? AND ? AND is_final = 1 ORDER BY open_time",
+                (symbol, start, end),
+            )
             rows = await cur.fetchall()
-        out: List[Bar] = []
-        for r in rows[::-1]:
-            out.append(Bar(
-                symbol=r["symbol"], interval=interval, open_time=r["open_time"],
-                open=r["open"], high=r["high"], low=r["low"], close=r["close"],
-                volume=r["volume"], quote_volume=r["quote_volume"], close_time=r["close_time"],
-                trades=r["trades"], taker_buy_base=r["taker_buy_base"], taker_buy_quote=r["taker_buy_quote"],
-                is_final=bool(r["is_final"])
-            ))
-        return out
+            if not rows:
+                return 0
+            await asyncio.to_thread(sink, rows)
+            return await _apply_delete(db, symbol, interval, start, end, only_final=True)
+
+        return await self._writer.run(op)
+
+    async def incremental_vacuum(self, max_pages: int = 4096) -> int:
+        """Return up to ``max_pages`` free pages to the OS; returns the pages released."""
+        await self.connect()
+        return await self._writer.run(lambda db: _apply_incremental_vacuum(db, max_pages))
 
     async def max_open_time(self, interval: Interval) -> Optional[int]:
-        tbl = table_for_interval(interval)
         await self.connect()
-        async with self._pool.acquire() as db:
-            cur = await db.execute(f"SELECT MAX(open_time) FROM {tbl}")
+        async with self._readers.acquire() as db:
+            cur = await db.execute(
+                "SELECT MAX(last_open_time) FROM kline_watermark WHERE itv = ?", (interval.value,)
+            )
             row = await cur.fetchone()
         return row[0] if row and row[0] is not None else None
 
     async def min_open_time(self, interval: Interval) -> Optional[int]:
-        tbl = table_for_interval(interval)
         await self.connect()
-        async with self._pool.acquire() as db:
-            cur = await db.execute(f"SELECT MIN(open_time) FROM {tbl}")
+        async with self._readers.acquire() as db:
+            cur = await db.execute(
+                "SELECT MIN(first_open_time) FROM kline_watermark WHERE itv = ?", (interval.value,)
+            )
             row = await cur.fetchone()
         return row[0] if row and row[0] is not None else None
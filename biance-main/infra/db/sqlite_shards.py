@@ -0,0 +1,341 @@
+import os
+import re
+import zlib
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import aiosqlite
+
+from domain.models import Bar, Interval, Watermark, bar_from_raw
+from infra.db.segment_repo import month_label, month_start, next_month
+from infra.db.sqlite_repo import SqliteKlineRepo, ensure_schema, table_for_interval
+
+log = logging.getLogger(__name__)
+
+# (symbol bucket, month start in ms or None when not sharding by month)
+ShardKey = Tuple[int, Optional[int]]
+
+# other processes create shards too: reads look at the directory again after this long,
+# or at once (but at most every SHARD_RESCAN_MIN_SEC) when the month they need is not known
+SHARD_RESCAN_SEC = 10.0
+SHARD_RESCAN_MIN_SEC = 1.0
+
+
+def _combine(marks: Iterable[Optional[Watermark]]) -> Optional[Watermark]:
+    out: Optional[Watermark] = None
+    for wm in marks:
+        if wm is None:
+            continue
+        if out is None:
+            out = wm
+        else:
+            out = Watermark(
+                min(out.first_open_time, wm.first_open_time),
+                max(out.last_open_time, wm.last_open_time),
+                out.count + wm.count,
+            )
+    return out
+
+
+class ShardedSqliteKlineRepo:
+    """KlineRepo spreading rows over several sqlite files.
+
+    Symbols are bucketed by ``crc32(symbol) % symbol_shards`` and, with ``by_month``, each
+    bucket gets one file per UTC calendar month, e.g. ``klines.03.2024-05.db`` next to the
+    configured ``klines.db``.  Every shard is a full :class:`SqliteKlineRepo` with its own
+    WAL and writer, so writes to different shards commit in parallel and a finished month's
+    file stops changing.  Shards are created on first write and found again on startup;
+    changing ``symbol_shards`` needs the data re-imported.  Shards another process creates
+    are picked up by reads within ``SHARD_RESCAN_SEC``, or immediately when the read's
+    newest month is one this instance has not seen.
+
+    At most ``max_open`` shards are kept open; the least recently used idle one is closed
+    when another is needed.  An unsharded ``klines.db`` holding rows is not served from:
+    :meth:`connect` refuses to start rather than answer from empty shards.
+    """
+
+    def __init__(self, db_url: str, symbol_shards: int = 1, by_month: bool = False,
+                 max_open: int = 32, **repo_kwargs):
+        path = db_url.replace("sqlite:///", "")
+        self.dir = os.path.dirname(path) or "."
+        self.stem = os.path.splitext(os.path.basename(path))[0]
+        self.symbol_shards = max(1, symbol_shards)
+        self.by_month = by_month
+        self.max_open = max(1, max_open)
+        self._repo_kwargs = repo_kwargs
+        self._keys: Dict[int, List[Optional[int]]] = {}
+        self._shards: "OrderedDict[ShardKey, SqliteKlineRepo]" = OrderedDict()
+        self._users: Dict[ShardKey, int] = {}
+        # shards that had rows deleted since their last incremental vacuum
+        self._freed: Set[ShardKey] = set()
+        self._lock = asyncio.Lock()
+        self._slots = asyncio.Semaphore(self.max_open)
+        self._discovered = False
+        self._scanned_at = 0.0
+
+    def bucket(self, symbol: str) -> int:
+        return zlib.crc32(symbol.encode()) % self.symbol_shards
+
+    def shard_key(self, symbol: str, open_time: int) -> ShardKey:
+        return self.bucket(symbol), (month_start(open_time) if self.by_month else None)
+
+    def shard_path(self, key: ShardKey) -> str:
+        bucket, month = key
+        parts = [self.stem]
+        if self.symbol_shards > 1:
+            parts.append(f"{bucket:02d}")
+        if month is not None:
+            parts.append(month_label(month))
+        return os.path.join(self.dir, ".".join(parts) + ".db")
+
+    def _add_key(self, key: ShardKey) -> None:
+        months = self._keys.setdefault(key[0], [])
+        if key[1] not in months:
+            months.append(key[1])
+            months.sort(key=lambda m: -1 if m is None else m)
+
+    def _scan(self) -> List[ShardKey]:
+        bucket_re = r"\.(\d+)" if self.symbol_shards > 1 else r"()"
+        month_re = r"\.(\d{4})-(\d{2})" if self.by_month else r"()()"
+        pattern = re.compile(re.escape(self.stem) + bucket_re + month_re + r"\.db$")
+        os.makedirs(self.dir, exist_ok=True)
+        keys = []
+        for name in os.listdir(self.dir):
+            m = pattern.match(name)
+            if not m:
+                continue
+            bucket = int(m.group(1)) if m.group(1) else 0
+            if bucket >= self.symbol_shards:
+                log.warning("ignoring shard %s: outside %d symbol shards", name, self.symbol_shards)
+                continue
+            month = None
+            if m.group(2):
+                month = int(datetime(int(m.group(2)), int(m.group(3)), 1, tzinfo=timezone.utc).timestamp() * 1000)
+            keys.append((bucket, month))
+        return keys
+
+    async def _discover(self) -> None:
+        self._scanned_at = time.monotonic()
+        for key in await asyncio.to_thread(self._scan):
+            self._add_key(key)
+
+    async def _refresh(self, symbol: Optional[str] = None, end: Optional[int] = None) -> None:
+        """Rescan the directory if the known shards are stale or miss ``symbol``'s newest month."""
+        await self.connect()
+        age = time.monotonic() - self._scanned_at
+        if age >= SHARD_RESCAN_SEC:
+            await self._discover()
+        elif symbol is not None and age >= SHARD_RESCAN_MIN_SEC:
+            bucket, month = self.shard_key(symbol, end if end is not None else int(time.time() * 1000))
+            if month not in self._keys.get(bucket, ()):
+                await self._discover()
+
+    async def _check_unsharded(self) -> None:
+        path = os.path.join(self.dir, f"{self.stem}.db")
+        if self.shard_path((0, None)) == path or not os.path.exists(path):
+            return
+        async with aiosqlite.connect(f"file:{path}?mode=ro", uri=True) as db:
+            cur = await db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+            tables = {r[0] for r in await cur.fetchall()}
+            for interval in Interval:
+                tbl = table_for_interval(interval)
+                if tbl in tables and await (await db.execute(f"SELECT 1 FROM {tbl} LIMIT 1")).fetchone():
+                    raise RuntimeError(
+                        f"{path} holds klines but sharding is enabled; the shards next to it would "
+                        f"serve none of them.  Re-import its rows into the shards and move it away, "
+                        f"or turn sharding off"
+                    )
+
+    async def _open(self, key: ShardKey) -> SqliteKlineRepo:
+        repo = self._shards.get(key)
+        if repo is not None:
+            self._shards.move_to_end(key)
+            return repo
+        async with self._lock:
+            repo = self._shards.get(key)
+            if repo is None:
+                url = "sqlite:///" + self.shard_path(key)
+                await ensure_schema(url)
+                repo = SqliteKlineRepo(url, **self._repo_kwargs)
+                await repo.connect()
+                self._shards[key] = repo
+                self._add_key(key)
+        return repo
+
+    async def _close_idle(self) -> None:
+        if len(self._shards) <= self.max_open:
+            return
+        # under the lock, so _open waits for the close instead of opening the file twice
+        async with self._lock:
+            for key in list(self._shards):
+                if len(self._shards) <= self.max_open:
+                    return
+                if self._users.get(key):
+                    continue
+                # pending writes are committed by close()
+                await self._shards.pop(key).close()
+
+    @asynccontextmanager
+    async def _use(self, key: ShardKey) -> AsyncIterator[SqliteKlineRepo]:
+        """The shard for ``key``, kept open until the block exits."""
+        self._users[key] = self._users.get(key, 0) + 1
+        try:
+            yield await self._open(key)
+        finally:
+            self._users[key] -= 1
+            if not self._users[key]:
+                del self._users[key]
+            await self._close_idle()
+
+    async def _each(self, keys: Iterable[ShardKey],
+                    fn: Callable[[SqliteKlineRepo], Awaitable[Any]]) -> List[Any]:
+        """``fn(shard)`` for every key, at most ``max_open`` shards at a time."""
+        async def one(key: ShardKey) -> Any:
+            async with self._slots:
+                async with self._use(key) as repo:
+                    return await fn(repo)
+
+        return await asyncio.gather(*(one(key) for key in keys))
+
+    def _keys_for(self, symbol: str, start: Optional[int], end: Optional[int]) -> List[ShardKey]:
+        """Shards that may hold ``symbol`` rows in ``[start, end]``, newest month first."""
+        bucket = self.bucket(symbol)
+        keys = []
+        for month in reversed(self._keys.get(bucket, [])):
+            if month is not None:
+                if start is not None and next_month(month) <= start:
+                    continue
+                if end is not None and month > end:
+                    continue
+            keys.append((bucket, month))
+        return keys
+
+    def _all_keys(self) -> List[ShardKey]:
+        return [(b, m) for b, months in self._keys.items() for m in months]
+
+    async def connect(self) -> None:
+        if not self._discovered:
+            await self._check_unsharded()
+            await self._discover()
+            self._discovered = True
+
+    async def close(self) -> None:
+        shards, self._shards = list(self._shards.values()), OrderedDict()
+        for repo in shards:
+            await repo.close()
+
+    async def upsert_1m(self, bars: Iterable[Bar]) -> None:
+        await self.upsert(bars)
+
+    async def upsert(self, bars: Iterable[Bar]) -> None:
+        await (await self.submit(bars))
+
+    async def submit(self, bars: Iterable[Bar]) -> "asyncio.Future[None]":
+        """Split ``bars`` by shard and queue each part on that shard's writer."""
+        await self.connect()
+        groups: Dict[ShardKey, List[Bar]] = {}
+        for b in bars:
+            groups.setdefault(self.shard_key(b.symbol, b.open_time), []).append(b)
+        futs = []
+        for key, part in groups.items():
+            async with self._use(key) as repo:
+                futs.append(await repo.submit(part))
+        return asyncio.ensure_future(_all_done(futs))
+
+    async def query(self, symbol: str, interval: Interval,
+                    start: Optional[int], end: Optional[int], limit: int,
+                    only_final: bool = True) -> List[Bar]:
+        rows = await self.query_raw(symbol, interval, start, end, limit, only_final)
+        return [bar_from_raw(symbol, interval, r) for r in rows]
+
+    async def query_raw(self, symbol: str, interval: Interval,
+                        start: Optional[int], end: Optional[int], limit: int,
+                        only_final: bool = True) -> List[tuple]:
+        # walk month shards newest first; the usual latest-window read stops at the first
+        await self._refresh(symbol, end)
+        chunks = []
+        remaining = limit
+        for key in self._keys_for(symbol, start, end):
+            if remaining <= 0:
+                break
+            async with self._use(key) as repo:
+                rows = await repo.query_raw(symbol, interval, start, end, remaining, only_final)
+            if rows:
+                chunks.append(rows)
+                remaining -= len(rows)
+        out: List[tuple] = []
+        for chunk in reversed(chunks):
+            out.extend(chunk)
+        return out
+
+    async def watermark(self, symbol: str, interval: Interval) -> Optional[Watermark]:
+        await self._refresh(symbol)
+        keys = self._keys_for(symbol, None, None)
+        return _combine(await self._each(keys, lambda s: s.watermark(symbol, interval)))
+
+    async def watermarks(self) -> Dict[Tuple[str, Interval], Watermark]:
+        await self._refresh()
+        out: Dict[Tuple[str, Interval], Watermark] = {}
+        for marks in await self._each(self._all_keys(), lambda s: s.watermarks()):
+            for series, wm in marks.items():
+                out[series] = _combine((out.get(series), wm))
+        return out
+
+    async def delete_range(self, symbol: str, interval: Interval,
+                           start: Optional[int], end: Optional[int]) -> int:
+        await self._refresh(symbol, end)
+        keys = self._keys_for(symbol, start, end)
+        deleted = await self._each(keys, lambda s: s.delete_range(symbol, interval, start, end))
+        self._freed.update(k for k, n in zip(keys, deleted) if n)
+        return sum(deleted)
+
+    async def drain_final(self, symbol: str, interval: Interval, start: int, end: int,
+                          sink: Callable[[List[tuple]], None]) -> int:
+        await self._refresh(symbol, end)
+        moved = 0
+        for key in self._keys_for(symbol, start, end):
+            async with self._use(key) as repo:
+                n = await repo.drain_final(symbol, interval, start, end, sink)
+            if n:
+                self._freed.add(key)
+                moved += n
+        return moved
+
+    async def incremental_vacuum(self, max_pages: int = 4096) -> int:
+        """Vacuum only the shards this process deleted rows from since their last vacuum."""
+        await self.connect()
+        keys, self._freed = list(self._freed), set()
+        return sum(await self._each(keys, lambda s: s.incremental_vacuum(max_pages)))
+
+    async def max_open_time(self, interval: Interval) -> Optional[int]:
+        # newest month first per bucket: older months cannot hold a later bar
+        return await self._edge(interval, newest=True)
+
+    async def min_open_time(self, interval: Interval) -> Optional[int]:
+        return await self._edge(interval, newest=False)
+
+    async def _edge(self, interval: Interval, newest: bool) -> Optional[int]:
+        await self._refresh()
+
+        async def bucket_edge(bucket: int) -> Optional[int]:
+            months = self._keys.get(bucket, [])
+            for month in (reversed(months) if newest else months):
+                async with self._use((bucket, month)) as repo:
+                    t = await (repo.max_open_time(interval) if newest else repo.min_open_time(interval))
+                if t is not None:
+                    return t
+            return None
+
+        found = [t for t in await asyncio.gather(*(bucket_edge(b) for b in list(self._keys))) if t is not None]
+        if not found:
+            return None
+        return max(found) if newest else min(found)
+
+
+async def _all_done(futs: List[asyncio.Future]) -> None:
+    await asyncio.gather(*futs)
@@ -0,0 +1,79 @@
+import asyncio
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from domain.models import Bar, Interval
+from domain.ports import DataVersions, TailStore
+
+
+class VersionedKlineRepo:
+    """Wraps a KlineRepo and bumps the data version of every series a write touched.
+
+    Versions move only after the write is committed, so a reader that sees the new
+    version always finds the new rows.  With a ``tail`` store, committed bars are also
+    folded into it under the version they produced, and ``on_commit`` (the push hub) is
+    handed every committed batch.  Everything else is delegated unchanged.
+    """
+
+    def __init__(self, repo, versions: DataVersions, tail: Optional[TailStore] = None,
+                 on_commit: Optional[Callable[[List[Bar]], None]] = None):
+        self.repo = repo
+        self.versions = versions
+        self.tail = tail
+        self.on_commit = on_commit
+        if hasattr(repo, "drop_expired"):
+            # only offered when the backend has it; RetentionJob probes for the attribute
+            self.drop_expired = self._drop_expired
+
+    def __getattr__(self, name: str):
+        return getattr(self.repo, name)
+
+    async def upsert_1m(self, bars: Iterable[Bar]) -> None:
+        await self.upsert(bars)
+
+    async def upsert(self, bars: Iterable[Bar]) -> None:
+        bars = list(bars)
+        await self.repo.upsert(bars)
+        await self._bump(bars)
+
+    async def submit(self, bars: Iterable[Bar]) -> "asyncio.Future[None]":
+        bars = list(bars)
+        committed = await self.repo.submit(bars)
+        return asyncio.ensure_future(self._bump_after(committed, bars))
+
+    async def delete_range(self, symbol: str, interval: Interval,
+                           start: Optional[int], end: Optional[int]) -> int:
+        deleted = await self.repo.delete_range(symbol, interval, start, end)
+        if deleted:
+            await self._forget(symbol, interval)
+        return deleted
+
+    async def _drop_expired(self, interval: Interval, cutoff: int) -> int:
+        """``drop_expired``, then a bump for every series of ``interval`` that had older rows."""
+        before = await self.repo.watermarks()
+        dropped = await self.repo.drop_expired(interval, cutoff)
+        if dropped:
+            for (symbol, itv), wm in before.items():
+                if itv == interval and wm.first_open_time < cutoff:
+                    await self._forget(symbol, interval)
+        return dropped
+
+    async def _forget(self, symbol: str, interval: Interval) -> None:
+        # rows went away: the tail cannot fold that in, so it reloads on next use
+        if self.tail is not None:
+            self.tail.invalidate(symbol, interval)
+        await self.versions.bump(symbol, interval)
+
+    async def _bump_after(self, committed: "asyncio.Future[None]", bars: List[Bar]) -> None:
+        await committed
+        await self._bump(bars)
+
+    async def _bump(self, bars: List[Bar]) -> None:
+        series: Dict[Tuple[str, Interval], List[Bar]] = {}
+        for b in bars:
+            series.setdefault((b.symbol, b.interval), []).append(b)
+        for (symbol, interval), part in series.items():
+            version = await self.versions.bump(symbol, interval)
+            if self.tail is not None:
+                self.tail.apply(symbol, interval, part, version)
+        if self.on_commit is not None:
+            self.on_commit(bars)
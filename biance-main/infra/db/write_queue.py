@@ -0,0 +1,195 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+import aiosqlite
+
+from domain.models import Bar, Interval
+
+log = logging.getLogger(__name__)
+
+ApplyFn = Callable[[aiosqlite.Connection, Interval, List[Bar]], Awaitable[None]]
+OpFn = Callable[[aiosqlite.Connection], Awaitable[Any]]
+_Job = Tuple[Union[List[Bar], OpFn], asyncio.Future]
+
+
+class SqliteWriteQueue:
+    """Write-behind queue that owns the only writing connection to a sqlite file.
+
+    Upserts submitted from any task are coalesced into one transaction until either
+    ``max_batch_rows`` rows are pending or ``max_latency_ms`` has passed since the first
+    one arrived.  Every submission gets a future that resolves once its rows are committed.
+    ``apply`` writes the rows of one interval inside the open transaction.  Other writes
+    (deletes, maintenance) go through :meth:`run` so they never contend with the upserts.
+    """
+
+    def __init__(self, path: str, apply: ApplyFn,
+                 max_batch_rows: int = 20_000, max_latency_ms: int = 10):
+        self.path = path
+        self._apply = apply
+        self.max_batch_rows = max(1, max_batch_rows)
+        self.max_latency_s = max(0, max_latency_ms) / 1000
+        self.commits = 0
+        self.rows_written = 0
+        self._queue: "asyncio.Queue[_Job]" = asyncio.Queue()
+        self._held: Optional[_Job] = None
+        self._db: Optional[aiosqlite.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        self._start_lock = asyncio.Lock()
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        async with self._start_lock:
+            if self._task is None:
+                self._db = await self._open()
+                self._task = asyncio.create_task(self._run())
+
+    async def _open(self) -> aiosqlite.Connection:
+        db = await aiosqlite.connect(self.path)
+        await db.execute("PRAGMA journal_mode=WAL;")
+        await db.execute("PRAGMA busy_timeout=5000;")
+        await db.execute("PRAGMA synchronous=NORMAL;")
+        await db.commit()
+        return db
+
+    def submit(self, bars: List[Bar]) -> asyncio.Future:
+        """Queue ``bars`` for writing and return the future acknowledging their commit."""
+        fut = asyncio.get_running_loop().create_future()
+        if not bars:
+            fut.set_result(None)
+            return fut
+        self._queue.put_nowait((bars, fut))
+        return fut
+
+    async def run(self, op: OpFn) -> Any:
+        """Run ``op(db)`` in a transaction of its own on the writer connection."""
+        fut = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((op, fut))
+        return await fut
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    async def _next(self) -> _Job:
+        if self._held is not None:
+            job, self._held = self._held, None
+            return job
+        return await self._queue.get()
+
+    async def _collect(self) -> List[_Job]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._next()]
+        if callable(batch[0][0]):
+            return batch
+        rows = len(batch[0][0])
+        deadline = loop.time() + self.max_latency_s
+        while rows < self.max_batch_rows:
+            if self._queue.empty():
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                item = self._queue.get_nowait()
+            if callable(item[0]):
+                # ops run alone; keep it for the next round
+                self._held = item
+                break
+            batch.append(item)
+            rows += len(item[0])
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            try:
+                if callable(batch[0][0]):
+                    await self._run_op(*batch[0])
+                else:
+                    await self._commit_group(batch)
+            except Exception as e:
+                if len(batch) == 1:
+                    _settle(batch, e)
+                else:
+                    # isolate the failing submission instead of failing everyone in the group
+                    log.warning("group commit of %d writes failed, retrying one by one: %s", len(batch), e)
+                    for item in batch:
+                        try:
+                            await self._commit_group([item])
+                        except Exception as item_err:
+                            _settle([item], item_err)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _transaction(self, body: OpFn) -> Any:
+        db = self._db
+        assert db is not None
+        last_err: Optional[Exception] = None
+        for _ in range(5):
+            try:
+                await db.execute("BEGIN")
+                result = await body(db)
+                await db.commit()
+                return result
+            except aiosqlite.OperationalError as e:
+                await _rollback(db)
+                last_err = e
+                await asyncio.sleep(0.1)
+            except BaseException:
+                # whatever went wrong, the connection must leave here without an open
+                # transaction, or every later BEGIN on it fails
+                await _rollback(db)
+                raise
+        assert last_err is not None
+        raise last_err
+
+    async def _run_op(self, op: OpFn, fut: asyncio.Future) -> None:
+        result = await self._transaction(op)
+        if not fut.done():
+            fut.set_result(result)
+
+    async def _commit_group(self, batch: List[_Job]) -> None:
+        by_interval: Dict[Interval, List[Bar]] = {}
+        for bars, _ in batch:
+            for b in bars:
+                by_interval.setdefault(b.interval, []).append(b)
+
+        async def body(db: aiosqlite.Connection) -> None:
+            for interval, bars in by_interval.items():
+                await self._apply(db, interval, bars)
+
+        await self._transaction(body)
+        self.commits += 1
+        self.rows_written += sum(len(v) for v in by_interval.values())
+        _settle(batch, None)
+
+
+async def _rollback(db: aiosqlite.Connection) -> None:
+    if db.in_transaction:
+        await db.rollback()
+
+
+def _settle(batch: List[_Job], err: Optional[BaseException]) -> None:
+    for _, fut in batch:
+        if fut.done():
+            continue
+        if err is None:
+            fut.set_result(None)
+        else:
+            fut.set_exception(err)
@@ -4,7 +4,7 @@ from weakref import WeakValueDictionary
 from app.settings import Settings
 from infra.fetch.binance_client import BinanceClient
 from domain.ports import KlineRepo
-from domain.models import Bar, Interval
+from domain.models import Bar, Interval, Watermark
 
 MS = {
     Interval.m1: 60_000,
@@ -22,6 +22,8 @@ def bars_for_days(days: int, interval: Interval) -> int:
     raise ValueError("unsupported interval")
 
 async def _rows_to_bars(rows: list, symbol: str, interval: Interval):
+    # the exchange also returns the bar still forming; it is final once its close time passed
+    now_ms = int(time.time() * 1000)
     out = []
     for arr in rows:
         out.append(Bar(
@@ -29,7 +31,7 @@ async def _rows_to_bars(rows: list, symbol: str, interval: Interval):
             open=float(arr[1]), high=float(arr[2]), low=float(arr[3]), close=float(arr[4]),
             volume=float(arr[5]), quote_volume=float(arr[7]), close_time=int(arr[6]),
             trades=int(arr[8]), taker_buy_base=float(arr[9]), taker_buy_quote=float(arr[10]),
-            is_final=True
+            is_final=int(arr[6]) < now_ms
         ))
     return out
 
@@ -90,18 +92,23 @@ class Fetcher:
         if interval_ms is None:
             # only 1m/4h are pulled directly; others由聚合产生
             return
+        keep_days = self.s.retention_days.get(interval.value, 0)
+        if keep_days > 0:
+            # never backfill what the retention job would delete again
+            coverage_bars = min(coverage_bars, bars_for_days(keep_days, interval))
         now_ms = int(time.time() * 1000)
         target_start = now_ms - coverage_bars * interval_ms
-        last_in_db: Optional[int] = await self.repo.max_open_time(interval)
+        wm: Optional[Watermark] = await self.repo.watermark(symbol, interval)
 
-        if last_in_db is None:
+        if wm is None:
             await self._page_forward(symbol, interval, start_ms=target_start, until_ms=now_ms)
             return
 
         # backfill to target_start if needed
-        await self._page_backward(symbol, interval, end_ms=last_in_db, until_ms=target_start)
+        if wm.first_open_time > target_start:
+            await self._page_backward(symbol, interval, end_ms=wm.first_open_time - 1, until_ms=target_start)
         # forward to now
-        await self._page_forward(symbol, interval, start_ms=last_in_db + interval_ms, until_ms=now_ms)
+        await self._page_forward(symbol, interval, start_ms=wm.last_open_time + interval_ms, until_ms=now_ms)
 
     async def _page_forward(self, symbol: str, interval: Interval, start_ms: int, until_ms: int):
         step = 1500
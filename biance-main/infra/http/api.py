@@ -1,27 +1,134 @@
-from fastapi import APIRouter, Depends, Query, Response
+import hashlib
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from app.bootstrap import AppState
-from infra.serialization import serialize_binance_klines
+from domain.models import Interval
+from domain.ports import PRIORITY_BACKGROUND, read_priority
+from infra.http.etag_middleware import not_modified, validator_headers
+from infra.serialization import (
+    COLUMNAR_MEDIA_TYPE, CSV_HEADER, pick_encoding, pick_format, serialize_csv_rows,
+    serialize_ndjson_rows,
+)
 
 router = APIRouter()
 
-def get_state() -> AppState:
-    from main import app_state
-    return app_state
+BATCH_MAX_SYMBOLS = 1000
+
+def get_state(request: Request) -> AppState:
+    return request.app.state.app_state
 
 @router.get("/fapi/v1/klines")
-async def get_klines(symbol: str,
+async def get_klines(request: Request,
+                     symbol: str,
                      interval: str,
                      startTime: int | None = Query(default=None),
                      endTime: int | None = Query(default=None),
                      limit: int = Query(default=500, ge=1, le=1500),
                      includeCurrent: bool = Query(default=False),
                      state: AppState = Depends(get_state)):
-    bars = await state.use_get_klines.handle(
-        symbol, interval, startTime, endTime, limit, only_final=(not includeCurrent)
+    only_final = not includeCurrent
+    fmt = pick_format(request.headers.get("accept"))
+    if fmt not in state.use_get_klines.encoders:
+        fmt = "json"
+    if state.hot_keys is not None:
+        state.hot_keys.observe(symbol, interval, startTime, endTime, limit, only_final)
+    found = await state.use_get_klines.validators(symbol, interval, startTime, endTime, limit, only_final, fmt)
+    payload = await state.use_get_klines.handle(symbol, interval, startTime, endTime, limit, only_final, fmt)
+    coding = pick_encoding(request.headers.get("accept-encoding"), payload.encodings)
+    etag, modified = found if found is not None else (payload.etag, None)
+    if coding is not None and not etag.startswith("W/"):
+        # a strong ETag names exact bytes, so each content-coding gets its own
+        etag = f'{etag[:-1]}-{coding}"'
+    headers = validator_headers(etag, modified)
+    if not_modified(request.headers.get("if-none-match"), request.headers.get("if-modified-since"),
+                    etag, modified):
+        return Response(status_code=304, headers=headers)
+    body = payload.body
+    if coding is not None:
+        headers["Content-Encoding"] = coding
+        body = payload.encodings[coding]
+    media_type = COLUMNAR_MEDIA_TYPE if fmt == "columnar" else "application/json"
+    return Response(content=body, media_type=media_type, headers=headers)
+
+@router.get("/fapi/v1/klines/batch")
+async def get_klines_batch(request: Request,
+                           symbols: str,
+                           intervals: str,
+                           startTime: int | None = Query(default=None),
+                           endTime: int | None = Query(default=None),
+                           limit: int = Query(default=500, ge=1, le=1500),
+                           includeCurrent: bool = Query(default=False),
+                           state: AppState = Depends(get_state)):
+    """``{symbol: {interval: klines}}`` for comma-separated ``symbols`` and ``intervals``."""
+    names = list(dict.fromkeys(s.strip() for s in symbols.split(",") if s.strip()))
+    itvs = list(dict.fromkeys(i.strip() for i in intervals.split(",") if i.strip()))
+    if not names or not itvs or len(names) > BATCH_MAX_SYMBOLS:
+        raise HTTPException(400, f"pass 1 to {BATCH_MAX_SYMBOLS} symbols and at least one interval")
+    try:
+        results = {
+            itv: await state.use_get_klines.handle_many(names, itv, startTime, endTime, limit, not includeCurrent)
+            for itv in itvs
+        }
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    # splice the cached bodies in as they are; nothing is decoded or re-encoded
+    parts = [b"{"]
+    tag = hashlib.blake2b(digest_size=16)
+    for n, symbol in enumerate(names):
+        parts.append((b"," if n else b"") + orjson.dumps(symbol) + b":{")
+        for m, itv in enumerate(itvs):
+            payload = results[itv][symbol]
+            parts += [(b"," if m else b"") + orjson.dumps(itv) + b":", payload.body]
+            tag.update(payload.etag.encode())
+        parts.append(b"}")
+    parts.append(b"}")
+    headers = validator_headers('"' + tag.hexdigest() + '"', None)
+    if not_modified(request.headers.get("if-none-match"), None, headers["ETag"], None):
+        return Response(status_code=304, headers=headers)
+    return Response(content=b"".join(parts), media_type="application/json", headers=headers)
+
+@router.get("/fapi/v1/klines/export")
+async def export_klines(symbol: str,
+                        interval: str,
+                        startTime: int | None = Query(default=None),
+                        endTime: int | None = Query(default=None),
+                        format: str = Query(default="ndjson", pattern="^(ndjson|csv)$"),
+                        includeCurrent: bool = Query(default=False),
+                        resumeAfter: int | None = Query(default=None),
+                        state: AppState = Depends(get_state)):
+    """Every kline in the range, streamed oldest first as NDJSON or CSV.
+
+    A broken download resumes with ``resumeAfter`` set to the open_time of the last row
+    received.  The body is written chunk by chunk as rows are read and never buffered.
+    """
+    try:
+        Interval(interval)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    csv = format == "csv"
+    encode = serialize_csv_rows if csv else serialize_ndjson_rows
+
+    async def body():
+        read_priority.set(PRIORITY_BACKGROUND)
+        if csv and resumeAfter is None:
+            yield CSV_HEADER
+        async for rows in state.use_export.stream(
+            symbol, interval, startTime, endTime, not includeCurrent, after=resumeAfter
+        ):
+            yield encode(rows)
+
+    return StreamingResponse(
+        body(),
+        media_type="text/csv" if csv else "application/x-ndjson",
+        headers={"Cache-Control": "no-store"},
     )
-    payload = serialize_binance_klines(bars)
-    return Response(content=payload, media_type="application/json")
 
 @router.get("/v1/health")
 async def health(state: AppState = Depends(get_state)):
     return await state.use_health.handle()
+
+@router.get("/v1/ready")
+async def ready(state: AppState = Depends(get_state)):
+    status = state.warmer.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
@@ -1,29 +1,104 @@
-import hashlib
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
-from starlette.responses import Response, StreamingResponse
-
-class KlineETagMiddleware(BaseHTTPMiddleware):
-    def _should_apply(self, request: Request) -> bool:
-        return request.method.upper() == "GET" and request.url.path.startswith("/fapi/v1/klines")
-    async def dispatch(self, request: Request, call_next):
-        if not self._should_apply(request):
-            return await call_next(request)
-        resp = await call_next(request)
-        if resp.status_code != 200:
-            return resp
-        if isinstance(resp, StreamingResponse) and not hasattr(resp, "body"):
-            body = b"".join([chunk async for chunk in resp.body_iterator])  # type: ignore
-            new_resp = Response(content=body, status_code=resp.status_code,
-                                headers=dict(resp.headers), media_type=resp.media_type,
-                                background=resp.background)
-            resp = new_resp
-        else:
-            body = await resp.body()
-        etag = '"' + hashlib.md5(body).hexdigest() + '"'
-        inm = request.headers.get("if-none-match")
-        if inm and inm == etag:
-            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "public, max-age=10"})
-        resp.headers.setdefault("ETag", etag)
-        resp.headers.setdefault("Cache-Control", "public, max-age=10")
-        return resp
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+
+from starlette.datastructures import Headers, QueryParams
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from infra.serialization import pick_format
+
+KLINES_PATH = "/fapi/v1/klines"
+CACHE_CONTROL = "public, max-age=10"
+
+
+def _opaque(tag: str) -> str:
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def not_modified(if_none_match: Optional[str], if_modified_since: Optional[str],
+                 etag: str, modified: Optional[int]) -> bool:
+    """RFC 9110 conditional GET: weak ETag comparison, If-Modified-Since only without INM."""
+    if if_none_match:
+        if if_none_match.strip() == "*":
+            return True
+        want = _opaque(etag)
+        return any(_opaque(t.strip()) == want for t in if_none_match.split(","))
+    if if_modified_since and modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return modified <= since
+    return False
+
+
+def validator_headers(etag: str, modified: Optional[int]) -> dict:
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL, "Vary": "Accept, Accept-Encoding"}
+    if modified is not None:
+        headers["Last-Modified"] = formatdate(modified, usegmt=True)
+    return headers
+
+
+def _flag(value: Optional[str]) -> bool:
+    return value is not None and value.lower() in ("1", "true", "on", "yes")
+
+
+def _int(value: Optional[str]) -> Optional[int]:
+    return None if value is None else int(value)
+
+
+class KlineETagMiddleware:
+    """Answers conditional klines GETs with 304 before the route runs.
+
+    The validators come from ``GetKlines.validators`` (the series' data version), so a
+    revalidation costs one version lookup: no query, no serialization, no body hashing.
+    Anything else, including requests the route would reject, passes through untouched;
+    the route sets the same validators on its own responses.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "GET" or scope["path"] != KLINES_PATH:
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        inm = headers.get("if-none-match")
+        ims = headers.get("if-modified-since")
+        if inm or ims:
+            state = getattr(scope["app"].state, "app_state", None)
+            key, found = await self._validators(state, scope, pick_format(headers.get("accept")))
+            if found is not None and not_modified(inm, ims, *found):
+                # the route never runs, so count the request here
+                if getattr(state, "hot_keys", None) is not None:
+                    state.hot_keys.observe(*key)
+                await send({
+                    "type": "http.response.start",
+                    "status": 304,
+                    "headers": [
+                        (k.lower().encode("latin-1"), v.encode("latin-1"))
+                        for k, v in validator_headers(*found).items()
+                    ],
+                })
+                await send({"type": "http.response.body", "body": b""})
+                return
+        await self.app(scope, receive, send)
+
+    async def _validators(self, state, scope: Scope, fmt: str):
+        """``(hot-key args, (etag, modified))``, with None validators when unavailable."""
+        if state is None:
+            return None, None
+        q = QueryParams(scope["query_string"])
+        try:
+            symbol, interval = q["symbol"], q["interval"]
+            start, end = _int(q.get("startTime")), _int(q.get("endTime"))
+            limit = int(q.get("limit", 500))
+            if not 1 <= limit <= 1500:
+                return None, None
+            only_final = not _flag(q.get("includeCurrent"))
+            if fmt not in state.use_get_klines.encoders:
+                fmt = "json"
+            found = await state.use_get_klines.validators(symbol, interval, start, end, limit, only_final, fmt)
+        except (KeyError, ValueError):
+            return None, None
+        return (symbol, interval, start, end, limit, only_final), found
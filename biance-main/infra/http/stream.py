@@ -0,0 +1,106 @@
+import asyncio
+import logging
+
+import orjson
+from fastapi import APIRouter, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+
+from domain.models import Interval
+from infra.agg.bar_hub import MAX_STREAMS, parse_streams
+
+router = APIRouter()
+log = logging.getLogger(__name__)
+
+HEARTBEAT_SEC = 15.0
+
+
+def _streams(spec: str):
+    streams = parse_streams(spec)
+    for _, interval in streams:
+        Interval(interval)
+    return streams
+
+
+@router.get("/v1/stream/klines")
+async def stream_klines(request: Request, streams: str):
+    """Server-sent events: one ``data:`` line per closed bar of the ``SYMBOL@interval`` streams."""
+    try:
+        wanted = _streams(streams)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    hub = request.app.state.app_state.bar_hub
+
+    async def events():
+        sub = hub.subscribe(wanted)
+        try:
+            while True:
+                try:
+                    msg = await asyncio.wait_for(sub.get(), HEARTBEAT_SEC)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
+                if msg is None:
+                    yield b"event: overflow\ndata: {}\n\n"
+                    return
+                yield msg[1]
+        finally:
+            hub.unsubscribe(sub)
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/v1/ws/klines")
+async def ws_klines(ws: WebSocket, streams: str = ""):
+    """Closed bars as JSON text frames.
+
+    Streams come from the ``streams`` query parameter and from
+    ``{"op": "subscribe" | "unsubscribe", "streams": ["BTCUSDT@1m", ...]}`` messages,
+    at most ``MAX_STREAMS`` per connection in total.  Bad messages get an ``error`` reply
+    and change nothing.
+    """
+    hub = ws.app.state.app_state.bar_hub
+    try:
+        wanted = _streams(streams)
+    except ValueError as e:
+        await ws.close(code=1008, reason=str(e))
+        return
+    await ws.accept()
+    sub = hub.subscribe(wanted)
+
+    async def pump():
+        while (msg := await sub.get()) is not None:
+            await ws.send_text(msg[0])
+        await ws.close(code=1013, reason="subscriber fell behind")
+
+    sender = asyncio.create_task(pump())
+    try:
+        while not sender.done():
+            req = await ws.receive_json()
+            try:
+                op = req.get("op")
+                if op not in ("subscribe", "unsubscribe"):
+                    raise ValueError(f"unknown op {op!r}, expected subscribe or unsubscribe")
+                change = _streams(",".join(req.get("streams", [])))
+                if op == "subscribe" and len(sub.streams.union(change)) > MAX_STREAMS:
+                    raise ValueError(f"at most {MAX_STREAMS} streams per connection")
+            except (AttributeError, TypeError, ValueError) as e:
+                await ws.send_text(orjson.dumps({"error": str(e)}).decode())
+                continue
+            if op == "unsubscribe":
+                hub.remove(sub, change)
+            else:
+                hub.add(sub, change)
+            await ws.send_text(orjson.dumps({"streams": sorted(f"{s}@{i}" for s, i in sub.streams)}).decode())
+    except (WebSocketDisconnect, RuntimeError, ValueError):
+        # client went away, the pump closed the socket, or the client sent something other than JSON
+        pass
+    finally:
+        hub.unsubscribe(sub)
+        sender.cancel()
+        try:
+            await sender
+        except (asyncio.CancelledError, Exception):
+            pass
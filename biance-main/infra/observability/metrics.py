@@ -0,0 +1,50 @@
+from typing import Dict
+
+from prometheus_client import REGISTRY, Counter
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# exposed on /metrics next to the instrumentator's HTTP metrics
+KLINES_CACHE = Counter(
+    "mtf_klines_cache_requests_total",
+    "GetKlines requests by cache outcome (hit, tail, miss, coalesced, peer)",
+    ["outcome"],
+)
+
+
+def record_klines_cache(outcome: str) -> None:
+    KLINES_CACHE.labels(outcome).inc()
+
+
+class CacheStatsCollector:
+    """Reads ``stats()`` of registered in-process caches at scrape time.
+
+    Caches keep plain integer counters, so the lookup path pays nothing for metrics.
+    """
+
+    def __init__(self):
+        self.caches: Dict[str, object] = {}
+
+    def collect(self):
+        counters = {
+            name: CounterMetricFamily(f"mtf_cache_{name}", f"In-process cache {name}", labels=["cache"])
+            for name in ("hits", "misses", "evictions", "expirations")
+        }
+        size = GaugeMetricFamily("mtf_cache_bytes", "Bytes held by the in-process cache", labels=["cache"])
+        items = GaugeMetricFamily("mtf_cache_items", "Entries in the in-process cache", labels=["cache"])
+        for cache_name, cache in self.caches.items():
+            stats = cache.stats()
+            for name, family in counters.items():
+                family.add_metric([cache_name], stats.get(name, 0))
+            size.add_metric([cache_name], stats.get("bytes", 0))
+            items.add_metric([cache_name], stats.get("items", 0))
+        yield from counters.values()
+        yield size
+        yield items
+
+
+_collector = CacheStatsCollector()
+REGISTRY.register(_collector)
+
+
+def register_cache(name: str, cache) -> None:
+    _collector.caches[name] = cache
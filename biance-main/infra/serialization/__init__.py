@@ -1,7 +1,22 @@
+import sys
+import gzip
+import struct
 import orjson
-from typing import Iterable, List
+from array import array
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional, gzip is always available
+    brotli = None
 from domain.models import Bar
 
+# a row's 11 values packed as its fragment key: exactly what its encoding depends on
+_ROW_KEY = struct.Struct("<qdddddqdqdd")
+# per-entry cost of the OrderedDict slot and link node, measured with tracemalloc on
+# CPython 3.11; sys.getsizeof of the key and the fragment is counted on top
+ROW_FRAGMENT_OVERHEAD = 112
+
 def serialize_binance_klines(bars: Iterable[Bar]) -> bytes:
     out: List[list] = []
     for b in bars:
@@ -20,3 +35,189 @@ def serialize_binance_klines(bars: Iterable[Bar]) -> bytes:
             "0",
         ])
     return orjson.dumps(out)
+
+def serialize_binance_rows(rows: Iterable[Sequence]) -> bytes:
+    """Same output as :func:`serialize_binance_klines` for ``KlineRepo.query_raw`` rows."""
+    s = str
+    return orjson.dumps([
+        [r[0], s(r[1]), s(r[2]), s(r[3]), s(r[4]), s(r[5]), r[6], s(r[7]), r[8], s(r[9]), s(r[10]), "0"]
+        for r in rows
+    ])
+
+def _entry_size(key: bytes, frag: bytes) -> int:
+    return sys.getsizeof(key) + sys.getsizeof(frag) + ROW_FRAGMENT_OVERHEAD
+
+class RowFragmentCache:
+    """:func:`serialize_binance_rows` that reuses the encoded JSON of final rows.
+
+    Fragments are keyed by the row's values packed into 88 bytes, which is all its
+    encoding depends on: a final row rewritten with different values simply misses, so
+    nothing ever needs invalidating, whatever symbol or interval the row belongs to.  Open
+    rows are never stored.  Entries are dropped oldest first once they take more than
+    ``max_bytes``, counted as ``sys.getsizeof`` of key and fragment plus
+    ``ROW_FRAGMENT_OVERHEAD``, which is what the process actually holds for them.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._frags: "OrderedDict[bytes, bytes]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+
+    def encode(self, rows: Iterable[Sequence]) -> bytes:
+        get = self._frags.get
+        pack = _ROW_KEY.pack
+        dumps = orjson.dumps
+        s = str
+        parts = []
+        hits = 0
+        for r in rows:
+            try:
+                key = pack(*r[:11])
+            except struct.error:  # not the column types the key assumes: encode, don't keep
+                key = None
+            frag = get(key) if key is not None else None
+            if frag is None:
+                frag = dumps([r[0], s(r[1]), s(r[2]), s(r[3]), s(r[4]), s(r[5]), r[6], s(r[7]), r[8], s(r[9]), s(r[10]), "0"])
+                if key is not None and r[11]:
+                    # orjson returns its whole ~1 KiB output buffer; keep a right-sized copy
+                    frag = memoryview(frag).tobytes()
+                    self._add(key, frag)
+            else:
+                hits += 1
+            parts.append(frag)
+        self.hits += hits
+        self.misses += len(parts) - hits
+        return b"[" + b",".join(parts) + b"]"
+
+    def _add(self, key: bytes, frag: bytes) -> None:
+        self._frags[key] = frag
+        self.bytes += _entry_size(key, frag)
+        while self.bytes > self.max_bytes and self._frags:
+            old_key, old = self._frags.popitem(last=False)
+            self.bytes -= _entry_size(old_key, old)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "bytes": self.bytes,
+            "items": len(self._frags),
+        }
+
+CSV_HEADER = (
+    b"open_time,open,high,low,close,volume,close_time,quote_volume,trades,"
+    b"taker_buy_base,taker_buy_quote\n"
+)
+
+def serialize_ndjson_rows(rows: Iterable[Sequence]) -> bytes:
+    """One Binance-style kline array per line."""
+    s = str
+    dumps = orjson.dumps
+    return b"".join(
+        dumps([r[0], s(r[1]), s(r[2]), s(r[3]), s(r[4]), s(r[5]), r[6], s(r[7]), r[8], s(r[9]), s(r[10]), "0"])
+        + b"\n"
+        for r in rows
+    )
+
+def serialize_csv_rows(rows: Iterable[Sequence]) -> bytes:
+    """Rows as CSV lines in :data:`CSV_HEADER` column order (no header)."""
+    return "".join(
+        f"{r[0]},{r[1]},{r[2]},{r[3]},{r[4]},{r[5]},{r[6]},{r[7]},{r[8]},{r[9]},{r[10]}\n"
+        for r in rows
+    ).encode()
+
+COLUMNAR_MEDIA_TYPE = "application/vnd.mtf.klines.columnar"
+COLUMNAR_MAGIC = b"MTFK"
+COLUMNAR_VERSION = 1
+# int64 ('q') and float64 ('d') columns in KlineRepo.query_raw order, is_final left out
+COLUMNAR_TYPES = "qdddddqdqdd"
+# magic, version, column count, row count, one type code per column, padded to 8 bytes
+_COLUMNAR_HEAD = struct.Struct("<4sHHI")
+COLUMNAR_HEADER_SIZE = (_COLUMNAR_HEAD.size + len(COLUMNAR_TYPES) + 7) // 8 * 8
+
+def serialize_columnar_rows(rows: Sequence[Sequence]) -> bytes:
+    """Rows as little-endian column blocks after a ``COLUMNAR_HEADER_SIZE`` byte header.
+
+    Column ``i`` of ``n`` rows starts at ``COLUMNAR_HEADER_SIZE + 8 * n * i``, so e.g.
+    ``numpy.frombuffer(body, "<f8", n, offset)`` maps it without copying or parsing.
+    """
+    head = _COLUMNAR_HEAD.pack(COLUMNAR_MAGIC, COLUMNAR_VERSION, len(COLUMNAR_TYPES), len(rows))
+    head += COLUMNAR_TYPES.encode()
+    parts = [head.ljust(COLUMNAR_HEADER_SIZE, b"\0")]
+    for i, code in enumerate(COLUMNAR_TYPES):
+        col = array(code, [r[i] for r in rows])
+        if sys.byteorder == "big":
+            col.byteswap()
+        parts.append(col.tobytes())
+    return b"".join(parts)
+
+def deserialize_columnar_rows(data: bytes) -> List[tuple]:
+    """Inverse of :func:`serialize_columnar_rows`."""
+    magic, version, ncols, n = _COLUMNAR_HEAD.unpack_from(data)
+    if magic != COLUMNAR_MAGIC or version != COLUMNAR_VERSION:
+        raise ValueError("not a columnar klines body")
+    codes = data[_COLUMNAR_HEAD.size:_COLUMNAR_HEAD.size + ncols].decode()
+    cols = []
+    offset = COLUMNAR_HEADER_SIZE
+    for code in codes:
+        col = array(code)
+        col.frombytes(data[offset:offset + 8 * n])
+        if sys.byteorder == "big":
+            col.byteswap()
+        cols.append(col)
+        offset += 8 * n
+    return list(zip(*cols))
+
+def pick_format(accept: Optional[str]) -> str:
+    """"columnar" when ``Accept`` lists the columnar media type with a non-zero q, else "json"."""
+    if not accept or COLUMNAR_MEDIA_TYPE not in accept:
+        return "json"
+    for item in accept.split(","):
+        media, *params = (p.strip() for p in item.split(";"))
+        if media != COLUMNAR_MEDIA_TYPE:
+            continue
+        for p in params:
+            if p.startswith("q="):
+                try:
+                    if float(p[2:]) == 0:
+                        return "json"
+                except ValueError:
+                    pass
+        return "columnar"
+    return "json"
+
+def _gzip(body: bytes) -> bytes:
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+def response_compressors() -> Dict[str, Callable[[bytes], bytes]]:
+    """Content-codings this process can produce, most preferred first (brotli if installed)."""
+    out: Dict[str, Callable[[bytes], bytes]] = {}
+    if brotli is not None:
+        out["br"] = lambda body: brotli.compress(body, quality=5)
+    out["gzip"] = _gzip
+    return out
+
+def pick_encoding(accept_encoding: Optional[str], available: Iterable[str]) -> Optional[str]:
+    """First of ``available`` the client accepts with a non-zero q; None means identity."""
+    if not accept_encoding:
+        return None
+    q: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        coding, *params = (p.strip() for p in item.split(";"))
+        weight = 1.0
+        for p in params:
+            if p.startswith("q="):
+                try:
+                    weight = float(p[2:])
+                except ValueError:
+                    weight = 0.0
+        q[coding.lower()] = weight
+    for coding in available:
+        if q.get(coding, q.get("*", 0.0)) > 0:
+            return coding
+    return None
@@ -15,7 +15,7 @@ log = logging.getLogger("app")
 Instrumentator().instrument(app).expose(app, include_in_schema=False, endpoint="/metrics")
 app.add_middleware(KlineETagMiddleware)
 
-for mod in ("infra.http.api", "infra.http.admin"):
+for mod in ("infra.http.api", "infra.http.admin", "infra.http.stream"):
     try:
         m = importlib.import_module(mod)
         router = getattr(m, "router", None)
@@ -0,0 +1,65 @@
+"""Compare executemany and COPY upserts on a local Postgres.
+
+    python scripts/bench_pg_upsert.py postgresql://postgres@localhost/bench --rows 1500 --rounds 20
+
+Each round writes a fresh 1500-row page (a backfill page) and then rewrites it (the
+conflict path).  Uses the ``kline_1m`` table of the given database, creating it if needed.
+"""
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from domain.models import Bar, Interval
+from infra.db.postgres_repo import PostgresKlineRepo, ensure_schema
+
+
+def _page(symbol: str, start: int, rows: int) -> list:
+    return [
+        Bar(
+            symbol=symbol, interval=Interval.m1, open_time=start + i * 60_000,
+            open=1.0, high=2.0, low=0.5, close=1.5, volume=10.0, quote_volume=15.0,
+            close_time=start + i * 60_000 + 59_999, trades=7,
+        )
+        for i in range(rows)
+    ]
+
+
+async def _bench(repo: PostgresKlineRepo, symbol: str, rows: int, rounds: int) -> tuple:
+    insert = update = 0.0
+    for r in range(rounds):
+        page = _page(symbol, r * rows * 60_000, rows)
+        t0 = time.perf_counter()
+        await repo.upsert(page)
+        t1 = time.perf_counter()
+        await repo.upsert(page)
+        insert += t1 - t0
+        update += time.perf_counter() - t1
+    return insert / rounds * 1000, update / rounds * 1000
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("db_url")
+    ap.add_argument("--rows", type=int, default=1500)
+    ap.add_argument("--rounds", type=int, default=20)
+    args = ap.parse_args()
+
+    await ensure_schema(args.db_url)
+    stamp = int(time.time())
+    for name, threshold in (("executemany", 10**9), ("copy", 1)):
+        repo = PostgresKlineRepo(args.db_url, pool_size=1, copy_threshold=threshold)
+        symbol = f"BENCH{name.upper()}{stamp}"
+        try:
+            ins, upd = await _bench(repo, symbol, args.rows, args.rounds)
+            print(f"{name:12s} insert {ins:8.1f} ms/page   conflict {upd:8.1f} ms/page")
+        finally:
+            await repo.delete_range(symbol, Interval.m1, None, None)
+            await repo.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
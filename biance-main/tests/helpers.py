@@ -0,0 +1,37 @@
+"""Builders and repo wrappers shared by the tests."""
+from typing import List
+
+from domain.models import INTERVAL_MS, Bar, Interval
+
+
+def make_bar(t: int, symbol: str = "BTCUSDT", interval: Interval = Interval.m1, **fields) -> Bar:
+    """A bar of ``interval`` opening at ``t``; ``fields`` override the fixed prices below."""
+    values = dict(
+        open=1, high=2, low=0.5, close=1, volume=1, quote_volume=1,
+        close_time=t + INTERVAL_MS[interval] - 1,
+    )
+    values.update(fields)
+    return Bar(symbol=symbol, interval=interval, open_time=t, **values)
+
+
+class CountingRepo:
+    """Delegates to ``repo`` and records the symbol(s) of every read that reaches it."""
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.calls: List[object] = []
+
+    def __getattr__(self, name: str):
+        return getattr(self.repo, name)
+
+    @property
+    def queries(self) -> int:
+        return len(self.calls)
+
+    async def query_raw(self, symbol, *args, **kwargs):
+        self.calls.append(symbol)
+        return await self.repo.query_raw(symbol, *args, **kwargs)
+
+    async def query_raw_many(self, symbols, *args, **kwargs):
+        self.calls.append(tuple(symbols))
+        return await self.repo.query_raw_many(symbols, *args, **kwargs)
@@ -6,7 +6,7 @@ from pathlib import Path
 # Ensure project root on path for imports
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 
-from domain.models import Bar, Interval
+from domain.models import Bar, Interval, Watermark
 from domain.ports import KlineRepo
 from infra.agg.aggregator_impl import Aggregator, bucket_start_ms
 
@@ -38,6 +38,11 @@ class DummyRepo(KlineRepo):
             rows = [b for b in rows if b.open_time <= end]
         return rows[:limit]
 
+    async def watermark(self, symbol, interval):
+        await asyncio.sleep(self.delay)
+        times = [b.open_time for b in self.data.get((symbol, interval), [])]
+        return Watermark(min(times), max(times), len(times)) if times else None
+
     async def max_open_time(self, interval):
         await asyncio.sleep(self.delay)
         times = [b.open_time for (s, itv), bars in self.data.items()
@@ -0,0 +1,137 @@
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+# Ensure project root on path for imports
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import orjson
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import infra.agg.aggregator_impl as aggregator_impl
+import infra.fetch.fetcher_impl as fetcher_impl
+from app.settings import Settings
+from domain.models import Interval
+from infra.agg.aggregator_impl import Aggregator
+from infra.agg.bar_hub import BarHub
+from infra.cache.versions import LocalDataVersions
+from infra.db.sqlite_repo import SqliteKlineRepo, ensure_schema
+from infra.db.versioned_repo import VersionedKlineRepo
+from infra.fetch.fetcher_impl import Fetcher
+from infra.http.stream import router
+from tests.helpers import make_bar
+
+T0 = 1_704_067_200_000  # 2024-01-01T00:00Z
+
+
+def test_only_new_closed_bars_are_pushed_and_slow_subscribers_dropped():
+    async def run():
+        hub = BarHub(queue_size=3, max_catchup=2)
+        fast = hub.subscribe([("BTCUSDT", "1m")])
+        slow = hub.subscribe([("BTCUSDT", "1m"), ("ETHUSDT", "1m")])
+
+        # a backfill pushes only its newest bars; open bars and rewrites never go out
+        hub.publish([make_bar(i * 60_000) for i in range(10)] + [make_bar(10 * 60_000, is_final=False)])
+        hub.publish([make_bar(9 * 60_000), make_bar(0, "XRPUSDT")])
+        got = [orjson.loads((await fast.get())[0])["k"][0] for _ in range(2)]
+        assert got == [8 * 60_000, 9 * 60_000] and fast.queue.empty()
+
+        hub.publish([make_bar(10 * 60_000)])
+        assert orjson.loads((await fast.get())[0])["k"][0] == 10 * 60_000
+        hub.publish([make_bar(11 * 60_000)])
+        assert slow.overflowed and await slow.get() is None
+        assert hub.stats() == {"streams": 1, "subscriptions": 1, "published": 4, "dropped": 1}
+
+    asyncio.run(run())
+
+
+def test_websocket_subscribers_receive_closed_bars():
+    app = FastAPI()
+    app.include_router(router)
+    hub = BarHub()
+    app.state.app_state = SimpleNamespace(bar_hub=hub)
+
+    async def publish(bars):
+        hub.publish(bars)
+
+    with TestClient(app) as client:
+        with client.websocket_connect("/v1/ws/klines?streams=btcusdt@1m") as ws:
+            ws.send_json({"op": "subscribe", "streams": ["ETHUSDT@1m"]})
+            assert ws.receive_json() == {"streams": ["BTCUSDT@1m", "ETHUSDT@1m"]}
+            client.portal.call(publish, [make_bar(60_000), make_bar(0, "ETHUSDT")])
+            got = sorted((m["s"], m["k"][0]) for m in (ws.receive_json(), ws.receive_json()))
+            assert got == [("BTCUSDT", 60_000), ("ETHUSDT", 0)]
+            ws.send_json({"op": "subscribe", "streams": ["BTCUSDT@7m"]})
+            assert "error" in ws.receive_json()
+            ws.send_json({"op": "subscrbe", "streams": ["XRPUSDT@1m"]})
+            assert "error" in ws.receive_json()
+
+            # the cap covers everything the connection holds, not each message
+            ws.send_json({"op": "subscribe", "streams": [f"S{i}USDT@1m" for i in range(150)]})
+            assert len(ws.receive_json()["streams"]) == 152
+            ws.send_json({"op": "subscribe", "streams": [f"S{i}USDT@5m" for i in range(100)]})
+            assert "error" in ws.receive_json()
+            assert hub.stats()["subscriptions"] == 152
+        assert hub.stats()["subscriptions"] == 0
+        r = client.get("/v1/stream/klines", params={"streams": "BTCUSDT"})
+        assert r.status_code == 400
+
+
+class FakeClient:
+    def __init__(self):
+        self.rows = []
+
+    async def klines(self, symbol, interval, limit=1500, startTime=None, endTime=None):
+        return self.rows[-limit:]
+
+    async def aclose(self):
+        pass
+
+
+def _row(t: int, close: float):
+    return [t, "1", "4", "0.5", str(close), "2", t + 59_999, "3", 5, "1", "1.5", "0"]
+
+
+def test_forming_bars_are_pushed_once_they_close(tmp_path: Path, monkeypatch):
+    db_url = f"sqlite:///{tmp_path / 'k.db'}"
+    clock = [0.0]
+    monkeypatch.setattr(fetcher_impl, "time", SimpleNamespace(time=lambda: clock[0]))
+    monkeypatch.setattr(aggregator_impl, "time", lambda: clock[0])
+
+    async def run():
+        await ensure_schema(db_url)
+        hub = BarHub()
+        sub = hub.subscribe([("BTCUSDT", "1m"), ("BTCUSDT", "3m")])
+        repo = VersionedKlineRepo(SqliteKlineRepo(db_url, pool_size=1), LocalDataVersions(),
+                                  on_commit=hub.publish)
+        fetcher = Fetcher(Settings(), repo)
+        await fetcher.aclose()
+        fetcher.client = FakeClient()
+        agg = Aggregator(repo)
+
+        async def tick(now_ms: int, rows):
+            clock[0] = now_ms / 1000
+            fetcher.client.rows = rows
+            await fetcher.incremental_fetch_symbol("BTCUSDT")
+            await agg.aggregate_symbol("BTCUSDT", Interval.m3)
+            out = []
+            while not sub.queue.empty():
+                m = orjson.loads((await sub.get())[0])
+                out.append((m["i"], m["k"][0], m["k"][4]))
+            return out
+
+        # the exchange serves the forming minute with its current close; nothing goes out for it
+        assert await tick(T0 + 90_000, [_row(T0, 1), _row(T0 + 60_000, 1.5)]) == [("1m", T0, "1.0")]
+        # next poll: that minute closed with different values, and those are what subscribers get
+        assert await tick(T0 + 125_000, [_row(T0 + 60_000, 2.5), _row(T0 + 120_000, 9)]) == [
+            ("1m", T0 + 60_000, "2.5")]
+        # the 3m bucket is rebuilt while open and pushed once its last minute is in
+        assert await tick(T0 + 185_000, [_row(T0 + 120_000, 3), _row(T0 + 180_000, 9)]) == [
+            ("1m", T0 + 120_000, "3.0"), ("3m", T0, "3.0")]
+        rows = await repo.query_raw("BTCUSDT", Interval.m3, None, None, 10, only_final=False)
+        assert [(r[0], r[4], r[11]) for r in rows] == [(T0, 3.0, 1)]
+        await repo.close()
+
+    asyncio.run(run())
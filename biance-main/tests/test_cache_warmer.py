@@ -0,0 +1,107 @@
+import asyncio
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+# Ensure project root on path for imports
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.lifecycle import on_startup
+from app.settings import Settings
+from domain.ports import PRIORITY_BACKGROUND, read_priority
+from domain.usecases import GetKlines
+from infra.cache.lru_cache import LRUCache
+from infra.cache.warmer import CacheWarmer, HotKeys
+from infra.fetch.fetcher_impl import Fetcher
+
+ROWS = [(i * 60_000, 1.0, 2.0, 0.5, 1.5, 3.0, i * 60_000 + 59_999, 4.5, 7, 1.0, 1.5, 1) for i in range(3)]
+
+
+class RecordingRepo:
+    def __init__(self):
+        self.calls = []
+
+    async def query_raw(self, symbol, interval, start, end, limit, only_final=True):
+        self.calls.append((symbol, interval.value, limit, read_priority.get()))
+        return ROWS[-limit:]
+
+
+def test_hot_keys_survive_a_restart_and_warm_the_cache(tmp_path: Path):
+    path = str(tmp_path / "hot.json")
+    hot = HotKeys(path, top_k=2)
+    for _ in range(3):
+        hot.record("BTCUSDT", "1m", 500, True)
+    hot.record("ETHUSDT", "5m", 100, False)
+    hot.record("ETHUSDT", "5m", 100, False)
+    hot.record("XRPUSDT", "1h", 10, True)
+    asyncio.run(hot.save())
+
+    restarted = HotKeys(path, top_k=2)
+    restarted.load()
+    assert restarted.top() == [("BTCUSDT", "1m", 500, True), ("ETHUSDT", "5m", 100, False)]
+
+    async def run():
+        repo = RecordingRepo()
+        use = GetKlines(repo, LRUCache())
+        warmer = CacheWarmer(use, restarted)
+        assert warmer.status() == {"ready": False, "warmed": 0, "total": 0}
+        await warmer.schedule()
+        assert warmer.status() == {"ready": True, "warmed": 2, "total": 2}
+        assert sorted(repo.calls) == [
+            ("BTCUSDT", "1m", 500, PRIORITY_BACKGROUND),
+            ("ETHUSDT", "5m", 100, PRIORITY_BACKGROUND),
+        ]
+        # the first client request is a cache hit
+        await use.handle("BTCUSDT", "1m", None, None, 500)
+        assert len(repo.calls) == 2
+
+    asyncio.run(run())
+
+
+def test_counts_decay_on_wall_clock_not_per_pass(tmp_path: Path):
+    start = time.monotonic()
+    hot = HotKeys(str(tmp_path / "hot.json"), top_k=5, half_life_s=60)
+    for _ in range(8):
+        hot.record("BTCUSDT", "1m", 500, True)
+    hot.record("ETHUSDT", "1m", 500, True)
+
+    # any number of warm passes inside one half-life leave the counts alone
+    for _ in range(10):
+        hot.decay(start + 59)
+    assert hot.top() == [("BTCUSDT", "1m", 500, True), ("ETHUSDT", "1m", 500, True)]
+
+    hot.decay(start + 130)  # two half-lives: 8 -> 2, 1 -> gone
+    assert hot.top() == [("BTCUSDT", "1m", 500, True)]
+    hot.decay(start + 179)
+    assert hot.top() == [("BTCUSDT", "1m", 500, True)]
+
+
+def test_node_gets_ready_when_the_initial_fetch_fails(tmp_path: Path, monkeypatch):
+    async def exchange_down(self, symbols):
+        raise RuntimeError("exchange down")
+
+    async def idle(self, symbols):
+        await asyncio.sleep(3600)
+
+    monkeypatch.setattr(Fetcher, "initial_fetch_all", exchange_down)
+    monkeypatch.setattr(Fetcher, "incremental_fetch_all", idle)
+    hot = HotKeys(str(tmp_path / "hot.json"))
+    hot.record("BTCUSDT", "1m", 500, True)
+
+    async def run():
+        repo = RecordingRepo()
+        warmer = CacheWarmer(GetKlines(repo, LRUCache()), hot)
+        state = SimpleNamespace(settings=Settings(ENABLE_AGGREGATOR=False), kline_repo=repo, warmer=warmer,
+                                tasks=[], fetcher=None, aggregator=None)
+        on_startup(state)()
+        await state.tasks[0]
+        while not warmer.status()["ready"]:
+            await asyncio.sleep(0.01)
+        assert [c[0] for c in repo.calls] == ["BTCUSDT"]
+        for t in state.tasks:
+            t.cancel()
+        await asyncio.gather(*state.tasks, return_exceptions=True)
+        await state.fetcher.aclose()
+
+    asyncio.run(asyncio.wait_for(run(), 10))
@@ -7,7 +7,8 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 
 from domain.models import Bar, Interval
-from infra.db.sqlite_repo import SqliteKlineRepo, ensure_schema
+from domain.ports import PRIORITY_BACKGROUND
+from infra.db.sqlite_repo import SqliteConnectionPool, SqliteKlineRepo, ensure_schema
 
 
 def _sample_bars(n: int):
@@ -62,3 +63,31 @@ def test_parallel_faster_than_sequential(tmp_path: Path):
     seq, par = asyncio.run(run())
     # Parallel time should be lower than sequential when connections are pooled
     assert par < seq
+
+
+def test_background_reads_leave_a_connection_for_interactive(tmp_path: Path):
+    db_url = f"sqlite:///{tmp_path / 'prio.db'}"
+
+    async def run():
+        await ensure_schema(db_url)
+        pool = SqliteConnectionPool(db_url.replace("sqlite:///", ""), size=2, readonly=True)
+        order = []
+
+        async def background(name: str, hold: float):
+            async with pool.acquire(PRIORITY_BACKGROUND):
+                order.append(name)
+                await asyncio.sleep(hold)
+
+        async def interactive():
+            async with pool.acquire():
+                order.append("api")
+
+        bg = [asyncio.create_task(background("scan1", 0.1)),
+              asyncio.create_task(background("scan2", 0.1))]
+        await asyncio.sleep(0.01)
+        await asyncio.wait_for(interactive(), timeout=0.05)
+        await asyncio.gather(*bg)
+        await pool.close()
+        return order
+
+    assert asyncio.run(run()) == ["scan1", "api", "scan2"]
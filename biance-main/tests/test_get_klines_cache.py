@@ -0,0 +1,198 @@
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+# Ensure project root on path for imports
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import infra.cache.versions as versions_mod
+from domain.models import Interval
+from domain.usecases import GetKlines
+from infra.agg.ring_buffer import RingBuffer
+from infra.cache.lru_cache import LRUCache
+from infra.cache.versions import LocalDataVersions
+from infra.db.sqlite_repo import SqliteKlineRepo, ensure_schema
+from infra.db.versioned_repo import VersionedKlineRepo
+from tests.helpers import CountingRepo, make_bar
+
+
+def test_upsert_invalidates_cached_klines(tmp_path: Path):
+    db_url = f"sqlite:///{tmp_path / 'v.db'}"
+
+    async def run():
+        await ensure_schema(db_url)
+        versions = LocalDataVersions()
+        repo = VersionedKlineRepo(SqliteKlineRepo(db_url, pool_size=1), versions)
+        reads = CountingRepo(repo)
+        use = GetKlines(reads, LRUCache(), ttl_s=3600, versions=versions)
+        await repo.upsert([make_bar(i * 60_000) for i in range(10)])
+
+        first = await use.handle("BTCUSDT", "1m", None, None, 500)
+        assert len(json.loads(first.body)) == 10
+        assert await use.handle("BTCUSDT", "1m", None, None, 500) == first
+        assert reads.queries == 1
+
+        # the new bar is visible right away despite the hour-long TTL
+        await repo.upsert([make_bar(10 * 60_000)])
+        second = await use.handle("BTCUSDT", "1m", None, None, 500)
+        assert len(json.loads(second.body)) == 11
+        assert second.etag != first.etag
+        assert reads.queries == 2
+
+        # a write to another series leaves this one's version alone
+        btc = await versions.get("BTCUSDT", Interval.m1)
+        eth = await versions.get("ETHUSDT", Interval.m1)
+        await (await repo.submit([make_bar(0, "ETHUSDT")]))
+        assert await versions.get("BTCUSDT", Interval.m1) == btc
+        assert await versions.get("ETHUSDT", Interval.m1) == eth + 1
+        await repo.close()
+
+    asyncio.run(run())
+
+
+class RecordingCache(LRUCache):
+    def __init__(self):
+        super().__init__()
+        self.ttls = []
+
+    async def set_bytes(self, key, data, ttl_s):
+        self.ttls.append(ttl_s)
+        await super().set_bytes(key, data, ttl_s)
+
+
+class OneRowRepo:
+    async def query_raw(self, symbol, interval, start, end, limit, only_final=True):
+        return [(0, 1.0, 1.0, 1.0, 1.0, 1.0, 3_599_999, 1.0, 0, 0.0, 0.0, 1)]
+
+
+def test_closed_history_gets_the_long_ttl():
+    cache = RecordingCache()
+    use = GetKlines(OneRowRepo(), cache, ttl_s=10, versions=LocalDataVersions(), history_ttl_s=3600)
+
+    async def run():
+        await use.handle("BTCUSDT", "1h", 0, 3_600_000, 10)
+        await use.handle("BTCUSDT", "1h", 0, None, 10)
+
+    asyncio.run(run())
+    assert cache.ttls == [3600, 10]
+
+
+def test_workers_with_private_versions_never_share_validators(monkeypatch):
+    # two worker processes started in the same millisecond count from the same epoch
+    monkeypatch.setattr(versions_mod, "time", SimpleNamespace(time=lambda: 1_700_000_000.0))
+    a, b = LocalDataVersions(), LocalDataVersions()
+
+    async def run():
+        assert await a.get("BTCUSDT", Interval.m1) == await b.get("BTCUSDT", Interval.m1)
+        tags = [
+            await GetKlines(OneRowRepo(), LRUCache(), versions=v).validators("BTCUSDT", "1m", None, None, 500)
+            for v in (a, b)
+        ]
+        assert tags[0][0] != tags[1][0]
+
+    asyncio.run(run())
+
+
+class ExpiringRepo:
+    """A partitioned backend: whole months go away without a delete_range."""
+
+    def __init__(self, repo):
+        self.repo = repo
+
+    def __getattr__(self, name):
+        return getattr(self.repo, name)
+
+    async def drop_expired(self, interval, cutoff):
+        return await self.repo.delete_range("BTCUSDT", interval, None, cutoff - 1)
+
+
+def test_dropped_partitions_move_the_version_and_drop_the_tail(tmp_path: Path):
+    db_url = f"sqlite:///{tmp_path / 'drop.db'}"
+
+    async def run():
+        await ensure_schema(db_url)
+        versions = LocalDataVersions()
+        tail = RingBuffer(capacity=50)
+        repo = VersionedKlineRepo(ExpiringRepo(SqliteKlineRepo(db_url, pool_size=1)), versions, tail=tail)
+        use = GetKlines(repo, LRUCache(), ttl_s=3600, versions=versions, tail=tail)
+        await repo.upsert([make_bar(i * 60_000) for i in range(10)])
+        assert len(json.loads((await use.handle("BTCUSDT", "1m", None, None, 100)).body)) == 10
+
+        before = await versions.get("BTCUSDT", Interval.m1)
+        assert await repo.drop_expired(Interval.m1, 5 * 60_000) == 5
+        assert await versions.get("BTCUSDT", Interval.m1) > before
+        assert tail.stats()["items"] == 0
+        assert len(json.loads((await use.handle("BTCUSDT", "1m", None, None, 100)).body)) == 5
+        # backends without partitions do not grow the method
+        assert not hasattr(VersionedKlineRepo(repo.repo.repo, versions), "drop_expired")
+        await repo.close()
+
+    asyncio.run(run())
+
+
+class SlowRepo:
+    def __init__(self):
+        self.queries = 0
+
+    async def query_raw(self, symbol, interval, start, end, limit, only_final=True):
+        self.queries += 1
+        await asyncio.sleep(0.05)
+        return [(0, 1.0, 1.0, 1.0, 1.0, 1.0, 59_999, 1.0, 0, 0.0, 0.0, 1)]
+
+
+def test_concurrent_misses_share_one_query():
+    events = []
+    repo = SlowRepo()
+    use = GetKlines(repo, LRUCache(), on_event=events.append)
+
+    async def run():
+        results = await asyncio.gather(*(use.handle("BTCUSDT", "1m", None, None, 500) for _ in range(50)))
+        assert all(r == results[0] for r in results)
+        # a caller that gives up does not fail the others waiting on the same fill
+        first = asyncio.ensure_future(use.handle("ETHUSDT", "1m", None, None, 500))
+        second = asyncio.ensure_future(use.handle("ETHUSDT", "1m", None, None, 500))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert len(json.loads((await second).body)) == 1
+        await use.handle("BTCUSDT", "1m", None, None, 500)
+
+    asyncio.run(run())
+    assert repo.queries == 2
+    assert events.count("miss") == 2
+    assert events.count("coalesced") == 50
+    assert events.count("hit") == 1
+
+
+def test_ranges_snap_to_bar_boundaries(tmp_path: Path):
+    assert GetKlines.normalize(Interval.m1, 60_001, 179_999) == (120_000, 120_000)
+    assert GetKlines.normalize(Interval.m1, 120_000, 120_000) == (120_000, 120_000)
+    now = int(time.time() * 1000)
+    assert GetKlines.normalize(Interval.m1, None, now) == (None, None)
+
+    db_url = f"sqlite:///{tmp_path / 'n.db'}"
+
+    async def run():
+        await ensure_schema(db_url)
+        versions = LocalDataVersions()
+        tail = RingBuffer(capacity=100)
+        repo = VersionedKlineRepo(SqliteKlineRepo(db_url, pool_size=1), versions, tail=tail)
+        reads = CountingRepo(repo)
+        use = GetKlines(reads, LRUCache(), ttl_s=3600, versions=versions, tail=tail)
+        await repo.upsert([make_bar(i * 60_000) for i in range(20)])
+
+        # polling with endTime=now reuses one latest-window fill
+        latest = await use.handle("BTCUSDT", "1m", None, now, 50)
+        assert await use.handle("BTCUSDT", "1m", None, now + 1234, 50) == latest
+        assert await use.handle("BTCUSDT", "1m", None, None, 50) == latest
+        assert reads.queries == 1
+
+        # start-only windows are cut from the same rows
+        rows = json.loads((await use.handle("BTCUSDT", "1m", 15 * 60_000 - 1, None, 50)).body)
+        assert [r[0] for r in rows] == [i * 60_000 for i in range(15, 20)]
+        assert reads.queries == 1
+        await repo.close()
+
+    asyncio.run(run())
@@ -0,0 +1,150 @@
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+# Ensure project root on path for imports
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from domain.models import Interval
+from domain.usecases import GetKlines
+from infra.cache.lru_cache import LRUCache
+from infra.cache.versions import LocalDataVersions
+from infra.http.api import router
+from infra.http.etag_middleware import KlineETagMiddleware
+from infra.serialization import (
+    COLUMNAR_MEDIA_TYPE, deserialize_columnar_rows, response_compressors, serialize_binance_rows,
+    serialize_columnar_rows,
+)
+from tests.helpers import CountingRepo
+
+ROWS = [(i * 60_000, 1.0, 2.0, 0.5, 1.5, 3.0, i * 60_000 + 59_999, 4.5, 7, 1.0, 1.5, 1) for i in range(3)]
+
+
+class StaticRepo:
+    async def query_raw(self, symbol, interval, start, end, limit, only_final=True):
+        return ROWS[-limit:]
+
+
+def test_klines_served_with_cached_etag():
+    app = FastAPI()
+    app.add_middleware(KlineETagMiddleware)
+    app.include_router(router)
+    use = GetKlines(StaticRepo(), LRUCache(), encode=serialize_binance_rows)
+    app.state.app_state = SimpleNamespace(use_get_klines=use, hot_keys=None)
+
+    with TestClient(app) as client:
+        r = client.get("/fapi/v1/klines", params={"symbol": "BTCUSDT", "interval": "1m"})
+        assert r.status_code == 200
+        assert r.content == serialize_binance_rows(ROWS)
+        etag = r.headers["etag"]
+
+        r = client.get("/fapi/v1/klines", params={"symbol": "BTCUSDT", "interval": "1m"},
+                       headers={"If-None-Match": etag})
+        assert r.status_code == 304
+        assert r.headers["etag"] == etag
+
+
+def test_revalidation_answered_from_the_data_version():
+    app = FastAPI()
+    app.add_middleware(KlineETagMiddleware)
+    app.include_router(router)
+    repo = CountingRepo(StaticRepo())
+    versions = LocalDataVersions()
+    use = GetKlines(repo, LRUCache(), versions=versions, encode=serialize_binance_rows)
+    seen = []
+    hot_keys = SimpleNamespace(observe=lambda *key: seen.append(key))
+    app.state.app_state = SimpleNamespace(use_get_klines=use, hot_keys=hot_keys)
+    params = {"symbol": "BTCUSDT", "interval": "1m", "limit": 2}
+
+    with TestClient(app) as client:
+        r = client.get("/fapi/v1/klines", params=params)
+        assert "last-modified" not in r.headers  # no write seen yet
+        asyncio.run(versions.bump("BTCUSDT", Interval.m1))
+        r = client.get("/fapi/v1/klines", params=params)
+        etag, modified = r.headers["etag"], r.headers["last-modified"]
+        assert etag.startswith('W/"')
+        assert repo.queries == 2
+
+        # neither conditional form reaches the route, let alone the repo
+        use.handle = None
+        r = client.get("/fapi/v1/klines", params=params, headers={"If-None-Match": f'"x", {etag[2:]}'})
+        assert r.status_code == 304 and r.headers["etag"] == etag
+        r = client.get("/fapi/v1/klines", params=params, headers={"If-Modified-Since": modified})
+        assert r.status_code == 304
+        del use.handle
+        assert len(seen) == 4  # each request counted once, wherever it was answered
+
+        # a write moves the version, so the old validators no longer match
+        asyncio.run(versions.bump("BTCUSDT", Interval.m1))
+        r = client.get("/fapi/v1/klines", params=params, headers={"If-None-Match": etag})
+        assert r.status_code == 200 and r.headers["etag"] != etag
+        r = client.get("/fapi/v1/klines", params=params, headers={"If-Modified-Since": modified})
+        assert r.status_code == 200 and r.headers["last-modified"] != modified
+        assert repo.queries == 3
+        assert len(seen) == 6
+
+
+def test_columnar_variant_is_negotiated_and_cached_separately():
+    app = FastAPI()
+    app.add_middleware(KlineETagMiddleware)
+    app.include_router(router)
+    repo = CountingRepo(StaticRepo())
+    use = GetKlines(repo, LRUCache(), versions=LocalDataVersions(), encode=serialize_binance_rows,
+                    formats={"columnar": serialize_columnar_rows})
+    app.state.app_state = SimpleNamespace(use_get_klines=use, hot_keys=None)
+    params = {"symbol": "BTCUSDT", "interval": "1m"}
+    columnar = {"Accept": COLUMNAR_MEDIA_TYPE}
+
+    with TestClient(app) as client:
+        js = client.get("/fapi/v1/klines", params=params)
+        col = client.get("/fapi/v1/klines", params=params, headers=columnar)
+        assert col.headers["content-type"] == COLUMNAR_MEDIA_TYPE
+        assert col.headers["vary"] == "Accept, Accept-Encoding"
+        assert deserialize_columnar_rows(col.content) == [r[:11] for r in ROWS]
+        assert col.headers["etag"] != js.headers["etag"]
+        assert repo.queries == 2
+
+        r = client.get("/fapi/v1/klines", params=params, headers={**columnar, "If-None-Match": col.headers["etag"]})
+        assert r.status_code == 304
+        r = client.get("/fapi/v1/klines", params=params, headers={"If-None-Match": col.headers["etag"]})
+        assert r.status_code == 200 and r.content == js.content
+        assert repo.queries == 2
+
+
+class BigRepo:
+    rows = [(i * 60_000, 1.5, 2.5, 0.5, 1.25, 3.0, i * 60_000 + 59_999, 4.5, 7, 1.0, 1.5, 1) for i in range(300)]
+
+    async def query_raw(self, symbol, interval, start, end, limit, only_final=True):
+        return self.rows[-limit:]
+
+
+def test_precompressed_variants_follow_accept_encoding():
+    app = FastAPI()
+    app.include_router(router)
+    repo = CountingRepo(BigRepo())
+    use = GetKlines(repo, LRUCache(), encode=serialize_binance_rows, compressors={"gzip": response_compressors()["gzip"]},
+                    compress_min_bytes=1024)
+    app.state.app_state = SimpleNamespace(use_get_klines=use, hot_keys=None)
+    big = {"symbol": "BTCUSDT", "interval": "1m", "limit": 300}
+    small = {**big, "limit": 2}
+
+    with TestClient(app) as client:
+        r = client.get("/fapi/v1/klines", params=big, headers={"Accept-Encoding": "gzip"})
+        assert r.headers["content-encoding"] == "gzip"
+        assert int(r.headers["content-length"]) < len(r.content)
+        assert r.content == serialize_binance_rows(BigRepo.rows)
+        gz_etag = r.headers["etag"]
+
+        r = client.get("/fapi/v1/klines", params=big, headers={"Accept-Encoding": "gzip;q=0, br"})
+        assert "content-encoding" not in r.headers
+        assert r.headers["etag"] != gz_etag
+        r = client.get("/fapi/v1/klines", params=big, headers={"Accept-Encoding": "*", "If-None-Match": gz_etag})
+        assert r.status_code == 304
+        assert repo.queries == 1
+
+        r = client.get("/fapi/v1/klines", params=small, headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in r.headers
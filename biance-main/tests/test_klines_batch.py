@@ -0,0 +1,111 @@
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+# Ensure project root on path for imports
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import orjson
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from domain.models import Interval
+from domain.usecases import GetKlines
+from infra.cache.lru_cache import LRUCache
+from infra.db.sqlite_repo import SqliteKlineRepo, ensure_schema
+from infra.http.api import router
+from infra.serialization import serialize_binance_rows
+from tests.helpers import CountingRepo, make_bar
+
+SYMBOLS = [f"S{i:03d}USDT" for i in range(450)]
+
+
+def test_query_raw_many_matches_query_raw(tmp_path: Path):
+    db_url = f"sqlite:///{tmp_path / 'b.db'}"
+
+    async def run():
+        await ensure_schema(db_url)
+        repo = SqliteKlineRepo(db_url, pool_size=1)
+        bars = [make_bar(i * 60_000, s) for n, s in enumerate(SYMBOLS) for i in range(n % 7)]
+        await repo.upsert(bars + [make_bar(6 * 60_000, SYMBOLS[6], is_final=False)])
+        for args in ((None, None, 3, True), (60_000, 240_000, 10, True), (None, None, 10, False)):
+            many = await repo.query_raw_many(SYMBOLS + ["NOPE"], Interval.m1, *args)
+            for symbol in SYMBOLS[:20] + SYMBOLS[-5:] + ["NOPE"]:
+                assert many[symbol] == await repo.query_raw(symbol, Interval.m1, *args)
+        await repo.close()
+
+    asyncio.run(run())
+
+
+def test_batch_endpoint_reuses_single_key_cache(tmp_path: Path):
+    db_url = f"sqlite:///{tmp_path / 'e.db'}"
+    asyncio.run(ensure_schema(db_url))
+    app = FastAPI()
+    app.include_router(router)
+    repo = CountingRepo(SqliteKlineRepo(db_url, pool_size=1))
+    use = GetKlines(repo, LRUCache(), encode=serialize_binance_rows)
+    app.state.app_state = SimpleNamespace(use_get_klines=use, hot_keys=None)
+
+    with TestClient(app) as client:
+        client.portal.call(repo.repo.upsert, [
+            make_bar(i * 60_000, s, interval=itv)
+            for s in ("BTCUSDT", "ETHUSDT") for itv in (Interval.m1, Interval.m5) for i in range(3)
+        ])
+        single = client.get("/fapi/v1/klines", params={"symbol": "ETHUSDT", "interval": "5m", "limit": 2})
+        assert repo.calls == ["ETHUSDT"]
+
+        params = {"symbols": "BTCUSDT,ETHUSDT", "intervals": "1m,5m", "limit": 2}
+        r = client.get("/fapi/v1/klines/batch", params=params)
+        assert r.status_code == 200
+        body = orjson.loads(r.content)
+        assert list(body) == ["BTCUSDT", "ETHUSDT"]
+        assert body["ETHUSDT"]["5m"] == orjson.loads(single.content)
+        assert len(body["BTCUSDT"]["1m"]) == 2
+        # one query per interval, and only for keys the cache did not have
+        assert repo.calls[1:] == [("BTCUSDT", "ETHUSDT"), ("BTCUSDT",)]
+
+        r2 = client.get("/fapi/v1/klines/batch", params=params, headers={"If-None-Match": r.headers["etag"]})
+        assert r2.status_code == 304
+        assert len(repo.calls) == 3
+        assert client.get("/fapi/v1/klines/batch", params={**params, "intervals": "7m"}).status_code == 400
+        client.portal.call(repo.repo.close)
+
+
+class SlowRepo:
+    def __init__(self):
+        self.reads = []
+
+    async def query_raw(self, symbol, interval, start, end, limit, only_final=True):
+        self.reads.append(symbol)
+        await asyncio.sleep(0.05)
+        return [(0, 1.0, 2.0, 0.5, 1.0, 1.0, 59_999, 1.0, 1, 0.5, 0.5, 1)]
+
+    async def query_raw_many(self, symbols, interval, start, end, limit, only_final=True):
+        self.reads.append(tuple(symbols))
+        await asyncio.sleep(0.05)
+        return {s: [(0, 1.0, 2.0, 0.5, 1.0, 1.0, 59_999, 1.0, 1, 0.5, 0.5, 1)] for s in symbols}
+
+
+def test_batch_fills_coalesce_with_single_requests():
+    repo = SlowRepo()
+    use = GetKlines(repo, LRUCache(), encode=serialize_binance_rows)
+
+    async def run():
+        many, single = await asyncio.gather(
+            use.handle_many(["BTCUSDT", "ETHUSDT"], "1m", None, None, 10),
+            use.handle("ETHUSDT", "1m", None, None, 10),
+        )
+        assert single.body == many["ETHUSDT"].body
+        assert repo.reads == [("BTCUSDT", "ETHUSDT")]
+
+        # and a batch waits on a single request already filling its key
+        repo.reads.clear()
+        single, many = await asyncio.gather(
+            use.handle("XRPUSDT", "1m", None, None, 10),
+            use.handle_many(["XRPUSDT", "SOLUSDT"], "1m", None, None, 10),
+        )
+        assert repo.reads == ["XRPUSDT", ("SOLUSDT",)]
+        assert many["XRPUSDT"].body == single.body
+
+    asyncio.run(run())
@@ -0,0 +1,68 @@
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+# Ensure project root on path for imports
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import orjson
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from domain.models import Interval
+from domain.usecases import ExportKlines
+from infra.db.sqlite_repo import SqliteKlineRepo, ensure_schema
+from infra.http.api import router
+from infra.serialization import serialize_binance_rows
+from tests.helpers import make_bar
+
+
+class WindowedOnly:
+    """A repo without ``iter_raw``, like the segment and sharded repos."""
+
+    def __init__(self, repo):
+        self.repo = repo
+
+    async def query_raw(self, *args):
+        return await self.repo.query_raw(*args)
+
+    async def watermark(self, *args):
+        return await self.repo.watermark(*args)
+
+
+def test_export_streams_the_whole_range(tmp_path: Path):
+    db_url = f"sqlite:///{tmp_path / 'x.db'}"
+    asyncio.run(ensure_schema(db_url))
+    repo = SqliteKlineRepo(db_url, pool_size=1)
+    app = FastAPI()
+    app.include_router(router)
+    state = SimpleNamespace(use_export=ExportKlines(repo, chunk_rows=5))
+    app.state.app_state = state
+    base = {"symbol": "BTCUSDT", "interval": "1m"}
+
+    with TestClient(app) as client:
+        client.portal.call(repo.upsert, [make_bar(i * 60_000, close=i) for i in range(23) if i != 7])
+        everything = client.portal.call(repo.query_raw, "BTCUSDT", Interval.m1, None, None, 100)
+        expected = b"".join(serialize_binance_rows([r])[1:-1] + b"\n" for r in everything)
+
+        for use in (ExportKlines(repo, chunk_rows=5), ExportKlines(WindowedOnly(repo), chunk_rows=5)):
+            state.use_export = use
+            r = client.get("/fapi/v1/klines/export", params=base)
+            assert r.headers["content-type"] == "application/x-ndjson"
+            assert r.content == expected
+
+            r = client.get("/fapi/v1/klines/export",
+                           params={**base, "startTime": 60_000, "endTime": 600_000, "resumeAfter": 300_000})
+            assert [orjson.loads(line)[0] for line in r.content.splitlines()] == [
+                i * 60_000 for i in (6, 8, 9, 10)
+            ]
+
+        r = client.get("/fapi/v1/klines/export", params={**base, "format": "csv", "endTime": 120_000})
+        lines = r.text.splitlines()
+        assert lines[0].startswith("open_time,open,high")
+        assert lines[1:] == ["0,1.0,2.0,0.5,0.0,1.0,59999,1.0,0,0.0,0.0",
+                             "60000,1.0,2.0,0.5,1.0,1.0,119999,1.0,0,0.0,0.0",
+                             "120000,1.0,2.0,0.5,2.0,1.0,179999,1.0,0,0.0,0.0"]
+        assert client.get("/fapi/v1/klines/export", params={**base, "format": "xml"}).status_code == 422
+        client.portal.call(repo.close)
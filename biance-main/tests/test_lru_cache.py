@@ -0,0 +1,47 @@
+import asyncio
+import sys
+from pathlib import Path
+
+# Ensure project root on path for imports
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from infra.cache import lru_cache
+from infra.cache.lru_cache import ENTRY_OVERHEAD, LRUCache
+
+
+def test_evicts_by_bytes_not_count():
+    entry = 1000
+    cache = LRUCache(max_bytes=10 * (entry + ENTRY_OVERHEAD))
+
+    async def run():
+        for i in range(12):
+            await cache.set_bytes(f"k{i}", b"x" * entry, 60)
+        await cache.get_bytes("k2")  # touched, so it survives the next insert
+        await cache.set_bytes("k12", b"x" * entry, 60)
+        assert await cache.get_bytes("k0") is None
+        assert await cache.get_bytes("k2") is not None
+        assert await cache.get_bytes("k3") is None
+        # larger than an eighth of the budget: not cached at all
+        await cache.set_bytes("big", b"x" * (2 * entry), 60)
+        assert await cache.get_bytes("big") is None
+
+    asyncio.run(run())
+    stats = cache.stats()
+    assert stats["items"] == 10
+    assert stats["bytes"] == 10 * (entry + ENTRY_OVERHEAD)
+    assert stats["evictions"] == 3
+    assert stats["hits"] == 2
+    assert stats["misses"] == 3
+
+
+def test_entries_expire_after_their_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(lru_cache.time, "monotonic", lambda: now[0])
+    cache = LRUCache()
+    cache.set("short", b"a", 10)
+    cache.set("long", b"b", 3600)
+    now[0] += 11
+    assert cache.get("short") is None
+    assert cache.get("long") == b"b"
+    assert cache.stats()["expirations"] == 1
+    assert cache.stats()["bytes"] == 1 + ENTRY_OVERHEAD
@@ -0,0 +1,97 @@
+import asyncio
+import os
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import pytest
+
+# Ensure project root on path for imports
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from domain.models import Interval, Watermark
+from infra.db.segment_repo import month_start, next_month
+from tests.helpers import make_bar
+
+PG_URL = os.environ.get("PG_URL")
+
+pytestmark = pytest.mark.skipif(not PG_URL, reason="set PG_URL to run against a real Postgres")
+
+JAN = 1_704_067_200_000  # 2024-01-01T00:00Z
+STEP = 3_600_000
+
+
+def test_legacy_table_is_partitioned_and_expired_months_are_dropped():
+    import asyncpg
+    from infra.db.postgres_repo import KLINE_COLUMNS_DDL, PostgresKlineRepo, ensure_schema, partition_name
+
+    schema = f"klines_test_{uuid.uuid4().hex[:8]}"
+    # asyncpg passes unknown DSN parameters on as server settings
+    url = f"{PG_URL}{'&' if '?' in PG_URL else '?'}search_path={schema}"
+    ahead = next_month(month_start(int(time.time() * 1000)))
+
+    async def run():
+        admin = await asyncpg.connect(PG_URL)
+        await admin.execute(f"CREATE SCHEMA {schema}")
+        try:
+            conn = await asyncpg.connect(url)
+            await conn.execute("CREATE TABLE kline_1m (" + KLINE_COLUMNS_DDL + ")")
+            await conn.executemany(
+                "INSERT INTO kline_1m (symbol, open_time, open, high, low, close, volume, close_time)"
+                " VALUES ('BTCUSDT', $1, 1, 1, 1, 1, 1, $2)",
+                [(t, t + 59_999) for t in range(JAN, JAN + 10 * STEP, STEP)],
+            )
+            await conn.close()
+
+            await ensure_schema(url)
+            await ensure_schema(url)  # idempotent once partitioned
+
+            conn = await asyncpg.connect(url)
+            assert await conn.fetchval("SELECT relkind::text FROM pg_class WHERE oid = to_regclass('kline_1m')") == "p"
+            parts = {r[0] for r in await conn.fetch(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = to_regclass('kline_1m')"
+            )}
+            assert {"kline_1m_legacy", partition_name("kline_1m", ahead)} <= parts
+            assert "kline_1m_default" not in parts  # it would rule out concurrent detach
+            # the legacy table's BRIN index was built beforehand and adopted by the parent's
+            assert await conn.fetchval(
+                "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass('kline_1m_open_time_brin')"
+            )
+            assert await conn.fetchval("SELECT to_regclass('kline_1m_legacy_open_time_brin') IS NOT NULL")
+            # the helper CHECK used to skip the attach scan is gone
+            assert await conn.fetchval(
+                "SELECT COUNT(*) FROM pg_constraint WHERE conrelid = to_regclass('kline_1m_legacy') AND contype = 'c'"
+            ) == 0
+            await conn.close()
+
+            repo = PostgresKlineRepo(url, pool_size=2, copy_threshold=10)
+            assert await repo.watermark("BTCUSDT", Interval.m1) == Watermark(JAN, JAN + 9 * STEP, 10)
+            # 20 rows take the COPY + merge path; the repeat of the first key is merged, not doubled
+            new = [make_bar(t) for t in range(ahead, ahead + 20 * STEP, STEP)]
+            await repo.upsert(new + [make_bar(ahead, close=5)])
+            rows = await repo.query_raw("BTCUSDT", Interval.m1, ahead, None, 100)
+            assert [r[0] for r in rows] == [b.open_time for b in new]
+            assert rows[0][4] == 5.0
+            assert await repo.watermark("BTCUSDT", Interval.m1) == Watermark(JAN, new[-1].open_time, 30)
+            chunks = [c async for c in repo.iter_raw("BTCUSDT", Interval.m1, None, None, chunk_rows=7)]
+            assert [len(c) for c in chunks] == [7, 7, 7, 7, 2]
+            assert [r[0] for c in chunks for r in c] == sorted(r[0] for c in chunks for r in c)
+            # concurrent writers of the same new keys count each of them once
+            more = [make_bar(t) for t in range(ahead + 20 * STEP, ahead + 25 * STEP, STEP)]
+            await asyncio.gather(*(repo.upsert(more) for _ in range(4)))
+            assert (await repo.watermark("BTCUSDT", Interval.m1)).count == 35
+
+            # kline_5m was created partitioned; past months get partitions on first write
+            feb = next_month(JAN)
+            await repo.upsert([make_bar(t, interval=Interval.m5) for t in range(feb - 5 * STEP, feb + 5 * STEP, STEP)])
+            assert await repo.drop_expired(Interval.m5, feb) == 5
+            assert await repo.watermark("BTCUSDT", Interval.m5) == Watermark(feb, feb + 4 * STEP, 5)
+            assert await repo.drop_expired(Interval.m5, feb) == 0
+            await repo.close()
+        finally:
+            await admin.execute(f"DROP SCHEMA {schema} CASCADE")
+            await admin.close()
+
+    asyncio.run(run())
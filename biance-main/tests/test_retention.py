@@ -0,0 +1,56 @@
+import asyncio
+import dataclasses
+import sys
+from pathlib import Path
+
+import aiosqlite
+
+# Ensure project root on path for imports
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from domain.models import Interval, Watermark
+from infra.db.retention import RetentionJob
+from infra.db.segment_repo import SegmentStore
+from infra.db.sqlite_repo import SqliteKlineRepo, ensure_schema
+from tests.helpers import make_bar
+
+DAY = 86_400_000
+HOUR = 3_600_000
+
+
+async def _page_count(path: Path) -> int:
+    async with aiosqlite.connect(path) as db:
+        cur = await db.execute("PRAGMA page_count")
+        return (await cur.fetchone())[0]
+
+
+def test_retention_trims_1m_and_keeps_aggregates(tmp_path: Path):
+    path = tmp_path / "ret.db"
+    db_url = f"sqlite:///{path}"
+    now = 40 * DAY
+
+    async def run():
+        await ensure_schema(db_url)
+        repo = SqliteKlineRepo(db_url, pool_size=2)
+        await repo.upsert([make_bar(t) for t in range(0, now, 60_000)])
+        await repo.upsert([make_bar(t, interval=Interval.h1) for t in range(0, now, HOUR)])
+        # a bar left open long ago expires too, but segments only hold closed bars
+        await repo.upsert([dataclasses.replace(make_bar(DAY), is_final=False)])
+        pages_before = await _page_count(path)
+
+        archive = SegmentStore(str(tmp_path / "archive"))
+        job = RetentionJob(repo, {"1m": 10}, archive=archive, batch_rows=5_000)
+        removed = await job.run_once(now_ms=now)
+
+        assert removed == 30 * 1440
+        assert await repo.watermark("BTCUSDT", Interval.m1) == Watermark(30 * DAY, now - 60_000, 10 * 1440)
+        assert await repo.watermark("BTCUSDT", Interval.h1) == Watermark(0, now - HOUR, 40 * 24)
+        assert archive.bounds("BTCUSDT", Interval.m1) == Watermark(0, 30 * DAY - 60_000, 30 * 1440 - 1)
+        assert DAY not in [r[0] for r in archive.read("BTCUSDT", Interval.m1, DAY - 60_000, DAY + 60_000, 10)]
+        assert await job.run_once(now_ms=now) == 0
+        await repo.close()
+
+        # incremental vacuum handed the freed pages back instead of keeping them on the freelist
+        assert await _page_count(path) < pages_before / 2
+
+    asyncio.run(run())
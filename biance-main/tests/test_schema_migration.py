@@ -0,0 +1,166 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import aiosqlite
+
+# Ensure project root on path for imports
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import infra.db.sqlite_repo as sqlite_repo
+from domain.models import Interval, Watermark
+from infra.db.sqlite_repo import SqliteKlineRepo, ensure_schema
+
+V1_DDL = """
+    CREATE TABLE kline_1m (
+      symbol TEXT NOT NULL,
+      open_time INTEGER NOT NULL,
+      open REAL NOT NULL,
+      high REAL NOT NULL,
+      low REAL NOT NULL,
+      close REAL NOT NULL,
+      volume REAL NOT NULL,
+      close_time INTEGER NOT NULL,
+      quote_volume REAL NOT NULL DEFAULT 0,
+      trades INTEGER NOT NULL DEFAULT 0,
+      taker_buy_base REAL NOT NULL DEFAULT 0,
+      taker_buy_quote REAL NOT NULL DEFAULT 0,
+      is_final INTEGER NOT NULL DEFAULT 1,
+      PRIMARY KEY(symbol, open_time)
+    );
+"""
+
+
+def test_v1_database_is_migrated_in_place(tmp_path: Path, monkeypatch):
+    path = tmp_path / "v1.db"
+    db_url = f"sqlite:///{path}"
+    # force several chunks per symbol
+    monkeypatch.setattr(sqlite_repo, "MIGRATE_BATCH_ROWS", 7)
+
+    async def run():
+        async with aiosqlite.connect(path) as db:
+            await db.execute(V1_DDL)
+            await db.execute("CREATE UNIQUE INDEX idx_kline_1m_symbol_time ON kline_1m(symbol, open_time)")
+            await db.execute(
+                "CREATE INDEX idx_kline_1m_final ON kline_1m(symbol, open_time) WHERE is_final = 1"
+            )
+            await db.executemany(
+                "INSERT INTO kline_1m (symbol, open_time, open, high, low, close, volume, close_time,"
+                " trades, is_final) VALUES (?, ?, 1, 2, 0.5, ?, 3, ?, ?, ?)",
+                [
+                    (sym, i * 60_000, float(i), i * 60_000 + 59_999, i, 1 if i < 19 else 0)
+                    for sym in ("BTCUSDT", "ETHUSDT")
+                    for i in range(20)
+                ],
+            )
+            await db.commit()
+
+        await ensure_schema(db_url)
+        await ensure_schema(db_url)  # idempotent once on v2
+
+        async with aiosqlite.connect(path) as db:
+            cur = await db.execute("PRAGMA user_version")
+            assert (await cur.fetchone())[0] == 2
+            cur = await db.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'kline_1m'")
+            assert await cur.fetchall() == []
+            cur = await db.execute("SELECT sql FROM sqlite_master WHERE name = 'kline_1m'")
+            assert "WITHOUT ROWID" in (await cur.fetchone())[0]
+
+        repo = SqliteKlineRepo(db_url, pool_size=1)
+        rows = await repo.query_raw("ETHUSDT", Interval.m1, None, None, 100, only_final=False)
+        assert [r[0] for r in rows] == [i * 60_000 for i in range(20)]
+        assert rows[-1][4] == 19.0 and rows[-1][8] == 19 and rows[-1][11] == 0
+        assert len(await repo.query_raw("BTCUSDT", Interval.m1, None, None, 100)) == 19
+        assert await repo.query_raw("XRPUSDT", Interval.m1, None, None, 100) == []
+        assert await repo.watermark("BTCUSDT", Interval.m1) == Watermark(0, 19 * 60_000, 20)
+        await repo.close()
+
+    asyncio.run(run())
+
+
+def test_resumed_migration_reconciles_rows_changed_since_the_copy(tmp_path: Path):
+    path = tmp_path / "v1.db"
+    db_url = f"sqlite:///{path}"
+
+    async def run():
+        async with aiosqlite.connect(path) as db:
+            await db.execute(V1_DDL)
+            await db.executemany(
+                "INSERT INTO kline_1m (symbol, open_time, open, high, low, close, volume, close_time)"
+                " VALUES (?, ?, 1, 2, 0.5, 1, 3, ?)",
+                [("BTCUSDT", i * 60_000, i * 60_000 + 59_999) for i in range(10)],
+            )
+            await db.commit()
+        # an interrupted run copied everything, then v1 writers kept going
+        async with aiosqlite.connect(path) as db:
+            await db.execute(sqlite_repo.SYMBOLS_DDL)
+            await db.execute(sqlite_repo.KLINE_DDL.format(tbl="kline_1m_v2"))
+            await db.execute("INSERT INTO symbols(name) VALUES ('BTCUSDT')")
+            await db.execute(
+                "INSERT INTO kline_1m_v2 SELECT 1, open_time, open, high, low, close, volume, close_time,"
+                " quote_volume, trades, taker_buy_base, taker_buy_quote, is_final FROM kline_1m"
+            )
+            await db.execute("UPDATE kline_1m SET close = 9 WHERE open_time = 0")
+            await db.execute("DELETE FROM kline_1m WHERE open_time = 60000")
+            await db.execute(
+                "INSERT INTO kline_1m (symbol, open_time, open, high, low, close, volume, close_time)"
+                " VALUES ('ETHUSDT', 0, 1, 2, 0.5, 1, 3, 59999)"
+            )
+            await db.commit()
+
+        await ensure_schema(db_url)
+
+        repo = SqliteKlineRepo(db_url, pool_size=1)
+        rows = await repo.query_raw("BTCUSDT", Interval.m1, None, None, 100)
+        assert [r[0] for r in rows] == [i * 60_000 for i in range(10) if i != 1]
+        assert rows[0][4] == 9.0
+        assert [r[0] for r in await repo.query_raw("ETHUSDT", Interval.m1, None, None, 100)] == [0]
+        await repo.close()
+
+    asyncio.run(run())
+
+
+def test_writes_made_during_the_migration_are_replayed(tmp_path: Path, monkeypatch):
+    path = tmp_path / "v1.db"
+    db_url = f"sqlite:///{path}"
+    monkeypatch.setattr(sqlite_repo, "MIGRATE_BATCH_ROWS", 2)
+    sync = sqlite_repo._sync_v1_window
+    windows = []
+
+    async def sync_then_write(db, tbl, new, sid, name, lo, hi):
+        await sync(db, tbl, new, sid, name, lo, hi)
+        windows.append((name, lo, hi))
+        if len(windows) == 1:
+            # a v1 writer commits right after the first window was checked
+            await db.execute("UPDATE kline_1m SET close = 9 WHERE open_time = 0")
+            await db.execute("DELETE FROM kline_1m WHERE open_time = 60000")
+            await db.execute(
+                "INSERT INTO kline_1m (symbol, open_time, open, high, low, close, volume, close_time)"
+                " VALUES ('XRPUSDT', 0, 1, 2, 0.5, 1, 3, 59999)"
+            )
+
+    monkeypatch.setattr(sqlite_repo, "_sync_v1_window", sync_then_write)
+
+    async def run():
+        async with aiosqlite.connect(path) as db:
+            await db.execute(V1_DDL)
+            await db.executemany(
+                "INSERT INTO kline_1m (symbol, open_time, open, high, low, close, volume, close_time)"
+                " VALUES ('BTCUSDT', ?, 1, 2, 0.5, 1, 3, ?)",
+                [(i * 60_000, i * 60_000 + 59_999) for i in range(5)],
+            )
+            await db.commit()
+
+        await ensure_schema(db_url)
+        assert windows == [("BTCUSDT", -1, 60_000), ("BTCUSDT", 60_000, 180_000), ("BTCUSDT", 180_000, None)]
+
+        async with aiosqlite.connect(path) as db:
+            cur = await db.execute("SELECT name FROM sqlite_master WHERE name LIKE '%v1_changes%'")
+            assert await cur.fetchall() == []
+        repo = SqliteKlineRepo(db_url, pool_size=1)
+        rows = await repo.query_raw("BTCUSDT", Interval.m1, None, None, 100)
+        assert [(r[0], r[4]) for r in rows] == [(0, 9.0)] + [(i * 60_000, 1.0) for i in range(2, 5)]
+        assert [r[0] for r in await repo.query_raw("XRPUSDT", Interval.m1, None, None, 100)] == [0]
+        await repo.close()
+
+    asyncio.run(run())
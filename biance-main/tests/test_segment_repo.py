@@ -0,0 +1,79 @@
+import asyncio
+import dataclasses
+import sys
+from pathlib import Path
+
+# Ensure project root on path for imports
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from domain.models import Interval, Watermark
+from infra.db.segment_repo import SegmentKlineRepo
+from infra.db.sqlite_repo import SqliteKlineRepo, ensure_schema
+from tests.helpers import make_bar
+
+JAN = 1_704_067_200_000  # 2024-01-01T00:00Z
+MAR = 1_709_251_200_000  # 2024-03-01T00:00Z
+STEP = 6 * 3_600_000
+
+
+def test_sealed_months_are_served_from_segments(tmp_path: Path):
+    db_url = f"sqlite:///{tmp_path / 'tail.db'}"
+    times = list(range(JAN, MAR + 10 * STEP, STEP))
+
+    async def run():
+        await ensure_schema(db_url)
+        tail = SqliteKlineRepo(db_url, pool_size=2)
+        repo = SegmentKlineRepo(tail, str(tmp_path / "segments"), seal_grace_days=2)
+        await repo.upsert([make_bar(t, open=t) for t in times])
+        before = await repo.query_raw("BTCUSDT", Interval.m1, None, None, 10_000)
+
+        sealed = await repo.seal_completed_months(now_ms=MAR + 3 * 86_400_000)
+        assert sealed == len([t for t in times if t < MAR])
+        assert (await tail.watermark("BTCUSDT", Interval.m1)).first_open_time == MAR
+        assert [Path(s.path).stem for s in repo.store.segments("BTCUSDT", Interval.m1)] == ["2024-01", "2024-02"]
+
+        assert await repo.query_raw("BTCUSDT", Interval.m1, None, None, 10_000) == before
+        assert await repo.watermark("BTCUSDT", Interval.m1) == Watermark(times[0], times[-1], len(times))
+        assert await repo.min_open_time(Interval.m1) == times[0]
+
+        # a window straddling the segment/tail boundary
+        rows = await repo.query_raw("BTCUSDT", Interval.m1, MAR - 3 * STEP, MAR + STEP, 100)
+        assert [r[0] for r in rows] == [MAR - 3 * STEP, MAR - 2 * STEP, MAR - STEP, MAR, MAR + STEP]
+        rows = await repo.query_raw("BTCUSDT", Interval.m1, None, MAR - 1, 2)
+        assert [r[0] for r in rows] == [MAR - 2 * STEP, MAR - STEP]
+        assert rows[-1][1] == float(MAR - STEP)
+
+        # a second pass has nothing left to seal
+        assert await repo.seal_completed_months(now_ms=MAR + 3 * 86_400_000) == 0
+        await repo.close()
+
+    asyncio.run(run())
+
+
+def test_sealing_keeps_open_rows_and_concurrent_backfills(tmp_path: Path):
+    db_url = f"sqlite:///{tmp_path / 'tail.db'}"
+    jan = list(range(JAN, JAN + 20 * STEP, STEP))
+    backfill = list(range(JAN + 20 * STEP, JAN + 40 * STEP, STEP))
+
+    async def run():
+        await ensure_schema(db_url)
+        tail = SqliteKlineRepo(db_url, pool_size=2)
+        repo = SegmentKlineRepo(tail, str(tmp_path / "segments"), seal_grace_days=2)
+        open_bar = dataclasses.replace(make_bar(jan[-1] + STEP // 2), is_final=False)
+        await repo.upsert([make_bar(t) for t in jan] + [open_bar])
+
+        # the fetcher backfills the same month while the seal pass runs
+        sealed, _ = await asyncio.gather(
+            repo.seal_completed_months(now_ms=MAR),
+            repo.upsert([make_bar(t) for t in backfill]),
+        )
+        sealed += await repo.seal_completed_months(now_ms=MAR)
+        assert sealed == len(jan) + len(backfill)
+
+        rows = await tail.query_raw("BTCUSDT", Interval.m1, None, None, 100, only_final=False)
+        assert [r[0] for r in rows] == [open_bar.open_time]
+        rows = await repo.query_raw("BTCUSDT", Interval.m1, None, None, 100, only_final=False)
+        assert [r[0] for r in rows] == sorted(jan + backfill + [open_bar.open_time])
+        await repo.close()
+
+    asyncio.run(run())
@@ -0,0 +1,116 @@
+import asyncio
+import random
+import struct
+import sys
+import tracemalloc
+from pathlib import Path
+
+# Ensure project root on path for imports
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import orjson
+
+from domain.models import RAW_COLUMNS, Bar, Interval
+from infra.db.sqlite_repo import SqliteKlineRepo, ensure_schema
+from infra.serialization import (
+    COLUMNAR_HEADER_SIZE, COLUMNAR_MEDIA_TYPE, RowFragmentCache, deserialize_columnar_rows, pick_format,
+    serialize_binance_klines, serialize_binance_rows, serialize_columnar_rows,
+)
+
+
+def _bars(n: int):
+    return [
+        Bar(
+            symbol="BTCUSDT",
+            interval=Interval.m1,
+            open_time=i * 60_000,
+            open=100.5 + i,
+            high=101.25 + i,
+            low=99.125,
+            close=100.0 + i / 3,
+            volume=12.5,
+            quote_volume=1250.75,
+            close_time=i * 60_000 + 59_999,
+            trades=i,
+            taker_buy_base=0.1,
+            taker_buy_quote=1e-07,
+            is_final=i < n - 1,
+        )
+        for i in range(n)
+    ]
+
+
+def test_raw_rows_serialize_like_bars(tmp_path: Path):
+    db_url = f"sqlite:///{tmp_path / 'raw.db'}"
+
+    async def run():
+        await ensure_schema(db_url)
+        repo = SqliteKlineRepo(db_url, pool_size=1)
+        await repo.upsert(_bars(50))
+        for only_final in (True, False):
+            bars = await repo.query("BTCUSDT", Interval.m1, 600_000, None, 20, only_final)
+            rows = await repo.query_raw("BTCUSDT", Interval.m1, 600_000, None, 20, only_final)
+            assert serialize_binance_rows(rows) == serialize_binance_klines(bars)
+        await repo.close()
+        return rows
+
+    rows = asyncio.run(run())
+    decoded = orjson.loads(serialize_binance_rows(rows))
+    assert decoded[-1][0] == 49 * 60_000
+    assert decoded[-1][10] == "1e-07"
+    assert decoded[-1][11] == "0"
+
+
+def test_columnar_round_trip_and_layout():
+    rows = [tuple(getattr(b, c) for c in RAW_COLUMNS[:11]) for b in _bars(5)]
+    body = serialize_columnar_rows(rows)
+    assert body[:4] == b"MTFK"
+    assert len(body) == COLUMNAR_HEADER_SIZE + 5 * 11 * 8
+    assert deserialize_columnar_rows(body) == rows
+    # the close column is a plain little-endian float64 block
+    offset = COLUMNAR_HEADER_SIZE + 4 * 5 * 8
+    assert struct.unpack_from("<5d", body, offset) == tuple(r[4] for r in rows)
+    assert deserialize_columnar_rows(serialize_columnar_rows([])) == []
+
+
+def test_accept_negotiation():
+    assert pick_format(None) == "json"
+    assert pick_format("application/json") == "json"
+    assert pick_format(f"application/json;q=0.5, {COLUMNAR_MEDIA_TYPE}") == "columnar"
+    assert pick_format(f"{COLUMNAR_MEDIA_TYPE};q=0, */*") == "json"
+
+
+def test_row_fragments_reused_only_for_final_rows():
+    rows = [tuple(getattr(b, c) for c in RAW_COLUMNS) for b in _bars(6)]
+    rows[-1] = rows[-1][:11] + (False,)
+    full = RowFragmentCache()
+    full.encode(rows)
+    assert full.stats()["items"] == 5
+    frags = RowFragmentCache(max_bytes=full.bytes - 1)
+    assert frags.encode(rows) == serialize_binance_rows(rows)
+    assert frags.stats()["items"] == 4 and frags.stats()["evictions"] == 1
+
+    assert frags.encode(rows[1:]) == serialize_binance_rows(rows[1:])
+    assert frags.hits == 4
+    # a rewritten final row is a different key, never a stale fragment
+    changed = rows[3][:4] + (123.5,) + rows[3][5:]
+    assert frags.encode([list(changed)]) == serialize_binance_rows([changed])
+
+
+def test_row_fragment_bytes_match_what_the_process_holds():
+    rng = random.Random(7)
+    rows = [
+        (i * 60_000, rng.uniform(1, 1e5), rng.uniform(1, 1e5), rng.uniform(1, 1e5), rng.uniform(1, 1e5),
+         rng.uniform(0, 1e4), i * 60_000 + 59_999, rng.uniform(0, 1e8), rng.randrange(10**6),
+         rng.uniform(0, 1e4), rng.uniform(0, 1e8), 1)
+        for i in range(20_000)
+    ]
+    frags = RowFragmentCache()
+    tracemalloc.start()
+    try:
+        frags.encode(rows)
+        held, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert frags.stats()["items"] == len(rows)
+    assert 0.8 < frags.bytes / held < 1.2
@@ -0,0 +1,142 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+# Ensure project root on path for imports
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import infra.db.sqlite_shards as sqlite_shards
+from domain.models import Interval, Watermark
+from infra.db.sqlite_repo import SqliteKlineRepo, ensure_schema
+from infra.db.sqlite_shards import ShardedSqliteKlineRepo
+from tests.helpers import make_bar
+
+JAN = 1_704_067_200_000  # 2024-01-01T00:00Z
+FEB = 1_706_745_600_000  # 2024-02-01T00:00Z
+STEP = 3_600_000
+
+
+def test_rows_are_routed_by_symbol_and_month(tmp_path: Path):
+    db_url = f"sqlite:///{tmp_path / 'klines.db'}"
+    times = list(range(FEB - 10 * STEP, FEB + 10 * STEP, STEP))
+    symbols = ["BTCUSDT", "ETHUSDT", "SOLUSDT"]
+
+    async def run():
+        repo = ShardedSqliteKlineRepo(db_url, symbol_shards=4, by_month=True, pool_size=1)
+        await repo.upsert([make_bar(t, s) for s in symbols for t in times])
+
+        expected = {f"klines.{repo.bucket(s):02d}.{m}.db" for s in symbols for m in ("2024-01", "2024-02")}
+        assert {p.name for p in tmp_path.glob("klines.*.db")} == expected
+
+        rows = await repo.query_raw("ETHUSDT", Interval.m1, None, None, 15)
+        assert [r[0] for r in rows] == times[-15:]
+        rows = await repo.query_raw("ETHUSDT", Interval.m1, FEB - 2 * STEP, FEB + STEP, 100)
+        assert [r[0] for r in rows] == [FEB - 2 * STEP, FEB - STEP, FEB, FEB + STEP]
+        assert await repo.watermark("BTCUSDT", Interval.m1) == Watermark(times[0], times[-1], len(times))
+        assert await repo.max_open_time(Interval.m1) == times[-1]
+        await repo.close()
+
+        # a fresh instance finds the shards written before
+        reopened = ShardedSqliteKlineRepo(db_url, symbol_shards=4, by_month=True, pool_size=1)
+        assert await reopened.watermark("SOLUSDT", Interval.m1) == Watermark(times[0], times[-1], len(times))
+        assert await reopened.delete_range("SOLUSDT", Interval.m1, None, FEB - 1) == 10
+        assert (await reopened.watermarks())[("SOLUSDT", Interval.m1)] == Watermark(FEB, times[-1], 10)
+        await reopened.close()
+
+    asyncio.run(run())
+
+
+def test_idle_shards_are_closed_and_edges_read_one_month(tmp_path: Path):
+    db_url = f"sqlite:///{tmp_path / 'klines.db'}"
+    months = [JAN + i * 31 * 86_400_000 for i in range(6)]
+
+    async def run():
+        repo = ShardedSqliteKlineRepo(db_url, by_month=True, max_open=2, pool_size=1)
+        await repo.upsert([make_bar(t) for t in months])
+        assert len(repo._shards) <= 2
+        assert len(await repo.query_raw("BTCUSDT", Interval.m1, None, None, 100)) == 6
+        assert len(repo._shards) <= 2
+        await repo.close()
+
+        reopened = ShardedSqliteKlineRepo(db_url, by_month=True, max_open=2, pool_size=1)
+        assert await reopened.max_open_time(Interval.m1) == months[-1]
+        assert list(reopened._shards) == [reopened.shard_key("BTCUSDT", months[-1])]
+        assert await reopened.min_open_time(Interval.m1) == months[0]
+        await reopened.close()
+
+    asyncio.run(run())
+
+
+def test_refuses_to_start_next_to_a_populated_unsharded_db(tmp_path: Path):
+    db_url = f"sqlite:///{tmp_path / 'klines.db'}"
+
+    async def run():
+        await ensure_schema(db_url)
+        plain = SqliteKlineRepo(db_url, pool_size=1)
+        await plain.upsert([make_bar(JAN)])
+        await plain.close()
+
+        repo = ShardedSqliteKlineRepo(db_url, symbol_shards=4, pool_size=1)
+        with pytest.raises(RuntimeError, match="sharding is enabled"):
+            await repo.connect()
+
+    asyncio.run(run())
+
+
+def test_a_shard_is_never_open_twice_while_it_closes(tmp_path: Path, monkeypatch):
+    db_url = f"sqlite:///{tmp_path / 'klines.db'}"
+    months = [JAN + i * 31 * 86_400_000 for i in range(4)]
+    live, twice = {}, []
+
+    class SlowClosingRepo(SqliteKlineRepo):
+        async def connect(self):
+            if not getattr(self, "_counted", False):
+                self._counted = True
+                live[self.path] = live.get(self.path, 0) + 1
+                if live[self.path] > 1:
+                    twice.append(self.path)
+            await super().connect()
+
+        async def close(self):
+            await asyncio.sleep(0.02)
+            await super().close()
+            live[self.path] -= 1
+
+    monkeypatch.setattr(sqlite_shards, "SqliteKlineRepo", SlowClosingRepo)
+
+    async def run():
+        repo = ShardedSqliteKlineRepo(db_url, by_month=True, max_open=1, pool_size=1)
+        await repo.upsert([make_bar(t) for t in months])
+
+        async def reader(offset: int):
+            for i in range(8):
+                t = months[(offset + i) % len(months)]
+                assert len(await repo.query_raw("BTCUSDT", Interval.m1, t, t, 1)) == 1
+
+        await asyncio.gather(*(reader(i) for i in range(len(months))))
+        await repo.close()
+
+    asyncio.run(asyncio.wait_for(run(), 30))
+    assert twice == []
+
+
+def test_shards_created_by_another_process_are_found(tmp_path: Path, monkeypatch):
+    db_url = f"sqlite:///{tmp_path / 'klines.db'}"
+    monkeypatch.setattr(sqlite_shards, "SHARD_RESCAN_MIN_SEC", 0.0)
+
+    async def run():
+        reader = ShardedSqliteKlineRepo(db_url, by_month=True, pool_size=1)
+        writer = ShardedSqliteKlineRepo(db_url, by_month=True, pool_size=1)
+        await writer.upsert([make_bar(JAN)])
+        assert await reader.watermark("BTCUSDT", Interval.m1) == Watermark(JAN, JAN, 1)
+
+        # a new month written elsewhere after the reader scanned the directory
+        await writer.upsert([make_bar(FEB)])
+        rows = await reader.query_raw("BTCUSDT", Interval.m1, None, FEB + STEP, 10)
+        assert [r[0] for r in rows] == [JAN, FEB]
+        await reader.close()
+        await writer.close()
+
+    asyncio.run(run())
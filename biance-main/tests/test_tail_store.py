@@ -0,0 +1,69 @@
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+# Ensure project root on path for imports
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from domain.models import Interval
+from domain.usecases import GetKlines
+from infra.agg.ring_buffer import RingBuffer
+from infra.cache.lru_cache import LRUCache
+from infra.cache.versions import LocalDataVersions
+from infra.db.sqlite_repo import SqliteKlineRepo, ensure_schema
+from infra.db.versioned_repo import VersionedKlineRepo
+from tests.helpers import CountingRepo, make_bar
+
+
+def test_latest_reads_come_from_the_tail(tmp_path: Path):
+    db_url = f"sqlite:///{tmp_path / 't.db'}"
+
+    async def run():
+        await ensure_schema(db_url)
+        versions = LocalDataVersions()
+        tail = RingBuffer(capacity=50)
+        repo = VersionedKlineRepo(SqliteKlineRepo(db_url, pool_size=1), versions, tail=tail)
+        reads = CountingRepo(repo)
+        use = GetKlines(reads, LRUCache(), ttl_s=3600, versions=versions, tail=tail)
+        await repo.upsert([make_bar(i * 60_000) for i in range(80)])
+
+        first = json.loads((await use.handle("BTCUSDT", "1m", None, None, 10)).body)
+        assert [r[0] for r in first] == [i * 60_000 for i in range(70, 80)]
+        assert reads.queries == 1
+
+        # other limits and new writes are served without another query
+        assert len(json.loads((await use.handle("BTCUSDT", "1m", None, None, 50)).body)) == 50
+        await repo.upsert([make_bar(79 * 60_000, close=3.0), make_bar(80 * 60_000, is_final=False)])
+        rows = json.loads((await use.handle("BTCUSDT", "1m", None, None, 2, only_final=False)).body)
+        assert [(r[0], r[4]) for r in rows] == [(79 * 60_000, "3.0"), (80 * 60_000, "1.0")]
+        rows = json.loads((await use.handle("BTCUSDT", "1m", None, None, 2)).body)
+        assert [r[0] for r in rows] == [78 * 60_000, 79 * 60_000]
+        assert reads.queries == 1
+
+        # more rows than the tail holds, or a range, still go to the DB
+        assert len(json.loads((await use.handle("BTCUSDT", "1m", None, None, 60)).body)) == 60
+        await use.handle("BTCUSDT", "1m", 0, 30 * 60_000, 10)
+        assert reads.queries == 3
+        await repo.close()
+
+    asyncio.run(run())
+
+
+def test_tail_is_dropped_on_a_version_gap():
+    tail = RingBuffer(capacity=5)
+    rows = [
+        (t, 1.0, 1.0, 1.0, 1.0, 1.0, t + 59_999, 1.0, 0, 0.0, 0.0, True)
+        for t in range(0, 3 * 60_000, 60_000)
+    ]
+    tail.load("BTCUSDT", Interval.m1, rows, 7)
+    assert len(tail.latest("BTCUSDT", Interval.m1, 10, False, 7)) == 3
+    assert tail.latest("BTCUSDT", Interval.m1, 1, False, 8) is None
+
+    tail.apply("BTCUSDT", Interval.m1, [make_bar(3 * 60_000)], 8)
+    assert tail.latest("BTCUSDT", Interval.m1, 10, True, 8)[-1][0] == 3 * 60_000
+
+    # version 9 was written elsewhere; the tail cannot know what it changed
+    tail.apply("BTCUSDT", Interval.m1, [make_bar(4 * 60_000)], 10)
+    assert tail.latest("BTCUSDT", Interval.m1, 1, False, 10) is None
+    assert tail.stats()["items"] == 0
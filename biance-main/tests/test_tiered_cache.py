@@ -0,0 +1,42 @@
+import asyncio
+import sys
+from pathlib import Path
+
+# Ensure project root on path for imports
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from infra.cache.lru_cache import LRUCache
+from infra.cache.tiered_cache import TieredCache
+
+
+class MemoryL2:
+    """Stands in for RedisCache: values with a TTL."""
+
+    def __init__(self):
+        self.data = {}
+        self.gets = 0
+
+    async def get_with_ttl(self, key):
+        self.gets += 1
+        if key not in self.data:
+            return None, -2
+        return self.data[key]
+
+    async def set_bytes(self, key, data, ttl_s):
+        self.data[key] = (data, ttl_s * 1000)
+
+
+def test_l2_hits_are_promoted_into_l1():
+    l1, l2 = LRUCache(), MemoryL2()
+    cache = TieredCache(l1, l2)
+
+    async def run():
+        await l2.set_bytes("k", b"payload", 60)  # filled by another worker
+        assert await cache.get_bytes("k") == b"payload"
+        assert await cache.get_bytes("k") == b"payload"
+        assert l2.gets == 1
+
+        await cache.set_bytes("own", b"x", 60)
+        assert l1.get("own") == b"x" and "own" in l2.data
+
+    asyncio.run(run())
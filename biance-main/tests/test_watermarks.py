@@ -0,0 +1,56 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import aiosqlite
+
+# Ensure project root on path for imports
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from domain.models import Interval, Watermark
+from infra.db.sqlite_repo import SqliteKlineRepo, ensure_schema
+from tests.helpers import make_bar
+
+
+def test_watermark_tracks_each_symbol(tmp_path: Path):
+    db_url = f"sqlite:///{tmp_path / 'wm.db'}"
+
+    async def run():
+        await ensure_schema(db_url)
+        repo = SqliteKlineRepo(db_url, pool_size=2)
+        await repo.upsert([make_bar(i * 60_000, "OLD") for i in range(10)])
+        await repo.upsert([make_bar(i * 60_000, "NEW") for i in range(8, 12)])
+        # overlapping re-upsert must not inflate the count
+        await repo.upsert([make_bar(i * 60_000, "OLD") for i in range(5, 15)])
+
+        assert await repo.watermark("OLD", Interval.m1) == Watermark(0, 14 * 60_000, 15)
+        assert await repo.watermark("NEW", Interval.m1) == Watermark(8 * 60_000, 11 * 60_000, 4)
+        assert await repo.watermark("NEW", Interval.m5) is None
+        assert await repo.max_open_time(Interval.m1) == 14 * 60_000
+        assert await repo.min_open_time(Interval.m1) == 0
+        await repo.close()
+
+    asyncio.run(run())
+
+
+def test_watermarks_backfilled_for_existing_rows(tmp_path: Path):
+    path = tmp_path / "legacy.db"
+    db_url = f"sqlite:///{path}"
+
+    async def run():
+        await ensure_schema(db_url)
+        async with aiosqlite.connect(path) as db:
+            await db.execute("DROP TABLE kline_watermark")
+            await db.execute("INSERT INTO symbols (id, name) VALUES (7, 'BTCUSDT')")
+            await db.executemany(
+                "INSERT INTO kline_1m (symbol_id, open_time, open, high, low, close, volume, close_time)"
+                " VALUES (7, ?, 1, 1, 1, 1, 1, ?)",
+                [(t, t + 59_999) for t in (60_000, 120_000, 180_000)],
+            )
+            await db.commit()
+        await ensure_schema(db_url)
+        repo = SqliteKlineRepo(db_url, pool_size=1)
+        assert await repo.watermark("BTCUSDT", Interval.m1) == Watermark(60_000, 180_000, 3)
+        await repo.close()
+
+    asyncio.run(run())
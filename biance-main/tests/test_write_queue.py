@@ -0,0 +1,80 @@
+import asyncio
+import dataclasses
+import sys
+from pathlib import Path
+
+# Ensure project root on path for imports
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from domain.models import Interval
+from infra.db.sqlite_repo import SqliteKlineRepo, ensure_schema
+from tests.helpers import make_bar
+
+
+def test_concurrent_upserts_share_group_commits(tmp_path: Path):
+    db_url = f"sqlite:///{tmp_path / 'wq.db'}"
+    symbols = [f"S{i:03d}" for i in range(50)]
+
+    async def run():
+        await ensure_schema(db_url)
+        repo = SqliteKlineRepo(db_url, pool_size=2, write_latency_ms=50)
+        await repo.connect()
+        await asyncio.gather(*(
+            repo.upsert([make_bar(0, sym, interval=itv), make_bar(60_000, sym, interval=itv)])
+            for sym in symbols
+            for itv in (Interval.m1, Interval.m5)
+        ))
+        writer = repo._writer
+        assert writer.rows_written == len(symbols) * 4
+        assert writer.commits < len(symbols)
+        for sym in symbols:
+            rows = await repo.query(sym, Interval.m5, None, None, 10)
+            assert [b.open_time for b in rows] == [0, 60_000]
+        await repo.close()
+
+    asyncio.run(run())
+
+
+def test_later_submission_wins_within_a_group(tmp_path: Path):
+    db_url = f"sqlite:///{tmp_path / 'order.db'}"
+
+    async def run():
+        await ensure_schema(db_url)
+        repo = SqliteKlineRepo(db_url, pool_size=1, write_latency_ms=50)
+        first = await repo.submit([make_bar(0, close=1)])
+        second = await repo.submit([make_bar(0, close=2)])
+        await asyncio.gather(first, second)
+        rows = await repo.query("BTCUSDT", Interval.m1, None, None, 10)
+        assert [b.close for b in rows] == [2]
+        assert (await repo.watermark("BTCUSDT", Interval.m1)).count == 1
+        await repo.close()
+
+    asyncio.run(run())
+
+
+def test_a_bad_submission_fails_alone(tmp_path: Path):
+    db_url = f"sqlite:///{tmp_path / 'bad.db'}"
+
+    async def run():
+        await ensure_schema(db_url)
+        repo = SqliteKlineRepo(db_url, pool_size=1, write_latency_ms=50)
+        # NOT NULL violation: an IntegrityError, not an OperationalError
+        bad = dataclasses.replace(make_bar(0, "ETHUSDT"), open=None)
+        futs = [
+            await repo.submit([make_bar(0)]),
+            await repo.submit([bad]),
+            await repo.submit([make_bar(60_000)]),
+        ]
+        results = await asyncio.gather(*futs, return_exceptions=True)
+        assert results[0] is None and results[2] is None
+        assert isinstance(results[1], Exception)
+        assert repo._writer.commits == 2
+
+        # the writer connection is usable afterwards
+        await repo.upsert([make_bar(120_000)])
+        rows = await repo.query("BTCUSDT", Interval.m1, None, None, 10)
+        assert [b.open_time for b in rows] == [0, 60_000, 120_000]
+        assert await repo.query("ETHUSDT", Interval.m1, None, None, 10) == []
+        await repo.close()
+
+    asyncio.run(run())